@@ -1,15 +1,31 @@
+import gzip
 import os
+import tempfile
+import time
 from dotenv import find_dotenv, load_dotenv
+import altair as alt
 import pandas as pd
 import streamlit as st
 
+from token_world.llm.xplore.archive import (
+    GZIP_COMPRESSLEVEL,
+    ArchiveError,
+    decompress_if_gzipped,
+    export_storyline,
+    import_storyline,
+)
 from token_world.llm.xplore.db import (
-    MessageModel,
-    SummaryModel,
+    clear_conversation,
+    clear_summaries,
     get_all_tables,
-    session_scope,
+    wipe_db,
 )
+from token_world.llm.xplore.llm import llm_client_stats
+from token_world.llm.xplore.message_cache import invalidate_parsed_messages
+from token_world.llm.xplore.prompt_cache import prompt_prefix_stats
+from token_world.llm.xplore.response_cache import get_response_cache
 from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.telemetry import prometheus_metrics, recent_turns
 
 
 @st.cache_data
@@ -19,30 +35,28 @@ def environment_variables():
 
 
 def admin_panel():
-    col1, col2, col3, _ = st.columns([1, 1, 1, 1])
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
     with col1:
         if st.button("💀 Wipe DB"):
-            os.remove("chat_history.db")
+            wipe_db()
             st.rerun()
 
     with col2:
         if st.button("🧹 Clear Conversation"):
             st.session_state["messages"] = []
-            with session_scope() as session:
-                session.query(MessageModel).where(
-                    MessageModel.storyline_name == get_active_storyline()
-                ).delete()
-                session.commit()
-                st.rerun()
+            clear_conversation(get_active_storyline())
+            invalidate_parsed_messages(get_active_storyline())
+            st.rerun()
 
     with col3:
         if st.button("🧹 Clear Summaries"):
-            with session_scope() as session:
-                session.query(SummaryModel).where(
-                    SummaryModel.storyline_name == get_active_storyline()
-                ).delete()
-                session.commit()
-                st.rerun()
+            clear_summaries(get_active_storyline())
+            st.rerun()
+
+    with col4:
+        if st.button("🧹 Clear LLM Cache") and (cache := get_response_cache()):
+            cache.clear()
+            st.rerun()
 
     st.subheader("Environment Variables")
     if st.button("🔁 Refresh"):
@@ -51,5 +65,143 @@ def admin_panel():
 
     st.dataframe(os.environ.items(), width=1000, height=200)
 
+    st.subheader("LLM Connections")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                (
+                    stats.base_url,
+                    stats.model,
+                    stats.requests,
+                    stats.connections_opened,
+                    stats.connections_reused,
+                )
+                for stats in llm_client_stats()
+            ],
+            columns=["Base URL", "Model", "Requests", "Connections Opened", "Connections Reused"],
+        )
+    )
+
+    st.subheader("Prompt Caching")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                (
+                    stats.model,
+                    stats.prompt_tokens,
+                    stats.cached_prompt_tokens,
+                    f"{stats.prompt_cache_hit_ratio:.0%}",
+                )
+                for stats in llm_client_stats()
+            ],
+            columns=["Model", "Prompt Tokens", "Cached Prompt Tokens", "Cache Hit Ratio"],
+        )
+    )
+    st.dataframe(
+        pd.DataFrame(
+            [
+                (stats.agent_name, stats.calls, f"{stats.stable_prefix_ratio:.0%}")
+                for stats in prompt_prefix_stats()
+            ],
+            columns=["Agent", "Calls", "Stable Prefix"],
+        )
+    )
+
+    turn_waterfall()
+
+    storyline_archive()
+
     tables = get_all_tables()
     st.dataframe(pd.DataFrame(tables, columns=["Table Name", "SQL"]))
+
+
+def storyline_archive():
+    st.subheader("Storyline Archive")
+    storyline_name = get_active_storyline()
+    if st.button("📦 Export Storyline"):
+        # Spool the archive to disk rather than memory, histories can be large.
+        archive = tempfile.TemporaryFile()
+        with gzip.GzipFile(
+            fileobj=archive, mode="wb", compresslevel=GZIP_COMPRESSLEVEL
+        ) as file:
+            export_storyline(storyline_name, file)
+        archive.seek(0)
+        st.download_button(
+            "⬇️ Download Archive",
+            data=archive,
+            file_name=f"{storyline_name}.ndjson.gz",
+            mime="application/gzip",
+        )
+
+    uploaded_archive = st.file_uploader("Storyline archive", type=["gz", "ndjson"])
+    replace = st.checkbox("Replace the storyline if it exists")
+    if uploaded_archive and st.button("📥 Import Storyline"):
+        try:
+            imported_name = import_storyline(decompress_if_gzipped(uploaded_archive), None, replace)
+        except ArchiveError as e:
+            st.error(str(e))
+        else:
+            invalidate_parsed_messages(imported_name)
+            st.success(f"Imported storyline '{imported_name}'.")
+
+
+def turn_waterfall():
+    st.subheader("Turn Waterfall")
+    turns = recent_turns()
+    if not turns:
+        st.info("No turns traced yet.")
+    else:
+        turn = st.selectbox(
+            "Turn",
+            turns,
+            format_func=lambda turn: (
+                f"{time.strftime('%H:%M:%S', time.localtime(turn.started_at))} "
+                f"{turn.storyline_name} ({turn.spans[0].duration * 1000:.0f} ms)"
+            ),
+        )
+        spans = pd.DataFrame(
+            [
+                {
+                    "Span": span.name,
+                    "Kind": span.kind,
+                    "Start (ms)": round((span.start - turn.start) * 1000, 1),
+                    "End (ms)": round((span.end - turn.start) * 1000, 1),
+                    "Duration (ms)": round(span.duration * 1000, 1),
+                    "TTFT (ms)": round(span.ttft * 1000, 1) if span.ttft is not None else None,
+                    "Prompt Tokens": span.prompt_tokens,
+                    "Completion Tokens": span.completion_tokens,
+                    "Queries": span.queries,
+                    "Thread": span.thread,
+                    "Error": span.error,
+                    "Cancelled": span.cancelled,
+                }
+                for span in turn.spans
+            ]
+        )
+        # One row per span in start order, as spans of the same name repeat within a turn.
+        spans["Row"] = [f"{i:02} {name}" for i, name in enumerate(spans["Span"])]
+        chart = (
+            alt.Chart(spans)
+            .mark_bar()
+            .encode(
+                x=alt.X("Start (ms):Q", title="ms since the turn started"),
+                x2="End (ms):Q",
+                y=alt.Y("Row:N", sort=None, title=None),
+                color="Kind:N",
+                tooltip=[column for column in spans.columns if column != "Row"],
+            )
+        )
+        st.altair_chart(chart)
+        if turn.speculative_hit is not None:
+            st.caption(
+                f"Speculative response kept, {turn.speculation_saved * 1000:.0f} ms ahead."
+                if turn.speculative_hit
+                else "Speculative response restarted, as the classifiers changed the state."
+            )
+        st.dataframe(spans.drop(columns="Row"))
+    st.download_button(
+        "⬇️ Prometheus Metrics",
+        data=prometheus_metrics(),
+        file_name="xplore_metrics.txt",
+        mime="text/plain",
+    )
@@ -0,0 +1,119 @@
+import json
+import logging
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Iterator, Optional
+
+# Whitespace and an optional Markdown code fence between a marker and its JSON answer.
+JSON_ANSWER_PREFIX = re.compile(r"\s*(?:```(?:json)?\s*)?")
+
+
+class AnswerParser(ABC):
+    """Finds the answer that follows a marker in a streamed response, as soon as it is complete.
+
+    Agents reason step by step and end with a marker such as ``GOAL CLASSIFICATIONS:`` followed
+    by their answer. Feed the chunks as they arrive and stop streaming once ``feed`` returns True.
+    A marker the agent merely mentions in its reasoning, with no answer after it, is skipped.
+    """
+
+    def __init__(self, marker: str):
+        self.marker = marker
+        self.text = ""
+        self.value: Any = None
+        self.complete = False
+        self._marker_positions: list[int] = []
+        self._search_from = 0
+
+    @abstractmethod
+    def parse_answer(self, text: str) -> Any:
+        """Return the answer at the start of the text, None if it is incomplete so far, or raise
+        ValueError if the text is not an answer."""
+
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk of the response and return whether the answer is complete."""
+        if self.complete:
+            return True
+        self.text += chunk
+        while (position := self.text.find(self.marker, self._search_from)) != -1:
+            self._marker_positions.append(position + len(self.marker))
+            self._search_from = position + 1
+        self._search_from = max(self._search_from, len(self.text) - len(self.marker) + 1)
+        for position in list(self._marker_positions):
+            try:
+                value = self.parse_answer(self.text[position:])
+            except ValueError:
+                self._marker_positions.remove(position)
+                continue
+            if value is not None:
+                self.value = value
+                self.complete = True
+                return True
+        return False
+
+    def result(self) -> Any:
+        """Return the answer, or raise ValueError if the response did not complete one."""
+        if not self.complete:
+            raise ValueError(f"The response has no complete answer after '{self.marker}'.")
+        return self.value
+
+    def parse(self, response_text: str) -> Any:
+        """Return the answer of a whole response."""
+        self.feed(response_text)
+        return self.result()
+
+
+class JsonAnswerParser(AnswerParser):
+    """Parses a JSON object after the marker, ignoring any text that follows it."""
+
+    decoder = json.JSONDecoder()
+
+    def parse_answer(self, text: str) -> Optional[dict[str, Any]]:
+        if "```json".startswith(text.lstrip()):
+            # Nothing yet, or the start of a code fence.
+            return None
+        answer = text[JSON_ANSWER_PREFIX.match(text).end() :]  # type: ignore[union-attr]
+        if not answer:
+            return None
+        if not answer.startswith("{"):
+            raise ValueError(f"No JSON object after '{self.marker}'.")
+        try:
+            value, _ = self.decoder.raw_decode(answer)
+        except json.JSONDecodeError:
+            # Most likely the object is still streaming.
+            return None
+        return value
+
+
+class ChoiceAnswerParser(AnswerParser):
+    """Parses one of a fixed set of words after the marker, such as INCOMPLETE or COMPLETE."""
+
+    def __init__(self, marker: str, choices: tuple[str, ...]):
+        super().__init__(marker)
+        # Longest first, in case a choice is the prefix of another.
+        self.choices = sorted(choices, key=len, reverse=True)
+
+    def parse_answer(self, text: str) -> Optional[str]:
+        answer = text.lstrip(" \t\n\"'*`")
+        for choice in self.choices:
+            if answer.startswith(choice):
+                return choice
+        if not any(choice.startswith(answer) for choice in self.choices):
+            raise ValueError(f"None of {self.choices} after '{self.marker}'.")
+        return None
+
+
+def until_answer(stream: Iterator[str], parser: AnswerParser) -> Iterator[str]:
+    """Yield the chunks of a stream until the parser has the answer, then close the stream.
+
+    Closing the stream stops the LLM from generating, and billing, tokens after the answer.
+    """
+    try:
+        for chunk in stream:
+            yield chunk
+            if parser.feed(chunk):
+                logging.info(f"Closing the stream after the answer to '{parser.marker}'")
+                return
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
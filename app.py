@@ -10,6 +10,7 @@ from token_world.llm.xplore.db import (
 from token_world.llm.xplore.session_state import has_active_storyline
 from token_world.llm.xplore.sidebar import draw_sidebar
 from token_world.llm.xplore.storyline import get_active_storyline_description
+from token_world.llm.xplore.summary_worker import SummaryWorker, is_summary_worker_enabled
 
 
 def parse_args():
@@ -23,6 +24,13 @@ def parse_args():
     return parser.parse_args()
 
 
+@st.cache_resource
+def start_summary_worker() -> SummaryWorker:
+    worker = SummaryWorker()
+    worker.start()
+    return worker
+
+
 def main():
     load_dotenv()
     st.set_page_config(page_title="AI Chat App", page_icon="🤖")
@@ -34,6 +42,8 @@ def main():
 
     # Initialize database
     initialize_db()
+    if is_summary_worker_enabled():
+        start_summary_worker()
 
     st.title("🤖 RPGPT")
 
@@ -0,0 +1,232 @@
+import argparse
+import gzip
+import json
+import logging
+import sys
+from contextlib import contextmanager
+from typing import IO, Any, Iterator, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, Table, delete, func, select
+
+from token_world.llm.xplore.db import (
+    AgentGoalModel,
+    CharacterModel,
+    ClassificationModel,
+    MessageModel,
+    MessageSequenceModel,
+    MilestoneModel,
+    StorylineModel,
+    SummaryModel,
+    engine,
+    initialize_db,
+)
+
+ARCHIVE_FORMAT = "xplore-storyline"
+ARCHIVE_VERSION = 1
+# Rows fetched from the database and inserted into it at a time.
+BATCH_SIZE = 1000
+GZIP_MAGIC = b"\x1f\x8b"
+# gzip's default level 9 costs several times the CPU of level 6 for a barely smaller archive.
+GZIP_COMPRESSLEVEL = 6
+
+# The tables of a storyline in the order they are archived, and the column naming the storyline.
+STORYLINE_TABLES: list[tuple[Table, str]] = [
+    (StorylineModel.__table__, "name"),
+    (CharacterModel.__table__, "storyline_name"),
+    (MilestoneModel.__table__, "storyline_name"),
+    (AgentGoalModel.__table__, "storyline_name"),
+    (MessageModel.__table__, "storyline_name"),
+    (SummaryModel.__table__, "storyline_name"),
+]
+TABLES_BY_NAME = {table.name: (table, column) for table, column in STORYLINE_TABLES}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def iter_storyline_records(connection: Connection, storyline_name: str) -> Iterator[dict]:
+    """Yield the archive records of a storyline, a header followed by one record per row.
+
+    Rows are streamed from the database in batches, so memory use does not depend on its size.
+    """
+    yield {"type": "header", "format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION}
+    for table, storyline_column in STORYLINE_TABLES:
+        statement = (
+            select(table)
+            .where(table.c[storyline_column] == storyline_name)
+            .order_by(*table.primary_key.columns)
+        )
+        result = connection.execution_options(yield_per=BATCH_SIZE).execute(statement)
+        for row in result.mappings():
+            yield {"type": table.name, "row": dict(row)}
+
+
+def export_storyline(storyline_name: str, file: IO[bytes]) -> int:
+    """Write a storyline to the file as NDJSON and return the number of rows written."""
+    n_rows = 0
+    lines = []
+    with engine.connect() as connection:
+        for record in iter_storyline_records(connection, storyline_name):
+            lines.append(json.dumps(record, ensure_ascii=False).encode() + b"\n")
+            n_rows += record["type"] != "header"
+            if len(lines) >= BATCH_SIZE:
+                file.write(b"".join(lines))
+                lines.clear()
+    file.write(b"".join(lines))
+    if n_rows == 0:
+        raise ArchiveError(f"Storyline '{storyline_name}' does not exist.")
+    logging.info(f"Exported {n_rows} rows of storyline '{storyline_name}'")
+    return n_rows
+
+
+def read_records(file: IO[bytes]) -> Iterator[dict]:
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ArchiveError(f"Line {line_number} of the archive is not valid JSON: {e}")
+
+
+def delete_storyline_rows(connection: Connection, storyline_name: str):
+    for table, storyline_column in [
+        *STORYLINE_TABLES,
+        (MessageSequenceModel.__table__, "storyline_name"),
+        (ClassificationModel.__table__, "storyline_name"),
+    ]:
+        connection.execute(delete(table).where(table.c[storyline_column] == storyline_name))
+
+
+def import_storyline(
+    file: IO[bytes], storyline_name: Optional[str] = None, replace: bool = False
+) -> str:
+    """Import an exported storyline in one transaction and return its name.
+
+    The storyline keeps its archived name unless ``storyline_name`` is given. Importing over an
+    existing storyline fails unless ``replace`` is set, which deletes the existing one first.
+    Rows are inserted in batches, so memory use does not depend on the size of the archive.
+    """
+    records = read_records(file)
+    header = next(records, None)
+    if not header or header.get("format") != ARCHIVE_FORMAT:
+        raise ArchiveError("The file is not a storyline archive.")
+    if header.get("version") != ARCHIVE_VERSION:
+        raise ArchiveError(f"Unsupported storyline archive version {header.get('version')}.")
+
+    with engine.begin() as connection:
+        batch: list[dict[str, Any]] = []
+        batch_table: Optional[Table] = None
+        max_message_id = 0
+        counts: dict[str, int] = {}
+
+        def flush():
+            if batch_table is not None and batch:
+                connection.execute(batch_table.insert(), batch)
+                counts[batch_table.name] = counts.get(batch_table.name, 0) + len(batch)
+                batch.clear()
+
+        for record in records:
+            if record.get("type") not in TABLES_BY_NAME:
+                raise ArchiveError(f"Unknown record type {record.get('type')!r} in the archive.")
+            table, storyline_column = TABLES_BY_NAME[record["type"]]
+            row = record["row"]
+            if table is StorylineModel.__table__:
+                storyline_name = storyline_name or row["name"]
+                exists = connection.execute(
+                    select(func.count()).where(table.c.name == storyline_name)
+                ).scalar_one()
+                if exists and not replace:
+                    raise ArchiveError(f"Storyline '{storyline_name}' already exists.")
+                delete_storyline_rows(connection, storyline_name)
+            elif storyline_name is None:
+                raise ArchiveError("The archive does not start with its storyline.")
+            if table is not batch_table or len(batch) >= BATCH_SIZE:
+                flush()
+                batch_table = table
+            batch.append({**row, storyline_column: storyline_name})
+            if table is MessageModel.__table__:
+                max_message_id = max(max_message_id, row["id"])
+        flush()
+        if storyline_name is None:
+            raise ArchiveError("The archive does not contain a storyline.")
+
+        # Continue message ids after the imported ones.
+        connection.execute(
+            MessageSequenceModel.__table__.insert().values(
+                storyline_name=storyline_name, last_id=max_message_id
+            )
+        )
+    logging.info(f"Imported storyline '{storyline_name}': {counts}")
+    return storyline_name
+
+
+def decompress_if_gzipped(raw: IO[bytes]) -> IO[bytes]:
+    """Return a reader of the archive that decompresses it if it is gzipped."""
+    if hasattr(raw, "peek"):
+        magic = raw.peek(2)[:2]
+    else:
+        magic = raw.read(2)
+        raw.seek(0)
+    return gzip.GzipFile(fileobj=raw, mode="rb") if magic == GZIP_MAGIC else raw
+
+
+@contextmanager
+def open_archive(path: str, mode: str) -> Iterator[IO[bytes]]:
+    """Open an archive file, "-" for stdin/stdout, gzipped if it is (or is named) .gz."""
+    if mode == "rb":
+        raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+        file = decompress_if_gzipped(raw)
+    else:
+        raw = sys.stdout.buffer if path == "-" else open(path, "wb")
+        file = (
+            gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_COMPRESSLEVEL)
+            if path.endswith(".gz")
+            else raw
+        )
+    try:
+        yield file
+    finally:
+        if file is not raw:
+            file.close()
+        if path != "-":
+            raw.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export and import whole storylines.")
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export a storyline as NDJSON.")
+    export_parser.add_argument("storyline", help="Name of the storyline to export.")
+    export_parser.add_argument(
+        "-o", "--output", default="-", help="Output file, gzipped if it ends in .gz."
+    )
+    import_parser = subparsers.add_parser("import", help="Import an exported storyline.")
+    import_parser.add_argument("input", help="Archive to import, gzipped or not, - for stdin.")
+    import_parser.add_argument("--as", dest="name", help="Import under a different name.")
+    import_parser.add_argument(
+        "--replace", action="store_true", help="Replace the storyline if it already exists."
+    )
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    initialize_db()
+    if args.command == "export":
+        with open_archive(args.output, "wb") as file:
+            export_storyline(args.storyline, file)
+    else:
+        with open_archive(args.input, "rb") as file:
+            import_storyline(file, args.name, args.replace)
+
+
+if __name__ == "__main__":
+    main()
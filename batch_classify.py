@@ -0,0 +1,531 @@
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from swarm import Agent  # type: ignore[import]
+from token_world.llm.stream_processing import MessageStream, ToolStream, parse_streaming_response
+from token_world.llm.xplore.answer_parser import ChoiceAnswerParser, JsonAnswerParser
+from token_world.llm.xplore.classifier_tools import ToolCall, use_classifier_tools
+from token_world.llm.xplore.conversation import get_current_messages
+from token_world.llm.xplore.db import (
+    ClassificationModel,
+    MessageModel,
+    dialect_insert,
+    initialize_db,
+    session_scope,
+)
+from token_world.llm.xplore.goal_agent import (
+    GOAL_CLASSIFICATIONS_MARKER,
+    generate_completed_goal_calls,
+    generate_completed_goals,
+)
+from token_world.llm.xplore.llm import handle_base_model_arg, llm_client
+from token_world.llm.xplore.milestone_agent import (
+    MILESTONE_CLASSIFICATION_CHOICES,
+    MILESTONE_CLASSIFICATION_MARKER,
+    generate_milestone_classification,
+    generate_milestone_classification_calls,
+)
+from token_world.llm.xplore.prompt_builder import PromptBuilder
+from token_world.llm.xplore.prompt_cache import record_prompt
+from token_world.llm.xplore.response_cache import cached_response_stream
+from token_world.llm.xplore.summarize_agent import get_summary_conversation
+from token_world.llm.xplore.telemetry import traced_stream
+from token_world.llm.xplore.turn_context import TurnContext
+
+MILESTONE = "milestone"
+GOALS = "goals"
+CLASSIFIERS = (MILESTONE, GOALS)
+BATCH_COMPLETIONS_MARKER = "BATCH COMPLETIONS:"
+# Classifications written to the database at a time.
+WRITE_BATCH_SIZE = 200
+MISSING_RESULT_ERROR = "The answer did not classify this turn."
+CURRENT_STATE_NOTE = (
+    "Turns are scored against the current goals and milestone of their storyline, "
+    "not those it had when the turn was played."
+)
+
+SYSTEM_PROMPT = (
+    "You are an intelligent agent that reviews the turns of a roleplaying game. "
+    "You decide which milestones and goals of the main AI in the game each turn completed."
+)
+
+
+class ClassificationJob(NamedTuple):
+    storyline_name: str
+    # Id of the user message that ends the turn.
+    message_id: int
+
+
+class TurnInput(NamedTuple):
+    job: ClassificationJob
+    summary_context: str
+    ai_prompt: str
+    user_prompt: str
+
+
+def find_jobs(storyline_names: list[str]) -> list[ClassificationJob]:
+    """Return a job for every user message of the storylines that replies to the AI."""
+    jobs = []
+    with session_scope("find_jobs") as session:
+        for storyline_name in storyline_names:
+            rows = (
+                session.query(MessageModel.id, MessageModel.role)
+                .where(MessageModel.storyline_name == storyline_name)
+                .order_by(MessageModel.id)
+                .all()
+            )
+            jobs += [
+                ClassificationJob(storyline_name, message_id)
+                for (_, previous_role), (message_id, role) in zip(rows, rows[1:])
+                if previous_role == "assistant" and role == "user"
+            ]
+    return jobs
+
+
+def find_failed_jobs(model: str) -> list[ClassificationJob]:
+    """Return the turns with a classification by the model that failed, to classify again."""
+    with session_scope("find_failed_jobs") as session:
+        rows = (
+            session.query(ClassificationModel.storyline_name, ClassificationModel.message_id)
+            .where(ClassificationModel.model == model)
+            .where(ClassificationModel.result.is_(None))
+            .distinct()
+            .all()
+        )
+    return [
+        ClassificationJob(str(storyline_name), int(message_id))
+        for storyline_name, message_id in rows
+    ]
+
+
+def read_jobs(path: str) -> list[ClassificationJob]:
+    """Read jobs from JSONL lines of {"storyline_name": ..., "message_id": ...}."""
+    with open(path) as file:
+        return [
+            ClassificationJob(record["storyline_name"], int(record["message_id"]))
+            for record in map(json.loads, file)
+        ]
+
+
+def load_turn_inputs(storyline_name: str, jobs: list[ClassificationJob]) -> list[TurnInput]:
+    """Load the recent messages and summary context of the turns, in a single session.
+
+    Only summaries that already exist are used, nothing is summarized.
+    """
+    inputs = []
+    with session_scope("load_turn_inputs") as session:
+        for job in jobs:
+            message = session.get(MessageModel, (storyline_name, job.message_id))
+            if message is None:
+                logging.warning(f"Message {job.message_id} of '{storyline_name}' not found.")
+                continue
+            conversation = get_summary_conversation(
+                session, latest_message=message, max_messages=2, storyline_name=storyline_name
+            )
+            current_messages = get_current_messages(conversation)
+            if not current_messages or current_messages.ai is None:
+                logging.warning(f"Message {job.message_id} of '{storyline_name}' ends no turn.")
+                continue
+            inputs.append(
+                TurnInput(
+                    job,
+                    conversation.summary_context,
+                    current_messages.ai.content_val,
+                    current_messages.user.content_val,
+                )
+            )
+    return inputs
+
+
+def classifiable(context: TurnContext, classifiers: tuple[str, ...]) -> tuple[str, ...]:
+    """Drop the classifiers with nothing left to classify in the storyline."""
+    remaining = {
+        MILESTONE: context.active_milestone is not None,
+        GOALS: bool(classified_goals(context)),
+    }
+    return tuple(classifier for classifier in classifiers if remaining[classifier])
+
+
+def classified_goals(context: TurnContext) -> list[str]:
+    # Like the turn's goal completion classifier, which never completes Forever goals.
+    return [goal.name for goal in context.goals if goal.persistence != "Forever"]
+
+
+def classify_turn(
+    context: TurnContext, turn: TurnInput, classifier: str, model: str
+) -> dict[str, str]:
+    """Classify one turn with the agent a live turn uses, without applying the result."""
+    if classifier == MILESTONE:
+        milestone_name = context.active_milestone.name  # type: ignore[union-attr]
+        if use_classifier_tools():
+            calls: list[ToolCall] = []
+            for _ in generate_milestone_classification_calls(
+                context, turn.summary_context, turn.ai_prompt, turn.user_prompt, calls, model
+            ):
+                pass
+            completed = any(call.name == "mark_milestone_completed" for call in calls)
+            return {milestone_name: "COMPLETE" if completed else "INCOMPLETE"}
+        response_text = "".join(
+            generate_milestone_classification(
+                context, turn.summary_context, turn.ai_prompt, turn.user_prompt, model
+            )
+        )
+        status = ChoiceAnswerParser(
+            MILESTONE_CLASSIFICATION_MARKER, MILESTONE_CLASSIFICATION_CHOICES
+        ).parse(response_text)
+        return {milestone_name: status}
+
+    if use_classifier_tools():
+        calls = []
+        for _ in generate_completed_goal_calls(
+            context, turn.summary_context, turn.ai_prompt, turn.user_prompt, calls, model
+        ):
+            pass
+        completed_goals = {
+            str(call.arguments.get("goal_name", ""))
+            for call in calls
+            if call.name == "mark_goal_completed"
+        }
+        return {
+            **{goal_name: "INCOMPLETE" for goal_name in classified_goals(context)},
+            **{goal_name: "COMPLETE" for goal_name in completed_goals},
+        }
+    response_text = "".join(
+        generate_completed_goals(
+            context, turn.summary_context, turn.ai_prompt, turn.user_prompt, model
+        )
+    )
+    return {
+        **{goal_name: "INCOMPLETE" for goal_name in classified_goals(context)},
+        **JsonAnswerParser(GOAL_CLASSIFICATIONS_MARKER).parse(response_text),
+    }
+
+
+@traced_stream("generate_batch_completions")
+def generate_batch_completions(
+    context: TurnContext,
+    turns: list[TurnInput],
+    classifiers: tuple[str, ...],
+    model: Optional[str] = None,
+) -> Iterator[str]:
+    """Classify several consecutive turns of a storyline in one request.
+
+    The answer lists what each turn completed, as an empty object for the many turns that
+    complete nothing, so that they cost few completion tokens but a turn left out is detectable.
+    """
+    model = handle_base_model_arg(model)
+    try:
+        things = " and ".join(
+            {MILESTONE: "the milestone", GOALS: "which of the goals"}[classifier]
+            for classifier in classifiers
+        )
+        answer_fields = ", ".join(
+            {
+                MILESTONE: '"milestone": "COMPLETE"',
+                GOALS: '"goals": ["goal name 1", "goal name 2", ...]',
+            }[classifier]
+            for classifier in classifiers
+        )
+
+        def render(storyline: str, summary: str, state: str, transcripts: str) -> str:
+            return f"""You will be given the overall storyline of the game, a summary of the
+ conversation before the turns to review, the current state of the AI character and several turns
+ of the conversation, each an AI message followed by the reply of the user.
+For each turn on its own, determine if the AI message of that turn satisfies {things}.
+Be conservative and look for clear evidence in the turn before marking anything as COMPLETE.
+Keep your reasoning to one sentence per turn, then end with your answer in the format:
+
+{BATCH_COMPLETIONS_MARKER} {{"<turn id>": {{{answer_fields}}}, "<turn id>": {{}}, ...}}
+
+List every turn by its id, with only what it completed, or {{}} if it completed nothing.
+The answer must be valid JSON, and '{BATCH_COMPLETIONS_MARKER}' is case sensitive.
+
+## Storyline
+{storyline}
+
+## Summary
+{summary}
+
+{state}
+
+{transcripts}
+"""
+
+        state_sections = []
+        if MILESTONE in classifiers:
+            milestone = context.active_milestone
+            state_sections.append(
+                f"## Current Milestone\n{milestone.name}: {milestone.description}"  # type: ignore
+            )
+        if GOALS in classifiers:
+            goals = [goal for goal in context.goals if goal.persistence != "Forever"]
+            state_sections.append(
+                "## Current Goals\n"
+                + "\n".join(f"- {goal.name}: {goal.description}" for goal in goals)
+            )
+
+        # Fill the prompt by priority: instructions, state, turns, storyline and then summary.
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", ""))
+        state = builder.fit("state", "\n\n".join(state_sections))
+        transcripts = "\n\n".join(
+            builder.fit(
+                "turns",
+                f"## Turn {turn.job.message_id}\n"
+                f"AI: {turn.ai_prompt}\n---\nUser: {turn.user_prompt}",
+            )
+            for turn in turns
+        )
+        storyline = builder.fit("storyline", context.storyline_description)
+        # The summary of the conversation before the first turn of the batch.
+        summary = builder.fit("summary", turns[0].summary_context or "<No summary yet.>")
+        builder.log_usage("Batch Completion Classifier")
+        messages = [
+            {"role": "user", "content": render(storyline, summary, state, transcripts)},
+        ]
+
+        agent = Agent(
+            name="Batch Completion Classifier",
+            model=model,
+            instructions=SYSTEM_PROMPT,
+            stream=True,
+        )
+
+        def stream_response() -> Iterator[str]:
+            record_prompt(agent.name, agent.instructions, messages)
+            chunks = llm_client(model).run(agent, messages, stream=True)
+            for chunk in parse_streaming_response(chunks):
+                if isinstance(chunk, MessageStream):
+                    for content in chunk.content_stream:
+                        yield content
+                elif isinstance(chunk, ToolStream):
+                    logging.info(f"Tool Use: {chunk}")
+
+        yield from cached_response_stream(
+            model,
+            agent,
+            messages,
+            stream_response,
+            answer=JsonAnswerParser(BATCH_COMPLETIONS_MARKER),
+        )
+    except Exception as e:
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+def classify_turns(
+    context: TurnContext, turns: list[TurnInput], classifiers: tuple[str, ...], model: str
+) -> dict[tuple[int, str], dict[str, str]]:
+    """Classify the turns in one request, returning the results by (message id, classifier).
+
+    Turns the answer left out get no result, so that they are written as errors and retried.
+    """
+    response_text = "".join(generate_batch_completions(context, turns, classifiers, model))
+    completions = JsonAnswerParser(BATCH_COMPLETIONS_MARKER).parse(response_text)
+    results = {}
+    for turn in turns:
+        if str(turn.job.message_id) not in completions:
+            logging.warning(f"The answer left out turn {turn.job.message_id}")
+            continue
+        completed = completions[str(turn.job.message_id)] or {}
+        if MILESTONE in classifiers:
+            milestone_name = context.active_milestone.name  # type: ignore[union-attr]
+            status = "COMPLETE" if completed.get(MILESTONE) == "COMPLETE" else "INCOMPLETE"
+            results[(turn.job.message_id, MILESTONE)] = {milestone_name: status}
+        if GOALS in classifiers:
+            results[(turn.job.message_id, GOALS)] = {
+                **{goal_name: "INCOMPLETE" for goal_name in classified_goals(context)},
+                **{str(goal_name): "COMPLETE" for goal_name in completed.get(GOALS, [])},
+            }
+    return results
+
+
+def classification_row(
+    job: ClassificationJob,
+    classifier: str,
+    model: str,
+    result: Optional[dict[str, str]] = None,
+    error: Optional[str] = None,
+) -> dict[str, Any]:
+    return {
+        "storyline_name": job.storyline_name,
+        "message_id": job.message_id,
+        "classifier": classifier,
+        "model": model,
+        "result": json.dumps(result) if result is not None else None,
+        "error": error,
+        "created_at": time.time(),
+    }
+
+
+def write_classifications(rows: list[dict[str, Any]]):
+    """Insert the classifications in one statement, replacing those of an earlier run."""
+    if not rows:
+        return
+    with session_scope("write_classifications") as session:
+        statement = dialect_insert(session, ClassificationModel)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["storyline_name", "message_id", "classifier", "model"],
+                set_={
+                    "result": statement.excluded.result,
+                    "error": statement.excluded.error,
+                    "created_at": statement.excluded.created_at,
+                },
+            ),
+            rows,
+        )
+
+
+def run_batch(
+    jobs: list[ClassificationJob],
+    classifiers: tuple[str, ...] = CLASSIFIERS,
+    concurrency: int = 8,
+    pack: int = 1,
+    model: Optional[str] = None,
+) -> dict[str, Any]:
+    """Classify the turns of the jobs and write the results, returning statistics of the run.
+
+    Turns are classified against the current goals and milestone of their storyline, and the
+    results only go to the classifications table, so the storylines themselves are unchanged.
+    With ``pack`` above 1, that many consecutive turns of a storyline share one LLM request.
+    """
+    model = handle_base_model_arg(model)
+    logging.warning(CURRENT_STATE_NOTE)
+    start = time.perf_counter()
+    tasks: list[tuple[list[ClassificationJob], tuple[str, ...], Callable[[], Any]]] = []
+    for storyline_name, storyline_jobs in groupby(
+        sorted(set(jobs)), key=lambda job: job.storyline_name
+    ):
+        context = TurnContext(storyline_name)
+        storyline_classifiers = classifiable(context, classifiers)
+        if not storyline_classifiers:
+            logging.info(f"'{storyline_name}' has no milestone or goals left to classify.")
+            continue
+        turns = load_turn_inputs(storyline_name, list(storyline_jobs))
+        if pack > 1:
+            for i in range(0, len(turns), pack):
+                batch = turns[i : i + pack]
+                tasks.append(
+                    (
+                        [turn.job for turn in batch],
+                        storyline_classifiers,
+                        lambda context=context, batch=batch, classifiers=storyline_classifiers: (
+                            classify_turns(context, batch, classifiers, model)
+                        ),
+                    )
+                )
+        else:
+            tasks += [
+                (
+                    [turn.job],
+                    (classifier,),
+                    lambda context=context, turn=turn, classifier=classifier: {
+                        (turn.job.message_id, classifier): classify_turn(
+                            context, turn, classifier, model
+                        )
+                    },
+                )
+                for turn in turns
+                for classifier in storyline_classifiers
+            ]
+    logging.info(f"Classifying {len(jobs)} turns in {len(tasks)} requests")
+
+    rows: list[dict[str, Any]] = []
+    n_rows = n_errors = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="classify") as executor:
+        futures = {
+            executor.submit(task): (task_jobs, task_classifiers)
+            for task_jobs, task_classifiers, task in tasks
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            task_jobs, task_classifiers = futures[future]
+            try:
+                results = future.result()
+                error = None
+            except Exception as e:
+                logging.error(f"Classifying {task_jobs} failed: {e}", exc_info=True)
+                results, error = {}, repr(e)
+            for job in task_jobs:
+                for classifier in task_classifiers:
+                    result = results.get((job.message_id, classifier))
+                    if result is None:
+                        rows.append(
+                            classification_row(
+                                job, classifier, model, error=error or MISSING_RESULT_ERROR
+                            )
+                        )
+                    else:
+                        rows.append(classification_row(job, classifier, model, result))
+            if len(rows) >= WRITE_BATCH_SIZE or i == len(futures):
+                n_rows += len(rows)
+                n_errors += sum(row["result"] is None for row in rows)
+                write_classifications(rows)
+                rows = []
+                logging.info(f"Finished {i}/{len(futures)} requests, wrote {n_rows} results")
+
+    elapsed = time.perf_counter() - start
+    return {
+        "turns": len(set(jobs)),
+        "requests": len(tasks),
+        "results": n_rows,
+        "errors": n_errors,
+        "seconds": elapsed,
+        "turns_per_second": len(set(jobs)) / elapsed if elapsed else 0.0,
+        "note": CURRENT_STATE_NOTE,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-score the goal and milestone classifications of past turns in bulk.",
+        epilog=CURRENT_STATE_NOTE,
+    )
+    parser.add_argument(
+        "--storylines", nargs="+", default=[], help="Classify every turn of these storylines."
+    )
+    parser.add_argument(
+        "--jobs", help='JSONL file of turns to classify, {"storyline_name", "message_id"} each.'
+    )
+    parser.add_argument(
+        "--classifiers", nargs="+", choices=CLASSIFIERS, default=list(CLASSIFIERS)
+    )
+    parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="Also classify again the turns whose classification by the model failed.",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once.")
+    parser.add_argument(
+        "--pack", type=int, default=1, help="Turns of a storyline to classify per request."
+    )
+    parser.add_argument("--model", help="Model to classify with, the base model by default.")
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    initialize_db()
+    jobs = find_jobs(args.storylines)
+    if args.jobs:
+        jobs += read_jobs(args.jobs)
+    if args.retry_errors:
+        jobs += find_failed_jobs(handle_base_model_arg(args.model))
+    stats = run_batch(jobs, tuple(args.classifiers), args.concurrency, args.pack, args.model)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
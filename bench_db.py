@@ -0,0 +1,168 @@
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from threading import Barrier, Lock, Thread
+from typing import NamedTuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from token_world.llm.xplore.db import (
+    SQLITE_PRAGMAS,
+    Base,
+    add_message_to_db,
+    add_messages_to_db,
+    create_db_engine,
+)
+
+STORYLINE_NAME = "bench"
+
+
+class WriterResults:
+    def __init__(self):
+        self.lock = Lock()
+        self.commit_latencies: list[float] = []
+        self.n_messages = 0
+        self.n_failures = 0
+
+    def record(self, latency: float, n_messages: int):
+        with self.lock:
+            self.commit_latencies.append(latency)
+            self.n_messages += n_messages
+
+    def record_failure(self):
+        with self.lock:
+            self.n_failures += 1
+
+
+class StressTestReport(NamedTuple):
+    elapsed: float
+    n_messages: int
+    n_failures: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+
+def write_messages(
+    session_factory,
+    barrier: Barrier,
+    results: WriterResults,
+    writer: int,
+    n_messages: int,
+    batch_size: int,
+):
+    """Append ``n_messages`` to the shared storyline, one transaction per batch."""
+    barrier.wait()
+    for start in range(0, n_messages, batch_size):
+        messages = [
+            {"role": "user", "content": f"writer {writer} message {i}"}
+            for i in range(start, min(start + batch_size, n_messages))
+        ]
+        transaction_start = time.perf_counter()
+        try:
+            with session_factory.begin() as session:
+                if len(messages) == 1:
+                    add_message_to_db(messages[0], session, STORYLINE_NAME)
+                else:
+                    add_messages_to_db(messages, session, STORYLINE_NAME)
+        except OperationalError as e:
+            logging.warning(f"Writer {writer} failed to commit: {e}")
+            results.record_failure()
+            continue
+        results.record(time.perf_counter() - transaction_start, len(messages))
+
+
+def run_stress_test(
+    db_path: str, n_writers: int, n_messages: int, batch_size: int, tuned: bool = True
+) -> StressTestReport:
+    """Run concurrent writers against a fresh database and measure their commits.
+
+    That the allocated ids are unique and contiguous is checked by tests/test_message_ids.py.
+    """
+    engine = create_db_engine(f"sqlite:///{db_path}", SQLITE_PRAGMAS if tuned else {})
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    barrier = Barrier(n_writers)
+    results = WriterResults()
+    writers = [
+        Thread(
+            target=write_messages,
+            args=(session_factory, barrier, results, writer, n_messages, batch_size),
+        )
+        for writer in range(n_writers)
+    ]
+    start = time.perf_counter()
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    elapsed = time.perf_counter() - start
+
+    engine.dispose()
+
+    latencies = sorted(latency * 1000 for latency in results.commit_latencies) or [0.0]
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return StressTestReport(
+        elapsed,
+        results.n_messages,
+        results.n_failures,
+        quantiles[49],
+        quantiles[94],
+        quantiles[98],
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the commit latency of concurrent message writers on one storyline."
+    )
+    parser.add_argument(
+        "--writers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="Numbers of concurrent writers to measure.",
+    )
+    parser.add_argument("--messages", type=int, default=200, help="Messages per writer.")
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="Messages appended per transaction."
+    )
+    parser.add_argument(
+        "--untuned",
+        action="store_true",
+        help="Also measure SQLite with its default pragmas for comparison.",
+    )
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    modes = [True, False] if args.untuned else [True]
+    print("pragmas  writers  messages  failures  msgs/s  p50 ms  p95 ms  p99 ms")
+    for tuned in modes:
+        for n_writers in args.writers:
+            with tempfile.TemporaryDirectory() as directory:
+                report = run_stress_test(
+                    os.path.join(directory, "bench.db"),
+                    n_writers,
+                    args.messages,
+                    args.batch_size,
+                    tuned,
+                )
+            print(
+                f"{'tuned' if tuned else 'default':<8} {n_writers:>7} {report.n_messages:>9} "
+                f"{report.n_failures:>9} {report.n_messages / report.elapsed:>7.0f} "
+                f"{report.p50_ms:>7.2f} {report.p95_ms:>7.2f} {report.p99_ms:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
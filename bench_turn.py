@@ -0,0 +1,404 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from itertools import product
+from typing import Any
+
+from sqlalchemy import insert
+
+from token_world.llm.xplore.archive import delete_storyline_rows
+from token_world.llm.xplore.db import (
+    AgentGoalModel,
+    CharacterModel,
+    MilestoneModel,
+    StorylineModel,
+    SummaryModel,
+    add_messages_to_db,
+    engine,
+    get_query_count,
+    initialize_db,
+    session_scope,
+)
+from token_world.llm.xplore.stub_llm import StubLLMServer
+from token_world.llm.xplore.summarize_agent import (
+    ARC,
+    CHAPTER,
+    CHAPTERS_PER_ARC,
+    CHUNK,
+    CHUNKS_PER_CHAPTER,
+)
+from token_world.llm.xplore.telemetry import recent_turns
+from token_world.llm.xplore.turn_engine import TurnEngine
+from token_world.llm.xplore.turn_events import (
+    ClassifierChunk,
+    ResponseChunk,
+    StageFinished,
+    SummaryReady,
+    TurnComplete,
+)
+
+SEED_BATCH_SIZE = 1000
+STAGES = ["summary", "classifiers", "response_ttft", "response", "db_write"]
+CLASSIFIER_MODES = {"prose": "0", "tools": "1"}
+# Whether the character response waits for the classifiers or starts alongside them.
+RESPONSE_MODES = {"sequential": "0", "speculative": "1"}
+# Traced names of the agent calls of the classifier stages, in either mode.
+CLASSIFIER_AGENTS = {
+    "generate_milestone_classification",
+    "generate_completed_goals",
+    "generate_new_goals",
+    "generate_milestone_classification_calls",
+    "generate_completed_goal_calls",
+    "generate_new_goal_calls",
+}
+
+
+def seed_storyline(storyline_name: str, n_history: int, n_goals: int, n_milestones: int):
+    """Create a storyline in the state a long-running game would reach.
+
+    Every turn summarizes the messages before the last two, so the seeded history has chunk
+    summaries every two messages, rolled up into chapters and arcs.
+    """
+    with engine.begin() as connection:
+        delete_storyline_rows(connection, storyline_name)
+    with session_scope("seed_storyline") as session:
+        session.add(
+            StorylineModel(
+                name=storyline_name,
+                description="{character_name} guides the player through a benchmark quest.",
+            )
+        )
+        session.add(CharacterModel(storyline_name=storyline_name, type="player1", name="Ada"))
+        session.add(CharacterModel(storyline_name=storyline_name, type="character1", name="Ollie"))
+        for order in range(1, n_milestones + 1):
+            session.add(
+                MilestoneModel(
+                    storyline_name=storyline_name,
+                    name=f"milestone {order}",
+                    order=order,
+                    description=f"Reach waypoint {order} of the quest.",
+                    completed=False,
+                )
+            )
+        for i in range(n_goals):
+            session.add(
+                AgentGoalModel(
+                    storyline_name=storyline_name,
+                    name=f"goal {i}",
+                    description=f"Help the player with task {i}.",
+                    completed=False,
+                    persistence="Medium",
+                )
+            )
+    for start in range(0, n_history, SEED_BATCH_SIZE):
+        with session_scope("seed_storyline") as session:
+            add_messages_to_db(
+                [
+                    {
+                        "role": "user" if i % 2 == 0 else "assistant",
+                        "content": f"Message {i} of the adventure, about the road ahead.",
+                    }
+                    for i in range(start, min(start + SEED_BATCH_SIZE, n_history))
+                ],
+                session,
+                storyline_name,
+            )
+
+    chunk_ids = list(range(2, n_history - 1, 2))
+    chapter_ids = chunk_ids[CHUNKS_PER_CHAPTER - 1 :: CHUNKS_PER_CHAPTER]
+    arc_ids = chapter_ids[CHAPTERS_PER_ARC - 1 :: CHAPTERS_PER_ARC]
+    rows = [
+        {
+            "storyline_name": storyline_name,
+            "level": level,
+            "summary_until_id": summary_until_id,
+            "content": f"Summary of the adventure until message {summary_until_id}.",
+        }
+        for level, ids in ((CHUNK, chunk_ids), (CHAPTER, chapter_ids), (ARC, arc_ids))
+        for summary_until_id in ids
+    ]
+    with engine.begin() as connection:
+        for start in range(0, len(rows), SEED_BATCH_SIZE):
+            connection.execute(insert(SummaryModel), rows[start : start + SEED_BATCH_SIZE])
+
+
+def time_turn(storyline_name: str, turn: int) -> dict[str, Any]:
+    """Play one turn and return its latency, the time spent per stage, its query count and the
+    tokens of its classifier calls."""
+    n_queries = get_query_count()
+    start = time.perf_counter()
+    marks: dict[str, float] = {}
+    classifier_ends: dict[str, float] = {}
+    for event in TurnEngine(storyline_name).run_turn(user_message=f"Benchmark turn {turn}."):
+        now = time.perf_counter() - start
+        if isinstance(event, SummaryReady):
+            marks["summary"] = now
+        elif isinstance(event, ClassifierChunk):
+            classifier_ends[event.stage] = now
+        elif isinstance(event, StageFinished):
+            marks["classifiers"] = now
+        elif isinstance(event, ResponseChunk):
+            marks.setdefault("response_ttft", now)
+            marks["response"] = now
+        elif isinstance(event, TurnComplete):
+            marks["db_write"] = now
+    total = time.perf_counter() - start
+    trace = recent_turns()[0]
+    classifier_spans = [span for span in trace.spans if span.name in CLASSIFIER_AGENTS]
+    marks.setdefault("classifiers", marks["summary"])
+    stages = {
+        "summary": marks["summary"],
+        "classifiers": marks["classifiers"] - marks["summary"],
+        "response_ttft": marks["response_ttft"] - marks["classifiers"],
+        "response": marks["response"] - marks["classifiers"],
+        "db_write": marks["db_write"] - marks["response"],
+    }
+    return {
+        "latency": total,
+        "stages": stages,
+        "classifier_streams": {
+            stage: end - marks["summary"] for stage, end in classifier_ends.items()
+        },
+        "queries": get_query_count() - n_queries,
+        "classifier_tokens": {
+            "prompt": sum(span.prompt_tokens for span in classifier_spans),
+            "completion": sum(span.completion_tokens for span in classifier_spans),
+        },
+        "speculative_hit": trace.speculative_hit,
+        "speculation_saved": trace.speculation_saved,
+    }
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Return p50, p95 and p99 in milliseconds."""
+    values_ms = sorted(value * 1000 for value in values)
+    quantiles = statistics.quantiles(values_ms, n=100) if len(values_ms) > 1 else values_ms * 99
+    return {
+        "p50": round(quantiles[49], 2),
+        "p95": round(quantiles[94], 2),
+        "p99": round(quantiles[98], 2),
+    }
+
+
+def run_benchmark(
+    n_history: int,
+    n_goals: int,
+    n_milestones: int,
+    n_turns: int,
+    n_warmup: int,
+    classifier_mode: str = "prose",
+    response_mode: str = "sequential",
+) -> dict[str, Any]:
+    os.environ["XPLORE_CLASSIFIER_TOOLS"] = CLASSIFIER_MODES[classifier_mode]
+    os.environ["XPLORE_SPECULATIVE_RESPONSE"] = RESPONSE_MODES[response_mode]
+    storyline_name = f"bench-turn-{n_history}-{n_goals}-{n_milestones}"
+    seed_start = time.perf_counter()
+    seed_storyline(storyline_name, n_history, n_goals, n_milestones)
+    logging.info(f"Seeded {storyline_name} in {time.perf_counter() - seed_start:.1f}s")
+    try:
+        for turn in range(n_warmup):
+            time_turn(storyline_name, turn)
+        turns = [time_turn(storyline_name, n_warmup + turn) for turn in range(n_turns)]
+    finally:
+        with engine.begin() as connection:
+            delete_storyline_rows(connection, storyline_name)
+    classifier_stages = sorted({stage for turn in turns for stage in turn["classifier_streams"]})
+    return {
+        "history": n_history,
+        "goals": n_goals,
+        "milestones": n_milestones,
+        "classifier_mode": classifier_mode,
+        "response_mode": response_mode,
+        "turns": n_turns,
+        "latency_ms": percentiles([turn["latency"] for turn in turns]),
+        "stages_ms": {
+            stage: percentiles([turn["stages"][stage] for turn in turns]) for stage in STAGES
+        },
+        "classifier_streams_ms": {
+            stage: percentiles(
+                [turn["classifier_streams"].get(stage, 0.0) for turn in turns]
+            )
+            for stage in classifier_stages
+        },
+        "queries": {
+            "mean": round(statistics.mean(turn["queries"] for turn in turns), 1),
+            "max": max(turn["queries"] for turn in turns),
+        },
+        "classifier_tokens": {
+            token_type: round(
+                statistics.mean(turn["classifier_tokens"][token_type] for turn in turns), 1
+            )
+            for token_type in ("prompt", "completion")
+        },
+        "speculation": {
+            "hit_rate": round(
+                statistics.mean(bool(turn["speculative_hit"]) for turn in turns), 3
+            ),
+            "saved_ms": percentiles([turn["speculation_saved"] for turn in turns]),
+        }
+        if response_mode == "speculative"
+        else None,
+    }
+
+
+def result_key(result: dict[str, Any]) -> tuple[int, int, int, str, str]:
+    return (
+        result["history"],
+        result["goals"],
+        result["milestones"],
+        result.get("classifier_mode", "prose"),
+        result.get("response_mode", "sequential"),
+    )
+
+
+def find_regressions(
+    results: list[dict[str, Any]], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    """Compare p95 latency and mean query counts with a previous run of the benchmark."""
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        for name, current, before in (
+            ("p95 latency", result["latency_ms"]["p95"], previous["latency_ms"]["p95"]),
+            ("mean queries", result["queries"]["mean"], previous["queries"]["mean"]),
+        ):
+            if current > before * (1 + tolerance):
+                regressions.append(
+                    f"history={result['history']} goals={result['goals']} "
+                    f"milestones={result['milestones']} mode={result['classifier_mode']} "
+                    f"response={result.get('response_mode', 'sequential')}: "
+                    f"{name} {before} -> {current}"
+                )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark whole turns (summary, classifiers, character response and DB "
+        "write) against a stub LLM. Run it against a scratch database via XPLORE_DB_URL."
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        nargs="+",
+        default=[10, 1000, 100000],
+        help="Numbers of messages already in the storyline.",
+    )
+    parser.add_argument(
+        "--goals", type=int, nargs="+", default=[3], help="Numbers of active goals."
+    )
+    parser.add_argument(
+        "--milestones", type=int, nargs="+", default=[5], help="Numbers of milestones."
+    )
+    parser.add_argument(
+        "--classifier-modes",
+        nargs="+",
+        choices=sorted(CLASSIFIER_MODES),
+        default=["prose"],
+        help="Run the goal and milestone agents with prose answers, function calls or both.",
+    )
+    parser.add_argument(
+        "--response-modes",
+        nargs="+",
+        choices=sorted(RESPONSE_MODES),
+        default=["sequential"],
+        help="Start the character response after the classifiers, alongside them or both.",
+    )
+    parser.add_argument("--turns", type=int, default=20, help="Measured turns per configuration.")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured turns to play first.")
+    parser.add_argument(
+        "--ttft", type=float, default=0.05, help="Stub LLM seconds to the first token."
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=500.0, help="Stub LLM streaming rate."
+    )
+    parser.add_argument(
+        "--base-url", help="Benchmark this OpenAI-compatible endpoint instead of the stub LLM."
+    )
+    parser.add_argument(
+        "--llm-cache", action="store_true", help="Keep the LLM response cache enabled."
+    )
+    parser.add_argument("--output", default="bench_turn.json", help="JSON file for the results.")
+    parser.add_argument("--baseline", help="Results of a previous run to check for regressions.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative regression."
+    )
+    parser.add_argument("--log-level", default="warning", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    if not args.llm_cache:
+        os.environ["XPLORE_LLM_CACHE"] = "0"
+    stub = None
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    else:
+        stub = StubLLMServer(ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+        os.environ["OPENAI_BASE_URL"] = stub.start()
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+    initialize_db()
+
+    results: list[dict[str, Any]] = []
+    print(
+        "history  goals  milestones   mode    response   p50 ms   p95 ms   p99 ms  queries  "
+        "classifier tokens (prompt/completion)  speculation hits"
+    )
+    try:
+        for n_history, n_goals, n_milestones, mode, response_mode in product(
+            args.history, args.goals, args.milestones, args.classifier_modes, args.response_modes
+        ):
+            result = run_benchmark(
+                n_history, n_goals, n_milestones, args.turns, args.warmup, mode, response_mode
+            )
+            results.append(result)
+            latency, tokens = result["latency_ms"], result["classifier_tokens"]
+            speculation = result["speculation"]
+            print(
+                f"{n_history:>7} {n_goals:>6} {n_milestones:>11} {mode:>6} {response_mode:>11} "
+                f"{latency['p50']:>8.1f} {latency['p95']:>8.1f} "
+                f"{latency['p99']:>8.1f} {result['queries']['mean']:>8.1f}  "
+                f"{tokens['prompt']:>17.0f}/{tokens['completion']:<19.0f} "
+                f"{speculation['hit_rate'] if speculation else '-':>16}"
+            )
+    finally:
+        if stub:
+            stub.stop()
+
+    report = {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "base_url": args.base_url,
+        "stub_llm": None
+        if args.base_url
+        else {"ttft": args.ttft, "tokens_per_second": args.tokens_per_second},
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    logging.info(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from token_world.llm.xplore.session_state import get_active_storyline
 
 
 def character_editor():
-    with session_scope() as session:
+    with session_scope("character_editor") as session:
         if (storyline := get_active_storyline()) is None:
             st.error("Please select a storyline to get started.")
             return
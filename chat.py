@@ -2,35 +2,43 @@ import logging
 from typing import Optional
 import streamlit as st
 
-from token_world.llm.xplore.character_agent import generate_character_response
 from token_world.llm.xplore.db import (
     MessageModel,
     SummaryModel,
     add_message_to_db,
     session_scope,
 )
-from token_world.llm.xplore.goal_agent import show_goal_management
 from token_world.llm.xplore.image import draw_image_prompt
-from token_world.llm.xplore.milestone_agent import show_milestone_management
-from token_world.llm.xplore.session_state import get_active_storyline
-from token_world.llm.xplore.summarize_agent import (
-    draw_conversation_summary,
+from token_world.llm.xplore.message_cache import (
+    ParsedMessage,
+    get_parsed_messages,
+    invalidate_parsed_messages,
 )
+from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.summarize_agent import LazySummaryConversation
+from token_world.llm.xplore.turn import draw_turn
+from token_world.llm.xplore.turn_engine import TurnEngine
+
+
+CONVERSATION_PAGE_SIZE = 20
 
 
 def draw_conversation():
     st.header("💬 Chat")
-    with session_scope() as session:
-        messages = (
-            session.query(MessageModel)
-            .where(MessageModel.storyline_name == get_active_storyline())
-            .order_by(MessageModel.id)
-            .all()
-        )
-        for message in messages:
-            msg = message.content_dict
-            with st.chat_message("user" if msg["role"] == "user" else "assistant"):
-                if msg["role"] != "assistant":
+    storyline_name = get_active_storyline()
+    window = st.session_state.setdefault("conversation_window", CONVERSATION_PAGE_SIZE)
+    with session_scope("draw_conversation") as session:
+        summary = LazySummaryConversation(session)
+        messages = get_parsed_messages(session, storyline_name)
+        if len(messages) > window:
+            n_older = len(messages) - window
+            if st.button(f"⬆️ Load older messages ({n_older} hidden)"):
+                st.session_state.conversation_window = window + CONVERSATION_PAGE_SIZE
+                st.rerun()
+                return
+        for message in messages[-window:]:
+            with st.chat_message("user" if message.role == "user" else "assistant"):
+                if message.role != "assistant":
                     col1, col2 = st.columns([1, 4])
                     with col1:
                         st.write(message.id)
@@ -38,19 +46,20 @@ def draw_conversation():
                         if st.button("🗑️", key=f"delete_{message.id}"):
                             logging.info(f"Deleting message {message.id}")
                             session.query(MessageModel).where(
-                                MessageModel.storyline_name == get_active_storyline()
+                                MessageModel.storyline_name == storyline_name
                             ).where(MessageModel.id >= message.id).delete()
                             session.query(SummaryModel).where(
-                                SummaryModel.storyline_name == get_active_storyline()
+                                SummaryModel.storyline_name == storyline_name
                             ).where(
                                 SummaryModel.summary_until_id >= message.id
                             ).delete()
                             session.commit()
+                            invalidate_parsed_messages(storyline_name)
                             st.rerun()
                             return
-                    st.markdown(msg["content"])
+                    st.markdown(message.content)
                 else:
-                    draw_assistant_message(message, session)
+                    draw_assistant_message(message, session, summary)
 
 
 def draw_chat_input():
@@ -61,16 +70,18 @@ def draw_chat_input():
             st.markdown(prompt)
         # Add user message to chat history
         user_message = {"role": "user", "content": prompt}
-        with session_scope() as session:
+        with session_scope("draw_chat_input") as session:
             add_message_to_db(user_message, session)
 
-        with session_scope() as session:
+        with session_scope("draw_chat_input") as session:
             with st.chat_message("assistant"):
-                draw_assistant_message(None, session)
+                draw_assistant_message(None, session, LazySummaryConversation(session))
                 st.rerun()
 
 
-def draw_assistant_message(existing_message: Optional[MessageModel], session):
+def draw_assistant_message(
+    existing_message: Optional[ParsedMessage], session, summary: LazySummaryConversation
+):
     message_id = existing_message.id if existing_message else "draft"
     col1, col2, col3, col4 = st.columns([1, 2, 2, 2])
     with col1:
@@ -78,15 +89,10 @@ def draw_assistant_message(existing_message: Optional[MessageModel], session):
     with col2:
         regenerate = st.button("🔃 Regenerate", key=f"regenerate_{message_id}")
 
-    conversation = draw_conversation_summary(session)
-    if not conversation:
-        st.error("Summary required...")
-        st.rerun()
-        return
-
     with col3:
         if st.button("🖼️ Image Prompt", key=f"image_{message_id}"):
-            draw_image_prompt(conversation)
+            if conversation := summary.get():
+                draw_image_prompt(conversation)
 
     with col4:
         if existing_message and st.button("🗑️", key=f"delete_{message_id}"):
@@ -95,37 +101,14 @@ def draw_assistant_message(existing_message: Optional[MessageModel], session):
                 MessageModel.storyline_name == get_active_storyline()
             ).filter(MessageModel.id >= existing_message.id).delete()
             session.commit()
+            invalidate_parsed_messages(get_active_storyline())
             st.rerun()
             return
 
     if existing_message and not regenerate:
-        st.markdown(existing_message.content_dict["content"])
+        st.markdown(existing_message.content)
         return
 
-    if existing_message:
-        session.query(MessageModel).where(
-            MessageModel.storyline_name == get_active_storyline()
-        ).where(MessageModel.id >= existing_message.id).delete()
-        session.query(SummaryModel).where(
-            SummaryModel.storyline_name == get_active_storyline()
-        ).where(SummaryModel.summary_until_id >= existing_message.id).delete()
-        session.commit()
-
-    with st.spinner("Managing milestones..."):
-        show_milestone_management()
-    with st.spinner("Managing goals..."):
-        show_goal_management()
-    response = generate_character_response(conversation)
-    response_text = str(st.write_stream(response))
-    if not existing_message:
-        with st.spinner("Generating response..."):
-            logging.debug(f"AI response: {response_text}")
-            ai_message = {"role": "assistant", "content": response_text}
-            existing_message = add_message_to_db(ai_message, session)
-    else:
-        with st.spinner("Regenerating response..."):
-            msg = existing_message.content_dict
-            msg["content"] = response_text
-            add_message_to_db(msg, session)
-    session.commit()
+    engine = TurnEngine(get_active_storyline())
+    draw_turn(engine.run_turn(regenerate_from=existing_message.id if existing_message else None))
     st.rerun()
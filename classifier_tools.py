@@ -0,0 +1,82 @@
+import logging
+import os
+from typing import Any, Iterator, NamedTuple
+
+from token_world.llm.xplore.db import Message
+from token_world.llm.xplore.llm import llm_client
+from token_world.llm.xplore.prompt_cache import record_prompt
+
+# Key of the context variables under which the functions record their calls.
+TOOL_CALLS = "tool_calls"
+
+
+class ToolCall(NamedTuple):
+    name: str
+    arguments: dict[str, Any]
+
+
+def use_classifier_tools() -> bool:
+    """Whether the goal and milestone agents answer with function calls instead of prose."""
+    return os.getenv("XPLORE_CLASSIFIER_TOOLS", "0") == "1"
+
+
+def use_classifier_reasoning() -> bool:
+    """Whether agents in tool mode briefly explain their decision before calling functions."""
+    return os.getenv("XPLORE_CLASSIFIER_REASONING", "1") != "0"
+
+
+def reasoning_instructions() -> str:
+    if use_classifier_reasoning():
+        return (
+            "First explain your decision in 1-3 sentences, quoting the evidence from the "
+            "conversation, then call the functions."
+        )
+    return "Do not explain your decision, only call the functions."
+
+
+# The functions the agents can call. They only record the call, since the classifiers stream
+# concurrently and their updates are applied afterwards in stage order.
+
+
+def mark_goal_completed(goal_name: str, context_variables: dict) -> str:
+    """Mark one of the AI character's goals as completed. Call once per completed goal."""
+    context_variables[TOOL_CALLS].append(ToolCall("mark_goal_completed", {"goal_name": goal_name}))
+    return f"Goal '{goal_name}' will be marked as completed."
+
+
+def create_goal(goal_name: str, description: str, context_variables: dict) -> str:
+    """Create a new goal for the AI character to pursue over the next turns."""
+    context_variables[TOOL_CALLS].append(
+        ToolCall("create_goal", {"goal_name": goal_name, "description": description})
+    )
+    return f"Goal '{goal_name}' will be created."
+
+
+def mark_milestone_completed(context_variables: dict) -> str:
+    """Mark the current milestone of the storyline as completed."""
+    context_variables[TOOL_CALLS].append(ToolCall("mark_milestone_completed", {}))
+    return "The milestone will be marked as completed."
+
+
+GOAL_COMPLETION_FUNCTIONS = [mark_goal_completed]
+GOAL_CREATION_FUNCTIONS = [create_goal]
+MILESTONE_FUNCTIONS = [mark_milestone_completed]
+
+
+def stream_tool_calls(
+    model: str, agent: Any, messages: list[Message], calls: list[ToolCall]
+) -> Iterator[str]:
+    """Stream the agent's text, and add the functions it called to ``calls`` once it is done.
+
+    ``max_turns=1`` stops Swarm from asking the LLM again after running the functions.
+    """
+    record_prompt(agent.name, agent.instructions, messages)
+    chunks = llm_client(model).run(
+        agent, messages, context_variables={TOOL_CALLS: []}, max_turns=1, stream=True
+    )
+    for chunk in chunks:
+        if "response" in chunk:
+            calls.extend(chunk["response"].context_variables[TOOL_CALLS])
+        elif chunk.get("content"):
+            yield chunk["content"]
+    logging.info(f"{agent.name} called {calls}")
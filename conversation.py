@@ -1,55 +1,74 @@
 import logging
-from typing import List, NamedTuple, Optional
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
 
-import streamlit as st
 from token_world.llm.xplore.db import (
     MessageModel,
     SummaryModel,
 )
+from token_world.llm.xplore.turn_events import TurnEvent
 
 
 class SummaryConversation(NamedTuple):
     latest_summary: Optional[SummaryModel]
     messages_to_summarize: List[MessageModel]
     new_messages: List[MessageModel]
+    # Arc, chapter and chunk summaries up to ``latest_summary``, assembled within a token budget.
+    summary_context: str = ""
 
     def is_summary_required(self) -> bool:
         return bool(self.messages_to_summarize)
 
 
+# How the roles are labelled when messages are written into a prompt as a transcript.
+ROLE_LABELS = {"user": "User", "assistant": "AI"}
+
+
+def format_transcript(messages: List[MessageModel]) -> str:
+    """Write the messages as "Role: text" lines, without the JSON of the chat format."""
+    return "\n---\n".join(
+        f"{ROLE_LABELS.get(str(message.role), str(message.role).capitalize())}: {message.content}"
+        for message in messages
+    )
+
+
 class CurrentMessages(NamedTuple):
     ai: Optional[MessageModel]
     user: MessageModel
 
 
+class ClassifierTask(NamedTuple):
+    """A classifier LLM call that is ready to stream, plus the handler for its full response.
+
+    The handler applies the classification and describes what it did as turn events.
+    """
+
+    stream: Iterator[str]
+    handle_response: Callable[[str], Iterable[TurnEvent]]
+
+
 def get_current_messages(summary: SummaryConversation) -> Optional[CurrentMessages]:
     if len(summary.new_messages) == 1:
         ai_message, user_message = None, summary.new_messages[0]
     elif len(summary.new_messages) == 2:
         ai_message, user_message = summary.new_messages
     else:
-        st.error("Expected one or two new messages.")
+        logging.error("Expected one or two new messages.")
         return None
 
     logging.info(
         f"Current messages {len(summary.new_messages)} unsummarized messages: "
-        f"{ai_message.content_dict['role'] if ai_message else None}, "
-        f"{user_message.content_dict['role'] if user_message else None}"
+        f"{ai_message.role if ai_message else None}, "
+        f"{user_message.role if user_message else None}"
     )
 
-    if ai_message:
-        ai_msg = ai_message.content_dict
-        if ai_msg["role"] != "assistant":
-            st.error(
-                "Expected second last message to be an assistant message, but was:"
-                f" {ai_msg['role']}."
-            )
-            return None
-    else:
-        ai_msg = None
-    user_msg = user_message.content_dict
-    if user_msg["role"] != "user":
-        st.error("Expected last message to be a user message.")
+    if ai_message and ai_message.role != "assistant":
+        logging.error(
+            "Expected second last message to be an assistant message, but was:"
+            f" {ai_message.role}."
+        )
+        return None
+    if user_message.role != "user":
+        logging.error("Expected last message to be a user message.")
         return None
 
     return CurrentMessages(ai_message, user_message)
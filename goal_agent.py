@@ -1,28 +1,46 @@
-import json
 import logging
-from typing import Iterator, Optional
+from typing import Iterable, Iterator, Optional, Union
 
-import streamlit as st
 from swarm import Agent  # type: ignore[import]
 from token_world.llm.stream_processing import (
     MessageStream,
     ToolStream,
     parse_streaming_response,
 )
-from token_world.llm.xplore.conversation import get_current_messages
+from token_world.llm.xplore.answer_parser import JsonAnswerParser, until_answer
+from token_world.llm.xplore.classifier_tools import (
+    GOAL_COMPLETION_FUNCTIONS,
+    GOAL_CREATION_FUNCTIONS,
+    ToolCall,
+    reasoning_instructions,
+    stream_tool_calls,
+    use_classifier_tools,
+)
+from token_world.llm.xplore.conversation import ClassifierTask, get_current_messages
 from token_world.llm.xplore.db import AgentGoalModel, session_scope
 from token_world.llm.xplore.goals import (
+    GOAL_COMPLETION_EXAMPLE_OUTPUT,
     get_active_goals_markdown,
     get_too_many_goals_warning,
     mark_goal_completed,
-    random_goal_completion_output,
 )
 from token_world.llm.xplore.llm import handle_base_model_arg, llm_client
-from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.prompt_builder import PromptBuilder
+from token_world.llm.xplore.prompt_cache import record_prompt
+from token_world.llm.xplore.response_cache import cached_response_stream
 from token_world.llm.xplore.storyline import get_active_milestone_markdown
-from token_world.llm.xplore.summarize_agent import (
-    SummaryConversation,
-    draw_conversation_summary,
+from token_world.llm.xplore.summarize_agent import SummaryConversation
+from token_world.llm.xplore.telemetry import traced_stream
+from token_world.llm.xplore.turn_context import TurnContext
+from token_world.llm.xplore.turn_events import (
+    ALREADY_EXISTS,
+    COMPLETED,
+    CREATED,
+    INVALID,
+    NOT_FOUND,
+    GoalUpdate,
+    Notice,
+    TurnEvent,
 )
 
 
@@ -35,52 +53,90 @@ SYSTEM_PROMPT = (
     "You will then be asked to perform various tasks involving managing the goals. "
 )
 
+GOAL_CLASSIFICATIONS_MARKER = "GOAL CLASSIFICATIONS:"
+NEW_GOALS_MARKER = "NEW GOALS:"
+
 
-def handle_goal_completion(response_text: str):
+def handle_goal_completion(response_text: str, context: TurnContext) -> Iterator[TurnEvent]:
     """Parse the response text for any goal completion commands and mark the goals as completed."""
-    # Regex pattern to match goal completion commands
-    goal_part = response_text.rsplit("GOAL CLASSIFICATIONS:", 1)[-1].strip()
-    logging.info(f"Goal part to parse classifications from: {goal_part}")
-    completion_classifications = json.loads(goal_part)
-    for goal_name, completion_status in completion_classifications.items():
-        if completion_status == "INCOMPLETE":
-            continue
-        if mark_goal_completed(goal_name):
-            st.success(f"Goal '{goal_name}' marked as completed.")
+    completion_classifications = JsonAnswerParser(GOAL_CLASSIFICATIONS_MARKER).parse(response_text)
+    logging.info(f"Parsed goal classifications: {completion_classifications}")
+    yield from complete_goals(
+        (
+            goal_name
+            for goal_name, completion_status in completion_classifications.items()
+            if completion_status != "INCOMPLETE"
+        ),
+        context,
+    )
+
+
+def handle_goal_completion_calls(
+    calls: list[ToolCall], context: TurnContext
+) -> Iterator[TurnEvent]:
+    """Mark the goals of the agent's ``mark_goal_completed`` calls as completed."""
+    yield from complete_goals(
+        (
+            str(call.arguments.get("goal_name", ""))
+            for call in calls
+            if call.name == "mark_goal_completed"
+        ),
+        context,
+    )
+
+
+def complete_goals(goal_names: Iterable[str], context: TurnContext) -> Iterator[TurnEvent]:
+    for goal_name in goal_names:
+        if mark_goal_completed(goal_name, context.storyline_name):
+            context.invalidate()
             logging.info(f"Goal '{goal_name}' marked as completed.")
+            yield GoalUpdate(goal_name, COMPLETED)
         else:
-            st.warning(f"Goal '{goal_name}' not found.")
             logging.warning(f"Goal '{goal_name}' not found.")
+            yield GoalUpdate(goal_name, NOT_FOUND)
 
 
-def handle_goal_creation(response_text: str):
-    """Parse the response text for any goal completion commands and mark the goals as completed."""
-    # Regex pattern to match goal completion commands
-    goal_part = response_text.rsplit("NEW GOALS:", 1)[-1].strip()
-    goal_part = goal_part.rsplit("{", 1)[-1].strip()
-    goal_part = goal_part.rsplit("}", 1)[0].strip()
-    goal_part = "{" + goal_part + "}"
-    logging.info(f"Goal part to parse goal creation from: {goal_part}")
-    goal_creation = json.loads(goal_part)
-    for goal_name, goal_description in goal_creation.items():
+def handle_goal_creation(response_text: str, context: TurnContext) -> Iterator[TurnEvent]:
+    """Parse the response text for any new goals and add them to the storyline."""
+    goal_creation = JsonAnswerParser(NEW_GOALS_MARKER).parse(response_text)
+    logging.info(f"Parsed new goals: {goal_creation}")
+    yield from create_goals(goal_creation.items(), context)
+
+
+def handle_goal_creation_calls(calls: list[ToolCall], context: TurnContext) -> Iterator[TurnEvent]:
+    """Add the goals of the agent's ``create_goal`` calls to the storyline."""
+    yield from create_goals(
+        (
+            (str(call.arguments.get("goal_name", "")), str(call.arguments.get("description", "")))
+            for call in calls
+            if call.name == "create_goal"
+        ),
+        context,
+    )
+
+
+def create_goals(goals: Iterable[tuple[str, str]], context: TurnContext) -> Iterator[TurnEvent]:
+    for goal_name, goal_description in goals:
         if not goal_name or not goal_description:
-            st.error(
+            logging.error(
                 f"Goal name or description are empty: {goal_name=}, {goal_description=}."
             )
-        with session_scope() as session:
+            yield GoalUpdate(goal_name, INVALID, goal_description)
+            continue
+        with session_scope("create_goals") as session:
             if (
                 session.query(AgentGoalModel)
-                .where(AgentGoalModel.storyline_name == get_active_storyline())
+                .where(AgentGoalModel.storyline_name == context.storyline_name)
                 .where(AgentGoalModel.name == goal_name)
                 .count()
                 > 0
             ):
-                st.error(f"Goal '{goal_name}' already exists.")
                 logging.warning(f"Goal '{goal_name}' already exists.")
+                yield GoalUpdate(goal_name, ALREADY_EXISTS, goal_description)
                 continue
             session.add(
                 AgentGoalModel(
-                    storyline_name=get_active_storyline(),
+                    storyline_name=context.storyline_name,
                     name=goal_name,
                     description=goal_description,
                     completed=False,
@@ -88,12 +144,18 @@ def handle_goal_creation(response_text: str):
                 )
             )
             session.commit()
-            st.success(f"Goal '{goal_name}' added.")
+            context.invalidate()
             logging.info(f"Goal '{goal_name}' added.")
+            yield GoalUpdate(goal_name, CREATED, goal_description)
 
 
+@traced_stream("generate_completed_goals")
 def generate_completed_goals(
-    summary: str, ai_prompt: str, user_prompt: str, model: Optional[str] = None
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
 ) -> Iterator[str]:
     model = handle_base_model_arg(model)
     try:
@@ -105,23 +167,13 @@ def generate_completed_goals(
 """
         else:
             summary_prompt = ""
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": f"""{summary_prompt}Here are the most recent messages:
-## Recent Messages
----
-AI: {ai_prompt}
----
-User: {user_prompt}
----
-
-Finally, here are the current goals of the AI character:
-## Goals (alphabetical order)
-{get_active_goals_markdown(exclude_forever=True)}
 
-Given these goals, can you determine if the most recent messages of the AI satisfy any of the goals?
+        def render(summary_prompt: str, ai_prompt: str, user_prompt: str, goals: str) -> str:
+            # Static instructions come first and volatile context last, so that the prompt
+            # prefix stays byte-identical across turns and provider prompt caches can hit.
+            return f"""You will be given a summary of the conversation so far,
+ the most recent messages and the current goals of the AI character.
+You need to determine if the most recent messages of the AI satisfy any of the goals.
 Think step-by-step showing your thought process, but don't overcomplicate things,
  keep the reasoning simple and concise (1-3 sentences), and then provide your answer.
 Be conservative and look for clear evidence from the conversation
@@ -151,9 +203,35 @@ ALWAYS OUTPUT 'GOAL CLASSIFICATIONS:' FOLLOWED BY THIS JSON OBJECT AT THE END.
 
 For example:
 ---
-{random_goal_completion_output()}
-""",
-            },
+{GOAL_COMPLETION_EXAMPLE_OUTPUT}
+---
+
+{summary_prompt}Here are the most recent messages:
+## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
+
+Finally, here are the current goals of the AI character:
+## Goals (alphabetical order)
+{goals}
+
+Given these goals, can you determine if the most recent messages of the AI satisfy any of the goals?
+"""
+
+        # Fill the prompt by priority: instructions, goals, summary and then recent messages.
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", ""))
+        goals = builder.fit("goals", get_active_goals_markdown(context, exclude_forever=True))
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Goal Completion Classifier")
+        messages = [
+            {"role": "user", "content": render(summary_prompt, ai_prompt, user_prompt, goals)},
         ]
         logging.info(f"Generating response for {messages[-1]} messages")
 
@@ -164,20 +242,35 @@ For example:
             stream=True,
         )
 
-        chunks = llm_client().run(agent, messages, stream=True)
-        for chunk in parse_streaming_response(chunks):
-            if isinstance(chunk, MessageStream):
-                for content in chunk.content_stream:
-                    yield content
-            elif isinstance(chunk, ToolStream):
-                logging.info(f"Tool Use: {chunk}")
+        def stream_response() -> Iterator[str]:
+            record_prompt(agent.name, agent.instructions, messages)
+            chunks = llm_client(model).run(agent, messages, stream=True)
+            for chunk in parse_streaming_response(chunks):
+                if isinstance(chunk, MessageStream):
+                    for content in chunk.content_stream:
+                        yield content
+                elif isinstance(chunk, ToolStream):
+                    logging.info(f"Tool Use: {chunk}")
+
+        yield from cached_response_stream(
+            model,
+            agent,
+            messages,
+            stream_response,
+            answer=JsonAnswerParser(GOAL_CLASSIFICATIONS_MARKER),
+        )
     except Exception as e:
-        st.error(f"Error generating response: {e}.")
-        return logging.error(f"Error generating response: {e}", exc_info=True)
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
 
 
+@traced_stream("generate_new_goals")
 def generate_new_goals(
-    summary: str, ai_prompt: str, user_prompt: str, model: Optional[str] = None
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
 ) -> Iterator[str]:
     model = handle_base_model_arg(model)
     try:
@@ -190,33 +283,27 @@ def generate_new_goals(
 """
         else:
             summary_prompt = ""
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": f"""Can you help me decide if any new goals need to be created
- for the AI in the game? And only if yes, what should they be?
 
-{summary_prompt}Here are the most recent messages:
-## Recent Messages
----
-AI: {ai_prompt}
----
-User: {user_prompt}
----
-
-The currently active milestone in the storyline is:
-{get_active_milestone_markdown()}
-
-And here are the active goals of the AI character:
-{get_active_goals_markdown()}
+        def render(
+            summary_prompt: str,
+            ai_prompt: str,
+            user_prompt: str,
+            milestone: str,
+            goals: str,
+            too_many_goals_warning: str,
+        ) -> str:
+            # Static instructions come first and volatile context last, so that the prompt
+            # prefix stays byte-identical across turns and provider prompt caches can hit.
+            return f"""Can you help me decide if any new goals need to be created
+ for the AI in the game? And only if yes, what should they be?
 
+You will be given a summary of the conversation so far, the most recent messages,
+ the currently active milestone in the storyline and the active goals of the AI character.
 Given the currently active milestone, the existing incomplete goals
  and the latest developments in the conversation,
- can you suggest if any new goals that the AI character should to pursue?
+ suggest if any new goals that the AI character should to pursue.
 Or, if no new goals are required, provide your reasoning.
 A general rule of thumb is to have 1-3 goals at a time. No more, no less.
-{get_too_many_goals_warning()}
 A goal is something that the AI character should strive to achieve over multiple turns.
 Don't suggest a goal that can be achieved in one turn.
 Keep in mind, that *most of the time, no new goals are required*.
@@ -260,8 +347,43 @@ ALWAYS OUTPUT 'NEW GOALS:' FOLLOWED BY THIS JSON OBJECT AT THE END.
 
 For example:
 ---
-{random_goal_completion_output()}
-""",
+{GOAL_COMPLETION_EXAMPLE_OUTPUT}
+---
+
+{summary_prompt}Here are the most recent messages:
+## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
+
+The currently active milestone in the storyline is:
+{milestone}
+
+And here are the active goals of the AI character:
+{goals}
+{too_many_goals_warning}
+Should any new goals be created for the AI character?
+"""
+
+        # Fill the prompt by priority: instructions, milestone, goals, summary, recent messages.
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", "", "", ""))
+        milestone = builder.fit("milestone", get_active_milestone_markdown(context))
+        goals = builder.fit("goals", get_active_goals_markdown(context))
+        too_many_goals_warning = builder.fit("goals", get_too_many_goals_warning(context))
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Goal Creator")
+        messages = [
+            {
+                "role": "user",
+                "content": render(
+                    summary_prompt, ai_prompt, user_prompt, milestone, goals, too_many_goals_warning
+                ),
             },
         ]
         logging.info(f"Generating response for {messages[-1]} messages")
@@ -273,88 +395,205 @@ For example:
             stream=True,
         )
 
-        chunks = llm_client().run(agent, messages, stream=True)
-        for chunk in parse_streaming_response(chunks):
-            if isinstance(chunk, MessageStream):
-                for content in chunk.content_stream:
-                    yield content
-            elif isinstance(chunk, ToolStream):
-                logging.info(f"Tool Use: {chunk}")
+        def stream_response() -> Iterator[str]:
+            record_prompt(agent.name, agent.instructions, messages)
+            chunks = llm_client(model).run(agent, messages, stream=True)
+            for chunk in parse_streaming_response(chunks):
+                if isinstance(chunk, MessageStream):
+                    for content in chunk.content_stream:
+                        yield content
+                elif isinstance(chunk, ToolStream):
+                    logging.info(f"Tool Use: {chunk}")
+
+        yield from until_answer(stream_response(), JsonAnswerParser(NEW_GOALS_MARKER))
     except Exception as e:
-        st.error(f"Error generating response: {e}.")
-        return logging.error(f"Error generating response: {e}", exc_info=True)
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+@traced_stream("generate_completed_goal_calls")
+def generate_completed_goal_calls(
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    calls: list[ToolCall],
+    model: Optional[str] = None,
+) -> Iterator[str]:
+    """Like ``generate_completed_goals``, but the agent calls ``mark_goal_completed`` instead."""
+    model = handle_base_model_arg(model)
+    try:
+        summary_prompt = f"## Summary\n{summary}\n\n" if summary else ""
+
+        def render(summary_prompt: str, ai_prompt: str, user_prompt: str, goals: str) -> str:
+            return f"""You will be given a summary of the conversation so far,
+ the most recent messages and the current goals of the AI character.
+Determine if the most recent messages of the AI satisfy any of the goals.
+Be conservative and only call `mark_goal_completed` for a goal
+ when there is clear evidence in the conversation.
+If no goal is satisfied, do not call any function.
+{reasoning_instructions()}
+
+{summary_prompt}## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
 
+## Goals (alphabetical order)
+{goals}
+"""
 
-def show_goal_completion_classification(summary: SummaryConversation):
-    with st.spinner("Detecting completed goals..."):
-        logging.info("Detecting completed goals...")
-        with session_scope() as session:
-            n_incomplete_goals = (
-                session.query(AgentGoalModel)
-                .where(AgentGoalModel.storyline_name == get_active_storyline())
-                .where(AgentGoalModel.completed.is_(False))
-                .count()
-            )
-            if n_incomplete_goals == 0:
-                st.write("All goals completed.")
-                return
-
-        current_messages = get_current_messages(summary)
-        if not current_messages or current_messages.ai is None:
-            st.warning("No messages to process.")
-            return
-        stream = generate_completed_goals(
-            str(summary.latest_summary.content) if summary.latest_summary else "",
-            current_messages.ai.content_val if current_messages.ai else "",
-            current_messages.user.content_val,
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", ""))
+        goals = builder.fit("goals", get_active_goals_markdown(context, exclude_forever=True))
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Goal Completion Tool Classifier")
+        messages = [
+            {"role": "user", "content": render(summary_prompt, ai_prompt, user_prompt, goals)},
+        ]
+
+        agent = Agent(
+            name="Goal Completion Tool Classifier",
+            model=model,
+            instructions=SYSTEM_PROMPT,
+            functions=GOAL_COMPLETION_FUNCTIONS,
         )
-        text_response = str(st.write_stream(stream))
-        logging.debug(f"Goal completion classification response: {text_response}")
-        handle_goal_completion(text_response)
-    st.write("Goal completion classification complete.")
+        yield from stream_tool_calls(model, agent, messages, calls)
+    except Exception as e:
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+@traced_stream("generate_new_goal_calls")
+def generate_new_goal_calls(
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    calls: list[ToolCall],
+    model: Optional[str] = None,
+) -> Iterator[str]:
+    """Like ``generate_new_goals``, but the agent calls ``create_goal`` instead."""
+    model = handle_base_model_arg(model)
+    try:
+        summary_prompt = f"## Summary\n{summary}\n\n" if summary else ""
+
+        def render(
+            summary_prompt: str,
+            ai_prompt: str,
+            user_prompt: str,
+            milestone: str,
+            goals: str,
+            too_many_goals_warning: str,
+        ) -> str:
+            return f"""You will be given a summary of the conversation so far,
+ the most recent messages, the currently active milestone in the storyline
+ and the active goals of the AI character.
+Decide if the AI character needs any new goals to pursue the milestone,
+ and call `create_goal` for each of them.
+A general rule of thumb is to have 1-3 goals at a time.
+A goal is something that the AI character should strive to achieve over multiple turns.
+Keep in mind, that *most of the time, no new goals are required*.
+If none are, do not call any function.
+{reasoning_instructions()}
+
+{summary_prompt}## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
 
+## Active Milestone
+{milestone}
+
+## Active Goals
+{goals}
+{too_many_goals_warning}"""
+
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", "", "", ""))
+        milestone = builder.fit("milestone", get_active_milestone_markdown(context))
+        goals = builder.fit("goals", get_active_goals_markdown(context))
+        too_many_goals_warning = builder.fit("goals", get_too_many_goals_warning(context))
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Goal Tool Creator")
+        messages = [
+            {
+                "role": "user",
+                "content": render(
+                    summary_prompt, ai_prompt, user_prompt, milestone, goals, too_many_goals_warning
+                ),
+            },
+        ]
 
-def show_goal_creation(summary: SummaryConversation):
-    with st.spinner("Determining if new goals need to be created..."):
-        logging.info("Detecting completed goals...")
-        with session_scope() as session:
-            n_incomplete_goals = (
-                session.query(AgentGoalModel)
-                .where(AgentGoalModel.storyline_name == get_active_storyline())
-                .where(AgentGoalModel.completed.is_(False))
-                .count()
-            )
-            if n_incomplete_goals > 5:
-                st.warning("Too many incomplete goals. Skipping goal creation.")
-                return
-
-        current_messages = get_current_messages(summary)
-        if not current_messages or current_messages.ai is None:
-            st.warning("No messages to process.")
-            return
-        stream = generate_new_goals(
-            str(summary.latest_summary.content) if summary.latest_summary else "",
-            current_messages.ai.content_val if current_messages.ai else "",
-            current_messages.user.content_val,
+        agent = Agent(
+            name="Goal Tool Creator",
+            model=model,
+            instructions=SYSTEM_PROMPT,
+            functions=GOAL_CREATION_FUNCTIONS,
+        )
+        yield from stream_tool_calls(model, agent, messages, calls)
+    except Exception as e:
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+def prepare_goal_completion_classification(
+    summary: SummaryConversation, context: TurnContext
+) -> Union[ClassifierTask, Notice]:
+    """Return the classification to run, or a notice saying why there is none this turn."""
+    logging.info("Preparing goal completion classification...")
+    if not context.goals:
+        return Notice("info", "All goals completed.")
+
+    current_messages = get_current_messages(summary)
+    if not current_messages or current_messages.ai is None:
+        return Notice("warning", "No messages to process.")
+    ai_prompt = current_messages.ai.content_val if current_messages.ai else ""
+    if use_classifier_tools():
+        calls: list[ToolCall] = []
+        stream = generate_completed_goal_calls(
+            context, summary.summary_context, ai_prompt, current_messages.user.content_val, calls
+        )
+        return ClassifierTask(stream, lambda _: handle_goal_completion_calls(calls, context))
+    stream = generate_completed_goals(
+        context, summary.summary_context, ai_prompt, current_messages.user.content_val
+    )
+    return ClassifierTask(
+        stream, lambda response_text: handle_goal_completion(response_text, context)
+    )
+
+
+def prepare_goal_creation(
+    summary: SummaryConversation, context: TurnContext
+) -> Union[ClassifierTask, Notice]:
+    """Return the goal creation to run, or a notice saying why there is none this turn."""
+    logging.info("Preparing goal creation...")
+    if len(context.goals) > 5:
+        return Notice("warning", "Too many incomplete goals. Skipping goal creation.")
+
+    current_messages = get_current_messages(summary)
+    if not current_messages or current_messages.ai is None:
+        return Notice("warning", "No messages to process.")
+    ai_prompt = current_messages.ai.content_val if current_messages.ai else ""
+    if use_classifier_tools():
+        calls: list[ToolCall] = []
+        stream = generate_new_goal_calls(
+            context, summary.summary_context, ai_prompt, current_messages.user.content_val, calls
         )
-        text_response = str(st.write_stream(stream))
-        logging.debug(f"Goal creation response: {text_response}")
-        handle_goal_creation(text_response)
-    st.write("Goal creation complete.")
-
-
-def show_goal_management():
-    logging.info("Showing goal management...")
-    with session_scope() as session:
-        with st.expander("📜 Conversation Summary", expanded=True):
-            summary = draw_conversation_summary(session, max_messages=2)
-            if not summary or summary.is_summary_required():
-                st.error("Summary required...")
-                st.rerun()
-                return
-
-        logging.info("Summarization for goals complete...")
-        with st.expander("🎯 Goal Management", expanded=True):
-            show_goal_completion_classification(summary)
-            st.divider()
-            show_goal_creation(summary)
+        return ClassifierTask(stream, lambda _: handle_goal_creation_calls(calls, context))
+    stream = generate_new_goals(
+        context, summary.summary_context, ai_prompt, current_messages.user.content_val
+    )
+    return ClassifierTask(
+        stream, lambda response_text: handle_goal_creation(response_text, context)
+    )
@@ -1,10 +1,9 @@
-import json
 import logging
-import random
 from typing import Optional
 import streamlit as st
 from token_world.llm.xplore.db import AgentGoalModel, session_scope
 from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.turn_context import TurnContext
 
 
 def goal_editor():
@@ -12,7 +11,7 @@ def goal_editor():
         st.error("Please select a storyline to get started.")
         return
 
-    with session_scope() as session:
+    with session_scope("goal_editor") as session:
         if st.button("✖️ Uncheck All"):
             session.query(AgentGoalModel).filter(AgentGoalModel.storyline_name == storyline).update(
                 {AgentGoalModel.completed: False}
@@ -64,7 +63,7 @@ def goal_form(goal: Optional[AgentGoalModel] = None):
             with col2:
                 if st.form_submit_button("Save"):
                     with st.spinner("Saving..."):
-                        with session_scope() as session:
+                        with session_scope("goal_form") as session:
                             goal.completed = completed  # type: ignore
                             goal.name = name  # type: ignore
                             goal.description = description  # type: ignore
@@ -75,7 +74,7 @@ def goal_form(goal: Optional[AgentGoalModel] = None):
                             st.rerun()
             with col3:
                 if st.form_submit_button("🗑️"):
-                    with session_scope() as session:
+                    with session_scope("goal_form") as session:
                         session.delete(
                             session.query(AgentGoalModel)
                             .where(AgentGoalModel.storyline_name == get_active_storyline())
@@ -89,67 +88,43 @@ def goal_form(goal: Optional[AgentGoalModel] = None):
             st.error(f"Error: {e}")
 
 
-def random_goal_completion_output() -> str:
-    with session_scope() as session:
-        goals = (
-            session.query(AgentGoalModel)
-            .where(AgentGoalModel.storyline_name == get_active_storyline())
-            .where(AgentGoalModel.completed.is_(False))
-            .order_by(AgentGoalModel.name)
-            .all()
-        )
-        goal_classifications = {
-            goal.name: random.choice(["COMPLETE", "INCOMPLETE"]) for goal in goals
-        }
-        return f"""
+# A fixed example keeps the goal prompts byte-identical across turns so provider prompt caches hit.
+GOAL_COMPLETION_EXAMPLE_OUTPUT = """
 ## Internal Goal Completion Classification Reasoning
 ...
 
-GOALS:
-{json.dumps(goal_classifications)}"""
+GOAL CLASSIFICATIONS: {"goal name 1": "INCOMPLETE", "goal name 2": "COMPLETE"}"""
 
 
-def get_active_goals_markdown(exclude_forever: bool = False) -> str:
-    """Retrieve all incomplete goals and return them as a markdown table."""
-    with session_scope() as session:
-        goals_query = (
-            session.query(AgentGoalModel)
-            .where(AgentGoalModel.storyline_name == get_active_storyline())
-            .where(AgentGoalModel.completed.is_(False))
-        )
-        if exclude_forever:
-            goals_query = goals_query.where(AgentGoalModel.persistence != "Forever")
-        goals = goals_query.order_by(AgentGoalModel.name).all()
-        logging.info(f"Found {len(goals)} goals")
-        return f"""
+def get_active_goals_markdown(context: TurnContext, exclude_forever: bool = False) -> str:
+    """Return the incomplete goals of the turn as a markdown table."""
+    goals = [
+        goal for goal in context.goals if not (exclude_forever and goal.persistence == "Forever")
+    ]
+    logging.info(f"Found {len(goals)} goals")
+    return f"""
         ## Current Goals
         | Name | Description | Completed | Persistence |
         | --- | --- | --- | --- |
-        {" | ".join([f"{goal.name} | {goal.description} | {goal.completed} | {goal.persistence}"
+        {" | ".join([f"{goal.name} | {goal.description} | False | {goal.persistence}"
                       for goal in goals])}
         """
 
 
-def get_too_many_goals_warning() -> str:
-    with session_scope() as session:
-        n_goals = (
-            session.query(AgentGoalModel)
-            .where(AgentGoalModel.storyline_name == get_active_storyline())
-            .where(AgentGoalModel.completed.is_(False))
-            .count()
-        )
-        if n_goals > 3:
-            return f"""*Note*: {n_goals} goals are already active.
+def get_too_many_goals_warning(context: TurnContext) -> str:
+    n_goals = len(context.goals)
+    if n_goals > 3:
+        return f"""*Note*: {n_goals} goals are already active.
 This is a lot of goals to keep track of, only create a new goal if absolutely necessary.
 Consider completing some of them before creating new ones."""
-        return ""
+    return ""
 
 
-def mark_goal_completed(goal_name: str):
-    with session_scope() as session:
+def mark_goal_completed(goal_name: str, storyline_name: str):
+    with session_scope("mark_goal_completed") as session:
         goal = (
             session.query(AgentGoalModel)
-            .where(AgentGoalModel.storyline_name == get_active_storyline())
+            .where(AgentGoalModel.storyline_name == storyline_name)
             .where(AgentGoalModel.name == goal_name)
             .first()
         )
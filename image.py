@@ -9,6 +9,10 @@ from token_world.llm.stream_processing import (
 )
 from token_world.llm.xplore.conversation import SummaryConversation
 from token_world.llm.xplore.llm import handle_base_model_arg, llm_client
+from token_world.llm.xplore.prompt_builder import PromptBuilder
+from token_world.llm.xplore.prompt_cache import record_prompt
+from token_world.llm.xplore.response_cache import cached_response_stream
+from token_world.llm.xplore.telemetry import traced_stream
 
 
 def draw_image_prompt(conversation: SummaryConversation, model: Optional[str] = None):
@@ -19,6 +23,7 @@ def draw_image_prompt(conversation: SummaryConversation, model: Optional[str] =
         st.code(prompt, language="text", wrap_lines=True)
 
 
+@traced_stream("generate_image_prompt")
 def generate_image_prompt(
     conversation: SummaryConversation, model: Optional[str] = None
 ) -> Iterator[str]:
@@ -38,40 +43,49 @@ Some keywords may describe the scene, physical traits, and visual actions.""",
     )
 
     summary_text = ""
-    if conversation.latest_summary:
+    if conversation.summary_context:
         summary_text = f"""Let me first give you a summary of the conversation so far.
 Note that this is only for context and may not be relevant
 for the image prompt you need to generate.
 
 Summary:
-{conversation.latest_summary.content}
+{conversation.summary_context}
 
 """
 
-    messages = [
-        {
-            "role": "user",
-            "content": f"""{summary_text}The actual message for which
-you need to generate an image prompt is:
-{conversation.new_messages[-1].content_dict["content"]}
-
----
-
-Based on the above message, please generate a concise image prompt
+    def render(summary_text: str, message: str) -> str:
+        # Static instructions come first so that the prompt prefix is identical across calls.
+        return f"""Please generate a concise image prompt for the message given below,
 consisting of comma separated keywords clearly following the prescribed instructions.
 Make sure to include keywords for the scene, physical descriptions of the character,
 character poses/actions, etc. Complex keywords are not recommended.
 A good prompt will have between 5-10 keywords.
 Examples of GOOD keywords are: ninja, sword, tent, etc
 Examples of BAD keywords are: anticipation, jealousy, grace, etc since they are abstract.
-Also avoid names since they don't have any visual representation.""",
-        }
-    ]
-    chunks = llm_client().run(agent, messages, stream=True)
+Also avoid names since they don't have any visual representation.
+
+{summary_text}The actual message for which
+you need to generate an image prompt is:
+{message}"""
+
+    # Fill the prompt by priority: instructions, the message to illustrate and then the summary.
+    builder = PromptBuilder(model)
+    builder.reserve("system", agent.instructions)
+    builder.reserve("instructions", render("", ""))
+    message = builder.fit("recent messages", conversation.new_messages[-1].content_dict["content"])
+    summary_text = builder.fit("summary", summary_text)
+    builder.log_usage(agent.name)
+    messages = [{"role": "user", "content": render(summary_text, message)}]
+
+    def stream_response() -> Iterator[str]:
+        record_prompt(agent.name, agent.instructions, messages)
+        chunks = llm_client(model).run(agent, messages, stream=True)
+
+        for stream in parse_streaming_response(chunks):
+            if isinstance(stream, MessageStream):
+                for chunk in stream.content_stream:
+                    yield chunk
+            elif isinstance(stream, ToolStream):
+                logging.debug(f"Tool Use: {stream}")
 
-    for stream in parse_streaming_response(chunks):
-        if isinstance(stream, MessageStream):
-            for chunk in stream.content_stream:
-                yield chunk
-        elif isinstance(stream, ToolStream):
-            logging.debug(f"Tool Use: {stream}")
+    yield from cached_response_stream(model, agent, messages, stream_response)
@@ -1,13 +1,138 @@
 # Set your OpenAI API key
+import logging
 import os
+from dataclasses import dataclass, field
+from threading import Lock
+from types import SimpleNamespace
 from typing import Optional
+
+import httpx
 from openai import OpenAI
 from swarm import Swarm  # type: ignore[import]
 
+from token_world.llm.xplore.telemetry import record_usage
+
+
+@dataclass
+class ClientStats:
+    """Connection reuse counters for one pooled LLM client."""
+
+    base_url: str
+    model: str
+    requests: int = 0
+    connections_opened: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # The counters are updated from the classifier threads and the summary worker at once.
+    _lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    @property
+    def connections_reused(self) -> int:
+        return max(self.requests - self.connections_opened, 0)
+
+    @property
+    def prompt_cache_hit_ratio(self) -> float:
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def record_usage(self, usage):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        with self._lock:
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_prompt_tokens += cached_tokens
+            self.completion_tokens += usage.completion_tokens
+        record_usage(usage.prompt_tokens, usage.completion_tokens)
+        logging.info(
+            f"LLM usage: {usage.prompt_tokens} prompt tokens ({cached_tokens} cached), "
+            f"{usage.completion_tokens} completion tokens"
+        )
+
+
+class UsageRecordingCompletions:
+    """Wraps ``chat.completions`` to request usage data on streams and record it.
+
+    Swarm reads ``choices[0]`` of every chunk, so the trailing usage-only chunk is consumed here.
+    """
+
+    def __init__(self, completions, stats: ClientStats):
+        self.completions = completions
+        self.stats = stats
+
+    def create(self, **kwargs):
+        if not kwargs.get("stream") or os.getenv("OPENAI_STREAM_USAGE", "1") == "0":
+            return self.completions.create(**kwargs)
+        kwargs.setdefault("stream_options", {"include_usage": True})
+        return self._record_usage(self.completions.create(**kwargs))
+
+    def _record_usage(self, stream):
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    self.stats.record_usage(chunk.usage)
+                if chunk.choices:
+                    yield chunk
+        finally:
+            stream.close()
+
+
+ClientKey = tuple[Optional[str], Optional[str], str]
+
+_clients: dict[ClientKey, Swarm] = {}
+_client_stats: dict[ClientKey, ClientStats] = {}
+_clients_lock = Lock()
+
+
+def _http_client(stats: ClientStats) -> httpx.Client:
+    def trace(event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            stats.count_connection()
+
+    def on_request(request: httpx.Request):
+        stats.count_request()
+        request.extensions["trace"] = trace
+
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+        ),
+        timeout=httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "600")), connect=10.0),
+        event_hooks={"request": [on_request]},
+    )
+
+
+def llm_client(model: Optional[str] = None) -> Swarm:
+    """Return the process-wide client for the configured endpoint, API key and model.
+
+    Clients are created once and reused so that every agent call shares warm HTTP connections.
+    """
+    base_url, api_key = os.getenv("OPENAI_BASE_URL"), os.getenv("OPENAI_API_KEY")
+    key = (base_url, api_key, handle_base_model_arg(model))
+    with _clients_lock:
+        if key not in _clients:
+            stats = ClientStats(base_url=base_url or "<default>", model=key[2])
+            client = OpenAI(base_url=base_url, api_key=api_key, http_client=_http_client(stats))
+            # Swarm only uses ``client.chat.completions.create``.
+            completions = UsageRecordingCompletions(client.chat.completions, stats)
+            usage_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+            _clients[key] = Swarm(client=usage_client)
+            _client_stats[key] = stats
+        return _clients[key]
+
 
-def llm_client() -> Swarm:
-    client = OpenAI(base_url=os.getenv("OPENAI_BASE_URL"), api_key=os.getenv("OPENAI_API_KEY"))
-    return Swarm(client=client)
+def llm_client_stats() -> list[ClientStats]:
+    with _clients_lock:
+        return list(_client_stats.values())
 
 
 def handle_base_model_arg(model: Optional[str]) -> str:
@@ -0,0 +1,73 @@
+import logging
+from threading import Lock
+from typing import NamedTuple
+
+from sqlalchemy import func
+
+from token_world.llm.xplore.db import Message, MessageModel
+
+
+class ParsedMessage(NamedTuple):
+    """A message row kept in memory as the role/content dict that is sent to the LLM."""
+
+    id: int
+    message: Message
+
+    @property
+    def role(self) -> str:
+        return self.message["role"]
+
+    @property
+    def content(self) -> str:
+        return self.message["content"]
+
+
+_parsed_messages: dict[str, list[ParsedMessage]] = {}
+_parsed_messages_lock = Lock()
+
+
+def _load_messages(session, storyline_name: str, after_id: int = 0) -> list[ParsedMessage]:
+    rows = (
+        session.query(MessageModel.id, MessageModel.role, MessageModel.content)
+        .where(MessageModel.storyline_name == storyline_name)
+        .where(MessageModel.id > after_id)
+        .order_by(MessageModel.id)
+        .all()
+    )
+    return [
+        ParsedMessage(message_id, {"role": role, "content": content})
+        for message_id, role, content in rows
+    ]
+
+
+def get_parsed_messages(session, storyline_name: str) -> list[ParsedMessage]:
+    """Return all messages of a storyline in id order, loading only rows not seen before.
+
+    The cache is checked against the number of messages and the latest id of the storyline:
+    newer ids are appended incrementally, and any deletion, even one followed by new messages
+    from another process, leaves the counts mismatched and reloads the storyline.
+    """
+    n_messages, latest_id = (
+        session.query(func.count(MessageModel.id), func.max(MessageModel.id))
+        .where(MessageModel.storyline_name == storyline_name)
+        .one()
+    )
+    latest_id = latest_id or 0
+    with _parsed_messages_lock:
+        messages = _parsed_messages.get(storyline_name, [])
+        cached_id = messages[-1].id if messages else 0
+        if latest_id < cached_id:
+            messages, cached_id = [], 0
+        if latest_id > cached_id:
+            messages = messages + _load_messages(session, storyline_name, cached_id)
+        if len(messages) != n_messages:
+            logging.info(f"Messages of '{storyline_name}' were deleted, reloading them")
+            messages = _load_messages(session, storyline_name)
+        _parsed_messages[storyline_name] = messages
+        return messages
+
+
+def invalidate_parsed_messages(storyline_name: str):
+    """Drop the cached messages of a storyline, e.g. after some of them were deleted."""
+    with _parsed_messages_lock:
+        _parsed_messages.pop(storyline_name, None)
@@ -0,0 +1,276 @@
+import argparse
+import json
+import logging
+import re
+import time
+from typing import Callable, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Connection, bindparam, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Executable
+
+from token_world.llm.xplore.db import (
+    AgentGoalModel,
+    Base,
+    Message,
+    MessageModel,
+    MilestoneModel,
+    SchemaMigrationModel,
+    SummaryModel,
+    SummaryWorkerLeaseModel,
+    engine,
+    initialize_db,
+)
+from token_world.llm.xplore.tokens import count_tokens
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def add_summary_levels(connection: Connection):
+    """Rebuild a summaries table from before summary levels, keeping its rows as chunk summaries."""
+    if "level" in [column["name"] for column in inspect(connection).get_columns("summaries")]:
+        return
+    connection.execute(text("ALTER TABLE summaries RENAME TO summaries_old"))
+    SummaryModel.__table__.create(connection)
+    connection.execute(
+        text(
+            "INSERT INTO summaries (storyline_name, level, summary_until_id, content) "
+            "SELECT storyline_name, 0, summary_until_id, content FROM summaries_old"
+        )
+    )
+    connection.execute(text("DROP TABLE summaries_old"))
+
+
+def create_indexes(connection: Connection, *index_names: str):
+    """Create indexes declared on the models that an older database does not have yet."""
+    indexes = {
+        index.name: index for table in Base.metadata.sorted_tables for index in table.indexes
+    }
+    for index_name in index_names:
+        indexes[index_name].create(connection, checkfirst=True)
+
+
+def add_milestone_and_goal_indexes(connection: Connection):
+    create_indexes(
+        connection,
+        "ix_milestones_storyline_completed_order",
+        "ix_agent_goals_storyline_completed_name",
+    )
+
+
+MESSAGE_MIGRATION_BATCH_SIZE = 1000
+
+
+def parse_legacy_message(content: str) -> Message:
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        logging.warning(f"Keeping a message that is not JSON as a user message: {content[:100]}")
+        return {"role": "user", "content": content}
+
+
+def add_message_columns(connection: Connection):
+    """Split the JSON blobs of messages.content into role, text and token count columns.
+
+    Rows are converted in batches, so memory use does not grow with the length of the history.
+    """
+    if "role" in [column["name"] for column in inspect(connection).get_columns("messages")]:
+        return
+    for column in ("role VARCHAR", "created_at FLOAT", "token_count INTEGER"):
+        connection.execute(text(f"ALTER TABLE messages ADD COLUMN {column}"))
+    messages = MessageModel.__table__
+    update_message = (
+        update(messages)
+        .where(messages.c.storyline_name == bindparam("b_storyline_name"))
+        .where(messages.c.id == bindparam("b_id"))
+        .values(
+            role=bindparam("b_role"),
+            content=bindparam("b_content"),
+            token_count=bindparam("b_token_count"),
+        )
+    )
+    n_messages = 0
+    while rows := connection.execute(
+        select(messages.c.storyline_name, messages.c.id, messages.c.content)
+        .where(messages.c.role.is_(None))
+        .limit(MESSAGE_MIGRATION_BATCH_SIZE)
+    ).all():
+        batch = []
+        for storyline_name, message_id, content in rows:
+            message = parse_legacy_message(content)
+            batch.append(
+                {
+                    "b_storyline_name": storyline_name,
+                    "b_id": message_id,
+                    "b_role": message["role"],
+                    "b_content": message["content"],
+                    "b_token_count": count_tokens(message["content"]),
+                }
+            )
+        connection.execute(update_message, batch)
+        n_messages += len(batch)
+        logging.info(f"Converted {n_messages} messages to structured columns")
+
+
+def add_summary_worker_leases(connection: Connection):
+    SummaryWorkerLeaseModel.__table__.create(connection, checkfirst=True)
+
+
+# Append only: a migration must never change once released, since databases record its version.
+# Migrations run after ``create_all``, so they only have work to do on databases created earlier.
+MIGRATIONS = [
+    Migration(1, "add summary levels", add_summary_levels),
+    Migration(2, "add milestone and goal indexes", add_milestone_and_goal_indexes),
+    Migration(3, "add structured message columns", add_message_columns),
+    Migration(4, "add summary worker leases", add_summary_worker_leases),
+]
+
+
+# Key of the PostgreSQL advisory lock that serializes schema changes across replicas.
+SCHEMA_LOCK_KEY = 0x78706C6F7265
+
+
+def lock_schema(connection: Connection):
+    """Wait for other processes changing the schema, and hold them off until the transaction ends.
+
+    Must be the first statement of the transaction.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+    elif connection.dialect.name == "sqlite":
+        # Takes the database write lock up front, rather than at the first write.
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def run_migrations(engine: Engine) -> list[int]:
+    """Apply the migrations the database has not had yet, each in its own transaction.
+
+    Each transaction holds the schema lock and checks the version again under it, so replicas
+    starting together apply every migration exactly once. Returns the versions that were applied.
+    """
+    with engine.connect() as connection:
+        applied = set(connection.scalars(select(SchemaMigrationModel.version)))
+    applied_versions = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        with engine.begin() as connection:
+            lock_schema(connection)
+            if connection.scalar(
+                select(SchemaMigrationModel.version).where(
+                    SchemaMigrationModel.version == migration.version
+                )
+            ):
+                logging.info(f"Schema migration {migration.version} was already applied")
+                continue
+            logging.info(f"Applying schema migration {migration.version}: {migration.name}")
+            migration.upgrade(connection)
+            connection.execute(
+                SchemaMigrationModel.__table__.insert().values(
+                    version=migration.version, name=migration.name, applied_at=time.time()
+                )
+            )
+        applied_versions.append(migration.version)
+    return applied_versions
+
+
+def explain_query_plan(connection: Connection, statement: Executable) -> str:
+    """Return the database's query plan for the statement."""
+    sql = str(statement.compile(connection, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return "\n".join(str(row[-1]) for row in rows)
+    return "\n".join(str(row[0]) for row in connection.execute(text(f"EXPLAIN {sql}")))
+
+
+# The hot queries of a turn and the index each of them must be served by, None for the primary key.
+HOT_QUERIES: dict[str, tuple[Executable, Optional[str]]] = {
+    "active milestone": (
+        select(MilestoneModel)
+        .where(MilestoneModel.storyline_name == "storyline")
+        .where(MilestoneModel.completed.is_(False))
+        .order_by(MilestoneModel.order)
+        .limit(1),
+        "ix_milestones_storyline_completed_order",
+    ),
+    "active goals": (
+        select(AgentGoalModel)
+        .where(AgentGoalModel.storyline_name == "storyline")
+        .where(AgentGoalModel.completed.is_(False))
+        .order_by(AgentGoalModel.name),
+        "ix_agent_goals_storyline_completed_name",
+    ),
+    # Summaries and messages are served by their primary keys, which lead with the storyline.
+    # The summaries key (storyline_name, level, summary_until_id) covers the descending search.
+    "latest chunk summary": (
+        select(SummaryModel)
+        .where(SummaryModel.storyline_name == "storyline")
+        .where(SummaryModel.level == 0)
+        .where(SummaryModel.summary_until_id < 100)
+        .order_by(SummaryModel.summary_until_id.desc())
+        .limit(1),
+        None,
+    ),
+    "latest messages": (
+        select(MessageModel)
+        .where(MessageModel.storyline_name == "storyline")
+        .order_by(MessageModel.id.desc())
+        .limit(8),
+        None,
+    ),
+}
+
+
+# Plan lines of a full table scan or of sorting rows that an index should have returned in order.
+FULL_SCAN_PATTERN = re.compile(r"^SCAN \w+$|Seq Scan|TEMP B-TREE", re.MULTILINE)
+
+
+def check_query_plans(engine: Engine) -> dict[str, str]:
+    """Assert that every hot query is served by its index, without a table scan or a sort."""
+    plans = {}
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # Fresh tables are tiny, so make the planner show what it would do at scale.
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, (statement, index_name) in HOT_QUERIES.items():
+            plan = explain_query_plan(connection, statement)
+            plans[name] = plan
+            if FULL_SCAN_PATTERN.search(plan) or (index_name and index_name not in plan):
+                raise AssertionError(
+                    f"The {name} query is not served by {index_name or 'the primary key'}:\n{plan}"
+                )
+    return plans
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Migrate the database to the latest schema and check the hot query plans."
+    )
+    parser.add_argument(
+        "--check-plans",
+        action="store_true",
+        help="Assert that the hot queries are served by indexes after migrating.",
+    )
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    initialize_db()
+    if args.check_plans:
+        for name, plan in check_query_plans(engine).items():
+            logging.info(f"Query plan of {name}:\n{plan}")
+
+
+if __name__ == "__main__":
+    main()
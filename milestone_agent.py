@@ -1,22 +1,37 @@
 import logging
-from typing import Iterator, Optional
+from typing import Iterator, Optional, Union
 
-import streamlit as st
 from swarm import Agent  # type: ignore[import]
 from token_world.llm.stream_processing import MessageStream, ToolStream, parse_streaming_response
-from token_world.llm.xplore.conversation import get_current_messages
-from token_world.llm.xplore.db import session_scope
+from token_world.llm.xplore.answer_parser import ChoiceAnswerParser
+from token_world.llm.xplore.classifier_tools import (
+    MILESTONE_FUNCTIONS,
+    ToolCall,
+    reasoning_instructions,
+    stream_tool_calls,
+    use_classifier_tools,
+)
+from token_world.llm.xplore.conversation import ClassifierTask, get_current_messages
 from token_world.llm.xplore.llm import handle_base_model_arg, llm_client
+from token_world.llm.xplore.prompt_builder import PromptBuilder
+from token_world.llm.xplore.prompt_cache import record_prompt
+from token_world.llm.xplore.response_cache import cached_response_stream
 from token_world.llm.xplore.storyline import (
-    get_active_milestone,
     get_active_milestone_classification_example,
     get_active_milestone_markdown,
-    get_active_storyline_description,
     mark_milestone_completed,
 )
-from token_world.llm.xplore.summarize_agent import (
-    SummaryConversation,
-    draw_conversation_summary,
+from token_world.llm.xplore.summarize_agent import SummaryConversation
+from token_world.llm.xplore.telemetry import traced_stream
+from token_world.llm.xplore.turn_context import TurnContext
+from token_world.llm.xplore.turn_events import (
+    COMPLETED,
+    INCOMPLETE,
+    NOT_FOUND,
+    UNKNOWN_STATUS,
+    MilestoneUpdate,
+    Notice,
+    TurnEvent,
 )
 
 
@@ -29,32 +44,61 @@ SYSTEM_PROMPT = (
     "You will then be asked to perform various tasks involving managing the milestones. "
 )
 
+MILESTONE_CLASSIFICATION_MARKER = "MILESTONE CLASSIFICATION:"
+MILESTONE_CLASSIFICATION_CHOICES = ("INCOMPLETE", "COMPLETE")
+
+
+def handle_milestone_completion(
+    milestone_name: str, response_text: str, context: TurnContext
+) -> Iterator[TurnEvent]:
+    try:
+        completion_status = ChoiceAnswerParser(
+            MILESTONE_CLASSIFICATION_MARKER, MILESTONE_CLASSIFICATION_CHOICES
+        ).parse(response_text)
+    except ValueError:
+        completion_status = response_text.rsplit(MILESTONE_CLASSIFICATION_MARKER, 1)[-1].strip()
+    logging.info(f"Milestone classification: {completion_status}")
+    yield from apply_milestone_classification(milestone_name, completion_status, context)
+
 
-def handle_milestone_completion(milestone_name: str, response_text: str):
-    completion_status = response_text.rsplit("MILESTONE CLASSIFICATION:", 1)[-1].strip()
-    logging.info(f"Milestone classification part to parse: {completion_status}")
+def handle_milestone_completion_calls(
+    milestone_name: str, calls: list[ToolCall], context: TurnContext
+) -> Iterator[TurnEvent]:
+    """Complete the milestone if the agent called ``mark_milestone_completed``."""
+    completed = any(call.name == "mark_milestone_completed" for call in calls)
+    yield from apply_milestone_classification(
+        milestone_name, "COMPLETE" if completed else "INCOMPLETE", context
+    )
 
+
+def apply_milestone_classification(
+    milestone_name: str, completion_status: str, context: TurnContext
+) -> Iterator[TurnEvent]:
     if completion_status == "INCOMPLETE":
-        st.info(f"Milestone '{milestone_name}' is incomplete.")
         logging.info(f"Milestone '{milestone_name}' is incomplete.")
+        yield MilestoneUpdate(milestone_name, INCOMPLETE)
     elif completion_status == "COMPLETE":
-        if mark_milestone_completed(milestone_name):
-            st.success(f"Milestone '{milestone_name}' marked as completed.")
+        if mark_milestone_completed(milestone_name, context.storyline_name):
+            context.invalidate()
             logging.info(f"Milestone '{milestone_name}' marked as completed.")
+            yield MilestoneUpdate(milestone_name, COMPLETED)
         else:
-            st.warning(f"Milestone '{milestone_name}' not found.")
             logging.warning(f"Milestone '{milestone_name}' not found.")
+            yield MilestoneUpdate(milestone_name, NOT_FOUND)
     else:
-        st.error(
-            f"Unknown completion status '{completion_status}' for milestone '{milestone_name}'."
-        )
         logging.error(
             f"Unknown completion status '{completion_status}' for milestone '{milestone_name}'."
         )
+        yield MilestoneUpdate(milestone_name, UNKNOWN_STATUS, completion_status)
 
 
+@traced_stream("generate_milestone_classification")
 def generate_milestone_classification(
-    summary: str, ai_prompt: str, user_prompt: str, model: Optional[str] = None
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
 ) -> Iterator[str]:
     model = handle_base_model_arg(model)
     try:
@@ -65,29 +109,20 @@ def generate_milestone_classification(
 {summary}
 
 """
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": f"""Can you help me classify the current milestone
-  as either INCOMPLETE/COMPLETE based on the conversation so far?
-
-Let's me start by giving you some context about the overall storyline of the game:
-{get_active_storyline_description()}
-
-{summary_prompt}And here are the most recent messages:
-## Recent Messages
----
-AI: {ai_prompt}
----
-User: {user_prompt}
----
+        example = get_active_milestone_classification_example(context)
 
-Finally, here is the current milestone of the AI character you need to classify:
-{get_active_milestone_markdown()}
+        def render(
+            storyline: str, summary_prompt: str, ai_prompt: str, user_prompt: str, milestone: str
+        ) -> str:
+            # Static instructions and the storyline come first and volatile context last, so that
+            # the prompt prefix stays byte-identical across turns and provider prompt caches hit.
+            return f"""Can you help me classify the current milestone
+  as either INCOMPLETE/COMPLETE based on the conversation so far?
 
-Given this milestone and the overall storyline,
- can you determine if the most recent messages of the AI satisfy the milestone?
+You will be given the overall storyline of the game, a summary of the conversation so far,
+ the most recent messages and the current milestone of the AI character.
+Given the milestone and the overall storyline,
+ determine if the most recent messages of the AI satisfy the milestone.
 Think step-by-step showing your thought process, but don't overcomplicate things,
     keep the reasoning simple and concise (1-3 sentences), and then provide your answer.
 Be conservative and look for clear evidence from the conversation
@@ -111,10 +146,42 @@ Notice that 'MILESTONE CLASSIFICATION:' is case sensitive,
     and the classification must be either 'INCOMPLETE' or 'COMPLETE'.
 ALWAYS OUTPUT 'MILESTONE CLASSIFICATION:' FOLLOWED BY THE CLASSIFICATION.
 
+Here is some context about the overall storyline of the game:
+{storyline}
+
 For example:
 ---
-{get_active_milestone_classification_example()}
-""",
+{example}
+---
+
+{summary_prompt}And here are the most recent messages:
+## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
+
+Finally, here is the current milestone of the AI character you need to classify:
+{milestone}
+
+Do the most recent messages of the AI satisfy this milestone?
+"""
+
+        # Fill the prompt by priority: instructions, milestone, storyline, summary, recent messages.
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", "", ""))
+        milestone = builder.fit("milestone", get_active_milestone_markdown(context))
+        storyline = builder.fit("storyline", context.storyline_description)
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Milestone Completion Classifier")
+        messages = [
+            {
+                "role": "user",
+                "content": render(storyline, summary_prompt, ai_prompt, user_prompt, milestone),
             },
         ]
         logging.info(f"Generating response for {messages[-1]} messages")
@@ -126,52 +193,124 @@ For example:
             stream=True,
         )
 
-        chunks = llm_client().run(agent, messages, stream=True)
-        for chunk in parse_streaming_response(chunks):
-            if isinstance(chunk, MessageStream):
-                for content in chunk.content_stream:
-                    yield content
-            elif isinstance(chunk, ToolStream):
-                logging.info(f"Tool Use: {chunk}")
+        def stream_response() -> Iterator[str]:
+            record_prompt(agent.name, agent.instructions, messages)
+            chunks = llm_client(model).run(agent, messages, stream=True)
+            for chunk in parse_streaming_response(chunks):
+                if isinstance(chunk, MessageStream):
+                    for content in chunk.content_stream:
+                        yield content
+                elif isinstance(chunk, ToolStream):
+                    logging.info(f"Tool Use: {chunk}")
+
+        yield from cached_response_stream(
+            model,
+            agent,
+            messages,
+            stream_response,
+            answer=ChoiceAnswerParser(
+                MILESTONE_CLASSIFICATION_MARKER, MILESTONE_CLASSIFICATION_CHOICES
+            ),
+        )
     except Exception as e:
-        st.error(f"Error generating response: {e}.")
-        return logging.error(f"Error generating response: {e}", exc_info=True)
-
-
-def show_milestone_completion_classification(summary: SummaryConversation):
-    with st.spinner("Detecting milestone completion..."):
-        logging.info("Detecting milestone completion...")
-        with session_scope() as session:
-            active_milestone = get_active_milestone(session)
-            if not active_milestone:
-                st.write("All milestones completed.")
-                return
-
-            current_messages = get_current_messages(summary)
-            if not current_messages or current_messages.ai is None:
-                st.warning("No messages to process.")
-                return
-            stream = generate_milestone_classification(
-                str(summary.latest_summary.content) if summary.latest_summary else "",
-                current_messages.ai.content_val if current_messages.ai else "",
-                current_messages.user.content_val,
-            )
-            text_response = str(st.write_stream(stream))
-            logging.debug(f"Milestone completion classification response: {text_response}")
-            handle_milestone_completion(str(active_milestone.name), text_response)
-    st.info("Milestone completion classification complete.")
-
-
-def show_milestone_management():
-    logging.info("Showing milestone management...")
-    with session_scope() as session:
-        with st.expander("📜 Conversation Summary", expanded=True):
-            summary = draw_conversation_summary(session, max_messages=2)
-            if not summary or summary.is_summary_required():
-                st.error("Summary required...")
-                st.rerun()
-                return
-
-        logging.info("Summarization for milestones complete...")
-        with st.expander("🔖 Milestone Management", expanded=True):
-            show_milestone_completion_classification(summary)
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+@traced_stream("generate_milestone_classification_calls")
+def generate_milestone_classification_calls(
+    context: TurnContext,
+    summary: str,
+    ai_prompt: str,
+    user_prompt: str,
+    calls: list[ToolCall],
+    model: Optional[str] = None,
+) -> Iterator[str]:
+    """Like ``generate_milestone_classification``, but the agent calls
+    ``mark_milestone_completed`` instead."""
+    model = handle_base_model_arg(model)
+    try:
+        summary_prompt = f"## Summary\n{summary}\n\n" if summary else ""
+
+        def render(
+            storyline: str, summary_prompt: str, ai_prompt: str, user_prompt: str, milestone: str
+        ) -> str:
+            return f"""You will be given the overall storyline of the game, a summary of the
+ conversation so far, the most recent messages and the current milestone of the AI character.
+Determine if the most recent messages of the AI satisfy the milestone.
+Be conservative and only call `mark_milestone_completed`
+ when there is clear evidence in the conversation.
+If the milestone is not satisfied, do not call any function.
+{reasoning_instructions()}
+
+## Storyline
+{storyline}
+
+{summary_prompt}## Recent Messages
+---
+AI: {ai_prompt}
+---
+User: {user_prompt}
+---
+
+## Current Milestone
+{milestone}
+"""
+
+        builder = PromptBuilder(model)
+        builder.reserve("system", SYSTEM_PROMPT)
+        builder.reserve("instructions", render("", "", "", "", ""))
+        milestone = builder.fit("milestone", get_active_milestone_markdown(context))
+        storyline = builder.fit("storyline", context.storyline_description)
+        summary_prompt = builder.fit("summary", summary_prompt)
+        user_prompt = builder.fit("recent messages", user_prompt)
+        ai_prompt = builder.fit("recent messages", ai_prompt)
+        builder.log_usage("Milestone Completion Tool Classifier")
+        messages = [
+            {
+                "role": "user",
+                "content": render(storyline, summary_prompt, ai_prompt, user_prompt, milestone),
+            },
+        ]
+
+        agent = Agent(
+            name="Milestone Completion Tool Classifier",
+            model=model,
+            instructions=SYSTEM_PROMPT,
+            functions=MILESTONE_FUNCTIONS,
+        )
+        yield from stream_tool_calls(model, agent, messages, calls)
+    except Exception as e:
+        logging.error(f"Error generating response: {e}", exc_info=True)
+        raise
+
+
+def prepare_milestone_classification(
+    summary: SummaryConversation, context: TurnContext
+) -> Union[ClassifierTask, Notice]:
+    """Return the classification to run, or a notice saying why there is none this turn."""
+    logging.info("Preparing milestone completion classification...")
+    active_milestone = context.active_milestone
+    if not active_milestone:
+        return Notice("info", "All milestones completed.")
+    milestone_name = active_milestone.name
+
+    current_messages = get_current_messages(summary)
+    if not current_messages or current_messages.ai is None:
+        return Notice("warning", "No messages to process.")
+    ai_prompt = current_messages.ai.content_val if current_messages.ai else ""
+    if use_classifier_tools():
+        calls: list[ToolCall] = []
+        stream = generate_milestone_classification_calls(
+            context, summary.summary_context, ai_prompt, current_messages.user.content_val, calls
+        )
+        return ClassifierTask(
+            stream, lambda _: handle_milestone_completion_calls(milestone_name, calls, context)
+        )
+    stream = generate_milestone_classification(
+        context, summary.summary_context, ai_prompt, current_messages.user.content_val
+    )
+    return ClassifierTask(
+        stream,
+        lambda response_text: handle_milestone_completion(milestone_name, response_text, context),
+    )
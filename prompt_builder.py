@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from token_world.llm.xplore.db import Message
+from token_world.llm.xplore.tokens import count_tokens, truncate_to_tokens
+
+# Prompt token budgets per model, overridable with a JSON object in XPLORE_PROMPT_TOKEN_BUDGETS.
+PROMPT_TOKEN_BUDGETS = {
+    "gpt-3.5-turbo": 12_000,
+    "gpt-4": 6_000,
+    "gpt-4o": 32_000,
+    "gpt-4o-mini": 32_000,
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 6_000
+# Tokens added by the chat format around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def prompt_token_budget(model: str) -> int:
+    budgets = {**PROMPT_TOKEN_BUDGETS, **json.loads(os.getenv("XPLORE_PROMPT_TOKEN_BUDGETS", "{}"))}
+    return int(budgets.get(model, DEFAULT_PROMPT_TOKEN_BUDGET))
+
+
+class PromptBuilder:
+    """Fits prompt sections into the token budget of a model.
+
+    Sections are admitted in the order they are passed to ``reserve``/``fit``, so callers add them
+    by priority: system instructions, milestone, goals, summary and finally recent messages.
+    Whatever no longer fits is truncated, or for message lists dropped oldest first.
+    """
+
+    def __init__(self, model: str, budget: Optional[int] = None):
+        self.model = model
+        self.budget = budget if budget is not None else prompt_token_budget(model)
+        self.remaining = self.budget
+        self.section_tokens: dict[str, int] = {}
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def _use(self, name: str, n_tokens: int):
+        self.remaining -= n_tokens
+        self.section_tokens[name] = self.section_tokens.get(name, 0) + n_tokens
+
+    def reserve(self, name: str, text: str) -> str:
+        """Admit text that must always be sent, such as instructions and templates."""
+        self._use(name, self.count(text) + MESSAGE_OVERHEAD_TOKENS)
+        return text
+
+    def fit(self, name: str, text: str) -> str:
+        """Admit as much of the text as still fits in the budget."""
+        text = truncate_to_tokens(text, max(self.remaining, 0), self.model)
+        self._use(name, self.count(text))
+        return text
+
+    def fit_messages(self, name: str, messages: list[Message]) -> list[Message]:
+        """Admit the newest messages that fit, always keeping the last one."""
+        fitted: list[Message] = []
+        for i, message in enumerate(reversed(messages)):
+            n_tokens = self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            if i > 0 and n_tokens > self.remaining:
+                break
+            if n_tokens > self.remaining:
+                # The overhead first, so that the content is fitted into what is left after it.
+                self._use(name, MESSAGE_OVERHEAD_TOKENS)
+                message = {**message, "content": self.fit(name, message["content"])}
+            else:
+                self._use(name, n_tokens)
+            fitted.append(message)
+        if len(fitted) < len(messages):
+            logging.info(f"Dropped {len(messages) - len(fitted)} {name} to fit the prompt budget")
+        return list(reversed(fitted))
+
+    def log_usage(self, agent_name: str):
+        logging.info(
+            f"{agent_name} prompt uses {self.budget - self.remaining}/{self.budget} tokens: "
+            f"{self.section_tokens}"
+        )
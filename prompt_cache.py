@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from threading import Lock
+
+from token_world.llm.xplore.db import Message
+from token_world.llm.xplore.telemetry import record_prompt_text
+
+
+@dataclass
+class PromptPrefixStats:
+    """How much of each agent's prompt was byte-identical to its previous prompt."""
+
+    agent_name: str
+    calls: int = 0
+    prompt_bytes: int = 0
+    stable_prefix_bytes: int = 0
+
+    @property
+    def stable_prefix_ratio(self) -> float:
+        return self.stable_prefix_bytes / self.prompt_bytes if self.prompt_bytes else 0.0
+
+
+_last_prompts: dict[str, bytes] = {}
+_prefix_stats: dict[str, PromptPrefixStats] = {}
+_prefix_lock = Lock()
+
+
+def serialize_prompt(instructions: str, messages: list[Message]) -> bytes:
+    """Serialize a prompt the way it is sent: the agent instructions followed by the messages."""
+    return json.dumps(
+        [{"role": "system", "content": instructions}, *messages], ensure_ascii=False
+    ).encode()
+
+
+def stable_prefix_length(previous: bytes, current: bytes) -> int:
+    return len(os.path.commonprefix([previous, current]))
+
+
+def record_prompt(agent_name: str, instructions: str, messages: list[Message]) -> int:
+    """Record a prompt and return how many leading bytes it shares with the agent's last prompt.
+
+    Provider prompt caches only hit on identical prefixes, so a ratio that drops between turns
+    means something volatile has crept into the start of the prompt.
+    """
+    prompt = serialize_prompt(instructions, messages)
+    with _prefix_lock:
+        previous = _last_prompts.get(agent_name, b"")
+        _last_prompts[agent_name] = prompt
+        stats = _prefix_stats.setdefault(agent_name, PromptPrefixStats(agent_name))
+        n_stable = stable_prefix_length(previous, prompt)
+        stats.calls += 1
+        stats.prompt_bytes += len(prompt)
+        stats.stable_prefix_bytes += n_stable
+    logging.info(
+        f"{agent_name} prompt shares {n_stable}/{len(prompt)} leading bytes with its last prompt"
+    )
+    record_prompt_text(instructions + "".join(message["content"] for message in messages))
+    return n_stable
+
+
+def prompt_prefix_stats() -> list[PromptPrefixStats]:
+    with _prefix_lock:
+        return list(_prefix_stats.values())
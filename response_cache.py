@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from token_world.llm.xplore.answer_parser import AnswerParser, until_answer
+from token_world.llm.xplore.db import Message
+from token_world.llm.xplore.prompt_cache import serialize_prompt
+
+
+def cache_key(model: str, agent_name: str, instructions: str, messages: list[Message]) -> str:
+    digest = hashlib.sha256(f"{model}\0{agent_name}\0".encode())
+    digest.update(serialize_prompt(instructions, messages))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded, LRU-evicted on-disk cache of complete LLM responses with a TTL."""
+
+    def __init__(self, path: str, max_bytes: int, max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection for one transaction and close it afterwards.
+
+        A sqlite3 connection's own context manager only commits or rolls back, it never closes.
+        """
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection, connection:
+            yield connection
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl_seconds:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._evict(connection, now)
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM responses")
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        n_entries, total_size = connection.execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM responses"
+        ).fetchone()
+        if n_entries <= self.max_entries and total_size <= self.max_bytes:
+            return
+        evict_keys = []
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if n_entries <= self.max_entries and total_size <= self.max_bytes:
+                break
+            evict_keys.append((key,))
+            n_entries -= 1
+            total_size -= size
+        connection.executemany("DELETE FROM responses WHERE key = ?", evict_keys)
+        logging.info(f"Evicted {len(evict_keys)} cached LLM responses")
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if XPLORE_LLM_CACHE is 0."""
+    global _response_cache
+    if os.getenv("XPLORE_LLM_CACHE", "1") == "0":
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            path=os.getenv("XPLORE_LLM_CACHE_PATH", "llm_cache.db"),
+            max_bytes=int(os.getenv("XPLORE_LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_entries=int(os.getenv("XPLORE_LLM_CACHE_MAX_ENTRIES", "10000")),
+            ttl_seconds=float(os.getenv("XPLORE_LLM_CACHE_TTL", str(7 * 24 * 60 * 60))),
+        )
+    return _response_cache
+
+
+def replay_stream(response: str) -> Iterator[str]:
+    """Yield a cached response word by word, like a live stream."""
+    yield from re.findall(r"\s*\S+\s*|\s+", response)
+
+
+def cached_response_stream(
+    model: str,
+    agent: Any,
+    messages: list[Message],
+    stream: Callable[[], Iterator[str]],
+    answer: Optional[AnswerParser] = None,
+) -> Iterator[str]:
+    """Stream an agent response from the cache, or from ``stream`` and cache it once complete.
+
+    With an ``answer`` parser the stream is closed as soon as the answer is complete, and the
+    response is cached up to there. A response without a complete answer is not cached, so that
+    a truncated or malformed one is not replayed to every retry. A consumer that closes the
+    stream early caches nothing.
+    Only use this for agents whose output is a deterministic function of their prompt.
+    """
+
+    def read_stream() -> Iterator[str]:
+        return stream() if answer is None else until_answer(stream(), answer)
+
+    cache = get_response_cache()
+    if cache is None:
+        yield from read_stream()
+        return
+    key = cache_key(model, agent.name, agent.instructions, messages)
+    if (response := cache.get(key)) is not None:
+        logging.info(f"Replaying cached {agent.name} response")
+        yield from replay_stream(response)
+        return
+    chunks = []
+    for chunk in read_stream():
+        chunks.append(chunk)
+        yield chunk
+    if answer is None or answer.complete:
+        cache.put(key, "".join(chunks))
+    else:
+        logging.warning(f"Not caching the {agent.name} response, as it has no complete answer")
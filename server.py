@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from threading import Thread
+from typing import Any, AsyncIterator, Optional
+
+import uvicorn
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from token_world.llm.xplore.archive import delete_storyline_rows
+from token_world.llm.xplore.db import (
+    CharacterModel,
+    MessageModel,
+    MilestoneModel,
+    StorylineModel,
+    engine,
+    initialize_db,
+    session_scope,
+)
+from token_world.llm.xplore.summary_worker import SummaryWorker, is_summary_worker_enabled
+from token_world.llm.xplore.telemetry import prometheus_metrics
+from token_world.llm.xplore.turn_context import load_turn_snapshot
+from token_world.llm.xplore.turn_engine import TurnEngine
+from token_world.llm.xplore.turn_events import GoalUpdate, MilestoneUpdate, Notice, TurnEvent
+
+# Turns played at once. The engine is synchronous, so every turn in progress holds a thread while
+# idle connections cost nothing; further turns wait for a free slot.
+MAX_CONCURRENT_TURNS = int(os.getenv("XPLORE_SERVER_MAX_TURNS", "64"))
+MAX_MESSAGES_PAGE_SIZE = 1000
+
+
+class TurnSlots:
+    """Limits the turns in progress, and allows one at a time per storyline."""
+
+    def __init__(self, max_turns: int):
+        self.semaphore = asyncio.Semaphore(max_turns)
+        self.storylines: set[str] = set()
+
+    async def acquire(self, storyline_name: str):
+        if storyline_name in self.storylines:
+            raise HTTPException(409, f"A turn of storyline '{storyline_name}' is in progress.")
+        self.storylines.add(storyline_name)
+        try:
+            await self.semaphore.acquire()
+        except BaseException:
+            # The request was cancelled while it waited, so the storyline must not stay busy.
+            self.storylines.discard(storyline_name)
+            raise
+
+    def release(self, storyline_name: str):
+        self.storylines.discard(storyline_name)
+        self.semaphore.release()
+
+
+def event_to_dict(event: TurnEvent) -> dict[str, Any]:
+    event_dict = {"type": type(event).__name__, **event._asdict()}
+    if isinstance(event, (MilestoneUpdate, GoalUpdate)):
+        event_dict.update(level=event.level, message=event.message)
+    return event_dict
+
+
+def format_sse(event: TurnEvent) -> str:
+    data = json.dumps(event_to_dict(event), ensure_ascii=False)
+    return f"event: {type(event).__name__}\ndata: {data}\n\n"
+
+
+async def start_turn(
+    slots: TurnSlots,
+    storyline_name: str,
+    user_message: Optional[str] = None,
+    regenerate_from: Optional[int] = None,
+) -> AsyncIterator[TurnEvent]:
+    """Start a turn on a thread of its own and return its events as they arrive on the event loop.
+
+    The turn runs to completion even if the client goes away, so that its messages are saved.
+    """
+    await slots.acquire(storyline_name)
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def put(event: Optional[TurnEvent]):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def play():
+        try:
+            for event in TurnEngine(storyline_name).run_turn(user_message, regenerate_from):
+                put(event)
+        except Exception as e:
+            logging.error(f"Turn of '{storyline_name}' failed: {e}", exc_info=True)
+            put(Notice("error", f"The turn failed: {e}."))
+        finally:
+            loop.call_soon_threadsafe(slots.release, storyline_name)
+            put(None)
+
+    Thread(target=play, name=f"turn-{storyline_name}", daemon=True).start()
+
+    async def drain() -> AsyncIterator[TurnEvent]:
+        while (event := await events.get()) is not None:
+            yield event
+
+    return drain()
+
+
+def parse_turn_request(body: Any) -> tuple[Optional[str], Optional[int]]:
+    if not isinstance(body, dict):
+        raise HTTPException(400, "The request body must be a JSON object.")
+    content, regenerate_from = body.get("content"), body.get("regenerate_from")
+    if content is not None and not isinstance(content, str):
+        raise HTTPException(400, "content must be a string.")
+    if regenerate_from is not None and not isinstance(regenerate_from, int):
+        raise HTTPException(400, "regenerate_from must be a message id.")
+    if not content and regenerate_from is None:
+        raise HTTPException(400, "Send either the content of a message or regenerate_from.")
+    return content, regenerate_from
+
+
+async def read_json(request: Request) -> dict[str, Any]:
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(400, "The request body must be JSON.")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "The request body must be a JSON object.")
+    return body
+
+
+def require_storyline(storyline_name: str):
+    with session_scope("require_storyline") as session:
+        if session.get(StorylineModel, storyline_name) is None:
+            raise HTTPException(404, f"Storyline '{storyline_name}' does not exist.")
+
+
+def get_storyline(storyline_name: str) -> dict[str, Any]:
+    snapshot = load_turn_snapshot(storyline_name)
+    if snapshot.storyline_description is None:
+        raise HTTPException(404, f"Storyline '{storyline_name}' does not exist.")
+    return {
+        "name": snapshot.storyline_name,
+        "description": snapshot.storyline_description,
+        "characters": snapshot.character_names,
+        "milestones": [milestone._asdict() for milestone in snapshot.milestones],
+        "goals": [goal._asdict() for goal in snapshot.goals],
+    }
+
+
+def validate_storyline(body: dict[str, Any]):
+    """Reject characters and milestones that would not fit the tables, before touching them."""
+    characters = body.get("characters", {})
+    if not isinstance(characters, dict) or not all(
+        isinstance(character_type, str) and isinstance(name, str)
+        for character_type, name in characters.items()
+    ):
+        raise HTTPException(400, "characters must map character types to names.")
+    milestones = body.get("milestones", [])
+    if not isinstance(milestones, list) or not all(
+        isinstance(milestone, dict)
+        and isinstance(milestone.get("name"), str)
+        and milestone["name"]
+        and isinstance(milestone.get("description", ""), str)
+        and isinstance(milestone.get("completed", False), bool)
+        for milestone in milestones
+    ):
+        raise HTTPException(
+            400, "milestones must be a list of {name, description, completed} objects."
+        )
+    if len({milestone["name"] for milestone in milestones}) != len(milestones):
+        raise HTTPException(400, "Milestone names must be unique.")
+
+
+def save_storyline(storyline_name: str, body: dict[str, Any], create: bool):
+    """Create or update a storyline, replacing its characters and milestones if they are given."""
+    validate_storyline(body)
+    with session_scope("save_storyline") as session:
+        storyline = session.get(StorylineModel, storyline_name)
+        if create and storyline:
+            raise HTTPException(409, f"Storyline '{storyline_name}' already exists.")
+        if not create and not storyline:
+            raise HTTPException(404, f"Storyline '{storyline_name}' does not exist.")
+        if storyline is None:
+            storyline = StorylineModel(name=storyline_name, description="")
+            session.add(storyline)
+        if "description" in body:
+            storyline.description = str(body["description"])
+        if "characters" in body:
+            session.query(CharacterModel).where(
+                CharacterModel.storyline_name == storyline_name
+            ).delete()
+            for character_type, name in body["characters"].items():
+                session.add(
+                    CharacterModel(storyline_name=storyline_name, type=character_type, name=name)
+                )
+        if "milestones" in body:
+            session.query(MilestoneModel).where(
+                MilestoneModel.storyline_name == storyline_name
+            ).delete()
+            for order, milestone in enumerate(body["milestones"], 1):
+                session.add(
+                    MilestoneModel(
+                        storyline_name=storyline_name,
+                        name=milestone["name"],
+                        order=order,
+                        description=milestone.get("description", ""),
+                        completed=milestone.get("completed", False),
+                    )
+                )
+
+
+def list_storylines() -> list[dict[str, str]]:
+    with session_scope("list_storylines") as session:
+        return [
+            {"name": str(name), "description": str(description)}
+            for name, description in session.query(StorylineModel.name, StorylineModel.description)
+            .order_by(StorylineModel.name)
+            .all()
+        ]
+
+
+def delete_storyline(storyline_name: str):
+    with engine.begin() as connection:
+        delete_storyline_rows(connection, storyline_name)
+
+
+def list_messages(storyline_name: str, after_id: int, limit: int) -> list[dict[str, Any]]:
+    with session_scope("list_messages") as session:
+        messages = (
+            session.query(MessageModel.id, MessageModel.role, MessageModel.content)
+            .where(MessageModel.storyline_name == storyline_name)
+            .where(MessageModel.id > after_id)
+            .order_by(MessageModel.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            {"id": message_id, "role": role, "content": content}
+            for message_id, role, content in messages
+        ]
+
+
+async def storylines_endpoint(request: Request) -> Response:
+    if request.method == "GET":
+        return JSONResponse(await run_in_threadpool(list_storylines))
+    body = await read_json(request)
+    if not body.get("name"):
+        raise HTTPException(400, "A storyline needs a name.")
+    await run_in_threadpool(save_storyline, str(body["name"]), body, True)
+    return JSONResponse(await run_in_threadpool(get_storyline, str(body["name"])), 201)
+
+
+async def storyline_endpoint(request: Request) -> Response:
+    storyline_name = request.path_params["name"]
+    if request.method == "PUT":
+        await run_in_threadpool(save_storyline, storyline_name, await read_json(request), False)
+    elif request.method == "DELETE":
+        await run_in_threadpool(delete_storyline, storyline_name)
+        return Response(status_code=204)
+    return JSONResponse(await run_in_threadpool(get_storyline, storyline_name))
+
+
+async def messages_endpoint(request: Request) -> Response:
+    """List the messages of a storyline, or send one and stream the turn as server-sent events."""
+    storyline_name = request.path_params["name"]
+    await run_in_threadpool(require_storyline, storyline_name)
+    if request.method == "GET":
+        try:
+            after_id = int(request.query_params.get("after_id", 0))
+            limit = min(int(request.query_params.get("limit", 100)), MAX_MESSAGES_PAGE_SIZE)
+        except ValueError:
+            raise HTTPException(400, "after_id and limit must be integers.")
+        return JSONResponse(
+            await run_in_threadpool(list_messages, storyline_name, after_id, limit)
+        )
+
+    content, regenerate_from = parse_turn_request(await read_json(request))
+    events = await start_turn(
+        request.app.state.turn_slots, storyline_name, content, regenerate_from
+    )
+
+    async def sse() -> AsyncIterator[str]:
+        async for event in events:
+            yield format_sse(event)
+
+    return StreamingResponse(sse(), media_type="text/event-stream")
+
+
+async def play_websocket(websocket: WebSocket):
+    """Play turns over a WebSocket: every {"content"} or {"regenerate_from"} sent streams a turn."""
+    storyline_name = websocket.path_params["name"]
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                content, regenerate_from = parse_turn_request(await websocket.receive_json())
+                await run_in_threadpool(require_storyline, storyline_name)
+                events = await start_turn(
+                    websocket.app.state.turn_slots, storyline_name, content, regenerate_from
+                )
+            except (HTTPException, json.JSONDecodeError) as e:
+                message = e.detail if isinstance(e, HTTPException) else "Send a JSON object."
+                await websocket.send_json(event_to_dict(Notice("error", message)))
+                continue
+            async for event in events:
+                await websocket.send_json(event_to_dict(event))
+    except WebSocketDisconnect:
+        logging.info(f"WebSocket of '{storyline_name}' disconnected")
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Expose the turn telemetry for Prometheus to scrape."""
+    return PlainTextResponse(
+        prometheus_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    await run_in_threadpool(initialize_db)
+    app.state.turn_slots = TurnSlots(MAX_CONCURRENT_TURNS)
+    worker = None
+    if is_summary_worker_enabled():
+        worker = SummaryWorker()
+        worker.start()
+    yield
+    if worker:
+        worker.stop()
+
+
+app = Starlette(
+    routes=[
+        Route("/storylines", storylines_endpoint, methods=["GET", "POST"]),
+        Route("/storylines/{name}", storyline_endpoint, methods=["GET", "PUT", "DELETE"]),
+        Route("/storylines/{name}/messages", messages_endpoint, methods=["GET", "POST"]),
+        WebSocketRoute("/storylines/{name}/play", play_websocket),
+        Route("/metrics", metrics_endpoint),
+    ],
+    lifespan=lifespan,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="HTTP and WebSocket server of the turn engine.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level.lower())
+
+
+if __name__ == "__main__":
+    main()
@@ -28,7 +28,7 @@ def draw_sidebar():
             goal_editor()
 
         with tab4:
-            with session_scope() as session:
+            with session_scope("draw_sidebar") as session:
                 draw_conversation_summary(session)
 
         with tab5:
@@ -11,10 +11,11 @@ from token_world.llm.xplore.db import (
     session_scope,
 )
 from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.turn_context import TurnContext
 
 
 def get_active_storyline_description() -> Optional[str]:
-    with session_scope() as session:
+    with session_scope("get_active_storyline_description") as session:
         storyline = (
             session.query(StorylineModel)
             .where(StorylineModel.name == get_active_storyline())
@@ -27,7 +28,7 @@ def get_active_storyline_description() -> Optional[str]:
 
 
 def storyline_form():
-    with session_scope() as session:
+    with session_scope("storyline_form") as session:
         with st.form(key="new_storyline"):
             storyline_name = st.text_input("Storyline Name")
             if st.form_submit_button("➕ New Storyline"):
@@ -56,7 +57,7 @@ def storyline_form():
 
     st.subheader("📖 Storyline")
     with st.form(key="storyline_form"):
-        with session_scope() as session:
+        with session_scope("storyline_form") as session:
             storyline_description = st.text_area(
                 "Enter the AI character prompt here...",
                 value=storyline_description if storyline else None,
@@ -65,7 +66,7 @@ def storyline_form():
 
         save_button = st.form_submit_button("Save")
         if save_button:
-            with session_scope() as session:
+            with session_scope("storyline_form") as session:
                 session.merge(
                     StorylineModel(name=storyline_name, description=storyline_description)
                 )
@@ -74,7 +75,7 @@ def storyline_form():
 
         delete_button = st.form_submit_button("🗑️ Delete")
         if delete_button:
-            with session_scope() as session:
+            with session_scope("storyline_form") as session:
                 storyline_to_delete = (
                     session.query(StorylineModel)
                     .where(StorylineModel.name == storyline_name)
@@ -97,7 +98,7 @@ def storyline_form():
     # if st.button("Bulk Add Milestones"):
     st.json(bulk_milestone_prompt)
     if st.button("Bulk Add Milestones"):
-        with session_scope() as session:
+        with session_scope("storyline_form") as session:
             for i, milestone in enumerate(json.loads(bulk_milestone_prompt)):
                 new_milestone = MilestoneModel(
                     storyline_name=storyline_name,
@@ -111,7 +112,7 @@ def storyline_form():
         st.success("Bulk milestones added!")
         st.rerun()
 
-    with session_scope() as session:
+    with session_scope("storyline_form") as session:
         milestones = (
             session.query(MilestoneModel)
             .where(MilestoneModel.storyline_name == get_active_storyline())
@@ -130,7 +131,7 @@ def storyline_form():
                 col1, col2 = st.columns([1, 1])
                 with col1:
                     if st.form_submit_button("💾 Save Changes"):
-                        with session_scope() as session:
+                        with session_scope("storyline_form") as session:
                             milestone_to_update = (
                                 session.query(MilestoneModel)
                                 .where(MilestoneModel.storyline_name == get_active_storyline())
@@ -144,7 +145,7 @@ def storyline_form():
                             st.success(f"Milestone '{milestone_name}' updated!")
                 with col2:
                     if st.form_submit_button("🗑️ Delete"):
-                        with session_scope() as session:
+                        with session_scope("storyline_form") as session:
                             milestone_to_delete = (
                                 session.query(MilestoneModel)
                                 .where(MilestoneModel.storyline_name == get_active_storyline())
@@ -164,7 +165,7 @@ def storyline_form():
             milestone_description = st.text_area("Milestone Description", height=150)
             add_button = st.form_submit_button("➕ Add milestone")
             if add_button:
-                with session_scope() as session:
+                with session_scope("storyline_form") as session:
                     new_milestone = MilestoneModel(
                         storyline_name=get_active_storyline(),
                         name=milestone_name,
@@ -193,24 +194,23 @@ def get_active_milestone(session) -> Optional[MilestoneModel]:
     return milestone
 
 
-def get_active_milestone_markdown() -> str:
-    with session_scope() as session:
-        milestone = get_active_milestone(session)
-        if not milestone:
-            logging.info("All milestones complete. No milestones remaining.")
-            return "<All milestones complete. No milestones remaining.>"
+def get_active_milestone_markdown(context: TurnContext) -> str:
+    milestone = context.active_milestone
+    if not milestone:
+        logging.info("All milestones complete. No milestones remaining.")
+        return "<All milestones complete. No milestones remaining.>"
 
-        logging.info(f"Current milestone: '{milestone.name}'")
-        return f"""## Milestone#{milestone.order}: {milestone.name}
+    logging.info(f"Current milestone: '{milestone.name}'")
+    return f"""## Milestone#{milestone.order}: {milestone.name}
     {milestone.description}
     """
 
 
-def mark_milestone_completed(milestone_name: str):
-    with session_scope() as session:
+def mark_milestone_completed(milestone_name: str, storyline_name: str):
+    with session_scope("mark_milestone_completed") as session:
         milestone = (
             session.query(MilestoneModel)
-            .where(MilestoneModel.storyline_name == get_active_storyline())
+            .where(MilestoneModel.storyline_name == storyline_name)
             .where(MilestoneModel.name == milestone_name)
             .first()
         )
@@ -222,12 +222,11 @@ def mark_milestone_completed(milestone_name: str):
         return False
 
 
-def get_active_milestone_classification_example() -> str:
-    with session_scope() as session:
-        milestone = get_active_milestone(session)
-        if not milestone:
-            return "<All milestones complete. No milestones remaining.>"
-        return f"""An example of an INCOMPLETE classification output:
+def get_active_milestone_classification_example(context: TurnContext) -> str:
+    milestone = context.active_milestone
+    if not milestone:
+        return "<All milestones complete. No milestones remaining.>"
+    return f"""An example of an INCOMPLETE classification output:
 
 ## Internal Milestone Completion Classification Reasoning
 
@@ -0,0 +1,514 @@
+import argparse
+import hashlib
+import json
+import logging
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+import httpx
+
+from token_world.llm.xplore.tokens import count_tokens
+
+# A scripted response is its text, or {"content": text, "tool_calls": [{"name", "arguments"}]},
+# or a function of the prompt text that returns its text.
+ScriptedResponse = Union[str, dict[str, Any], Callable[[str], str]]
+
+
+def batch_completions_answer(prompt: str) -> str:
+    """Answer that none of the turns of a batch classification request completed anything."""
+    turn_ids = re.findall(r"^## Turn (\d+)$", prompt, re.MULTILINE)
+    answer = json.dumps({turn_id: {} for turn_id in turn_ids})
+    return "None of the turns shows clear evidence of completing anything.\n\n" + (
+        f"BATCH COMPLETIONS: {answer}"
+    )
+
+
+# Scripted responses as (pattern, response): the first pattern found in the prompt answers it.
+# The defaults give every agent of a turn a well-formed answer, so that whole turns run offline.
+DEFAULT_SCRIPT: list[tuple[str, ScriptedResponse]] = [
+    # Agents in tool mode name the functions they may call in their prompts.
+    (
+        "`mark_milestone_completed`",
+        {"content": "There is no clear evidence yet that the milestone has been reached."},
+    ),
+    (
+        "`mark_goal_completed`",
+        {"content": "The AI has not yet done anything that clearly satisfies one of its goals."},
+    ),
+    (
+        "`create_goal`",
+        {"content": "The existing goals cover what the AI is working towards."},
+    ),
+    (
+        "NEW GOALS:",
+        """## Internal Goal Creation Reasoning
+
+### Step 1: Understand the conversation so far
+The AI is following the current milestone and its goals still apply.
+
+### Step 2: Decide if it any new goal needs to be created
+The existing goals cover what the AI is working towards.
+Hence, I suggest no new goals are required.
+
+NEW GOALS: {}""",
+    ),
+    (
+        "MILESTONE CLASSIFICATION:",
+        """## Internal Milestone Completion Classification Reasoning
+
+### Step 1: Understand the conversation so far
+The conversation is still making its way towards the milestone.
+
+### Step 2: Classify the milestone as completed or not
+There is no clear evidence yet that the milestone has been reached.
+Hence, I classify this milestone as INCOMPLETE.
+
+MILESTONE CLASSIFICATION: INCOMPLETE""",
+    ),
+    (
+        "GOAL CLASSIFICATIONS:",
+        """## Internal Goal Completion Classification Reasoning
+
+### Step 1: Understand the conversation so far
+The AI has not yet done anything that clearly satisfies one of its goals.
+
+GOAL CLASSIFICATIONS: {}""",
+    ),
+    ("BATCH COMPLETIONS:", batch_completions_answer),
+    (
+        "SUMMARY:",
+        "The user and the AI continued their adventure. They talked about where to go next, "
+        "shared what they had learned so far and agreed to keep heading towards their goal.",
+    ),
+    (
+        "",
+        "The lantern light flickers across the old stone walls as I lean closer, lowering my "
+        "voice. \"You came a long way to hear this, so listen carefully. The path ahead splits "
+        "at the river. One way is quick and dangerous, the other slow and safe, and the choice "
+        "is yours.\" I wait, watching your face for an answer, the smell of rain drifting in "
+        "through the open door.",
+    ),
+]
+# Streamed responses are split into word-sized chunks, roughly one token each.
+TOKEN_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+class Recording(NamedTuple):
+    key: str
+    model: str
+    messages: list[dict[str, Any]]
+    chunks: list[str]
+    # Seconds to the first chunk and to the end of the stream, as measured upstream.
+    ttft: float
+    duration: float
+    # Functions the response called, as {"name", "arguments"} with the arguments as sent.
+    tool_calls: list[dict[str, Any]] = []
+
+
+class Reply(NamedTuple):
+    chunks: list[str]
+    ttft: float
+    # Seconds between chunks after the first.
+    interval: float
+    # Functions to call after the text, as {"name", "arguments"}.
+    tool_calls: list[dict[str, Any]] = []
+
+
+def request_key(body: dict[str, Any]) -> str:
+    """Identify a completion request by everything that determines its response."""
+    prompt = {key: body.get(key) for key in ("model", "messages", "tools", "tool_choice")}
+    return hashlib.sha256(json.dumps(prompt, sort_keys=True).encode()).hexdigest()
+
+
+def prompt_text(body: dict[str, Any]) -> str:
+    return "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+
+
+def load_script(path: str) -> list[tuple[str, ScriptedResponse]]:
+    """Load scripted responses from JSONL lines of {"pattern": regex, "response": text}.
+
+    The response can also be {"content": text, "tool_calls": [{"name", "arguments"}]}.
+    """
+    with open(path) as file:
+        rules = [json.loads(line) for line in file if line.strip()]
+    return [(rule["pattern"], rule["response"]) for rule in rules]
+
+
+def load_recordings(path: str) -> dict[str, Recording]:
+    recordings = {}
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                recording = Recording(**json.loads(line))
+                recordings[recording.key] = recording
+    return recordings
+
+
+def completion_chunk(
+    completion_id: str, model: str, delta: dict[str, Any], finish_reason: Optional[str] = None
+) -> dict[str, Any]:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def arguments_json(call: dict[str, Any]) -> str:
+    """Serialize the arguments of a call, keeping recorded ones as they were sent."""
+    arguments = call.get("arguments", {})
+    return arguments if isinstance(arguments, str) else json.dumps(arguments)
+
+
+def tool_call_deltas(tool_calls: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    return [
+        {
+            "index": i,
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": call["name"], "arguments": arguments_json(call)},
+        }
+        for i, call in enumerate(tool_calls)
+    ]
+
+
+def reply_completion(reply: Reply) -> str:
+    """Return the text the reply is billed for, including the arguments of its tool calls."""
+    return "".join(reply.chunks) + "".join(json.dumps(call) for call in reply.tool_calls)
+
+
+def usage(body: dict[str, Any], completion: str) -> dict[str, Any]:
+    prompt_tokens = count_tokens(prompt_text(body))
+    completion_tokens = count_tokens(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """A local OpenAI-compatible chat completions endpoint for offline tests and benchmarks.
+
+    Responses are scripted, or replayed from recordings when ``replay_path`` is given, and are
+    streamed after ``ttft`` seconds at ``tokens_per_second`` (0 for no delay). With ``upstream``
+    the server instead proxies a real endpoint and appends every exchange to ``record_path``.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        script: Optional[list[tuple[str, ScriptedResponse]]] = None,
+        ttft: float = 0.0,
+        tokens_per_second: float = 0.0,
+        replay_path: Optional[str] = None,
+        replay_miss: str = "error",
+        recorded_timing: bool = False,
+        upstream: Optional[str] = None,
+        record_path: Optional[str] = None,
+    ):
+        super().__init__(address, StubLLMHandler)
+        self.script = [(re.compile(pattern), response) for pattern, response in script or []]
+        self.script += [(re.compile(re.escape(marker)), text) for marker, text in DEFAULT_SCRIPT]
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.recordings = load_recordings(replay_path) if replay_path else None
+        self.replay_miss = replay_miss
+        self.recorded_timing = recorded_timing
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.upstream_client = httpx.Client(timeout=600) if upstream else None
+        self.record_path = record_path
+        self._record_lock = Lock()
+        self.n_requests = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        """Serve on a background thread and return the base URL to use as ``OPENAI_BASE_URL``."""
+        Thread(target=self.serve_forever, name="stub-llm", daemon=True).start()
+        logging.info(f"Stub LLM server listening on {self.base_url}")
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reply(self, body: dict[str, Any]) -> Optional[Reply]:
+        """Return the response to a request, or None if replaying and it was never recorded."""
+        self.n_requests += 1
+        interval = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+        if self.recordings is not None:
+            recording = self.recordings.get(request_key(body))
+            if recording and self.recorded_timing:
+                n_intervals = max(len(recording.chunks) - 1, 1)
+                recorded_interval = (recording.duration - recording.ttft) / n_intervals
+                return Reply(
+                    recording.chunks, recording.ttft, recorded_interval, recording.tool_calls
+                )
+            if recording:
+                return Reply(recording.chunks, self.ttft, interval, recording.tool_calls)
+            logging.warning(f"No recording of request {request_key(body)}")
+            if self.replay_miss == "error":
+                return None
+        text = prompt_text(body)
+        response = next(response for pattern, response in self.script if pattern.search(text))
+        if callable(response):
+            response = response(text)
+        if isinstance(response, dict):
+            return Reply(
+                TOKEN_PATTERN.findall(response.get("content", "")),
+                self.ttft,
+                interval,
+                response.get("tool_calls", []),
+            )
+        return Reply(TOKEN_PATTERN.findall(response), self.ttft, interval)
+
+    def record(self, recording: Recording):
+        if not self.record_path:
+            return
+        with self._record_lock, open(self.record_path, "a") as file:
+            file.write(json.dumps(recording._asdict(), ensure_ascii=False) + "\n")
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StubLLMServer
+
+    def log_message(self, format: str, *args):
+        logging.debug(f"Stub LLM: {format % args}")
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients close streams once they have the answer they need.
+            logging.debug("Stub LLM: the client closed the connection")
+
+    def send_json(self, status: int, data: dict[str, Any]):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, {"error": {"message": message, "type": "stub_error"}})
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_event(self, line: str):
+        data = f"{line}\n\n".encode()
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error_json(404, f"Unknown path {self.path}")
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.server.upstream:
+            self.proxy(body)
+            return
+        reply = self.server.reply(body)
+        if reply is None:
+            self.send_error_json(404, "The request was not recorded.")
+        elif body.get("stream"):
+            self.stream_reply(body, reply)
+        else:
+            time.sleep(reply.ttft + reply.interval * max(len(reply.chunks) - 1, 0))
+            message: dict[str, Any] = {"role": "assistant", "content": "".join(reply.chunks)}
+            if reply.tool_calls:
+                message["tool_calls"] = [
+                    {key: value for key, value in call.items() if key != "index"}
+                    for call in tool_call_deltas(reply.tool_calls)
+                ]
+            self.send_json(
+                200,
+                {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": message,
+                            "finish_reason": "tool_calls" if reply.tool_calls else "stop",
+                        }
+                    ],
+                    "usage": usage(body, reply_completion(reply)),
+                },
+            )
+
+    def stream_reply(self, body: dict[str, Any], reply: Reply):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model", "stub")
+        self.start_stream()
+        time.sleep(reply.ttft)
+        for i, chunk in enumerate(reply.chunks):
+            if i and reply.interval:
+                time.sleep(reply.interval)
+            delta = {"role": "assistant", "content": chunk} if i == 0 else {"content": chunk}
+            self.write_event(f"data: {json.dumps(completion_chunk(completion_id, model, delta))}")
+        for i, tool_call in enumerate(tool_call_deltas(reply.tool_calls)):
+            tool_delta: dict[str, Any] = {"tool_calls": [tool_call]}
+            if i == 0 and not reply.chunks:
+                tool_delta["role"] = "assistant"
+            tool_chunk = completion_chunk(completion_id, model, tool_delta)
+            self.write_event(f"data: {json.dumps(tool_chunk)}")
+        finish_reason = "tool_calls" if reply.tool_calls else "stop"
+        stop_chunk = completion_chunk(completion_id, model, {}, finish_reason)
+        self.write_event(f"data: {json.dumps(stop_chunk)}")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final_chunk = completion_chunk(completion_id, model, {})
+            final_chunk.update(choices=[], usage=usage(body, reply_completion(reply)))
+            self.write_event(f"data: {json.dumps(final_chunk)}")
+        self.write_event("data: [DONE]")
+        self.end_stream()
+
+    def proxy(self, body: dict[str, Any]):
+        """Relay the request to the upstream endpoint as it streams, and record the exchange."""
+        headers = {"Authorization": self.headers.get("Authorization", "")}
+        start = time.perf_counter()
+        chunks: list[str] = []
+        # Calls streamed in pieces, by their index: the name comes first, then the arguments.
+        tool_calls: dict[int, dict[str, Any]] = {}
+        ttft = 0.0
+        assert self.server.upstream_client is not None
+        with self.server.upstream_client.stream(
+            "POST", f"{self.server.upstream}/chat/completions", json=body, headers=headers
+        ) as response:
+            if response.status_code != 200 or not body.get("stream"):
+                data = json.loads(response.read())
+                self.send_json(response.status_code, data)
+                if response.status_code != 200:
+                    return
+                ttft = time.perf_counter() - start
+                message = data["choices"][0]["message"]
+                chunks = [message.get("content") or ""]
+                for i, call in enumerate(message.get("tool_calls") or []):
+                    tool_calls[i] = dict(call["function"])
+            else:
+                self.start_stream()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    self.write_event(line)
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    for choice in json.loads(line[len("data: ") :]).get("choices", []):
+                        delta = choice.get("delta") or {}
+                        if content := delta.get("content"):
+                            ttft = ttft or time.perf_counter() - start
+                            chunks.append(content)
+                        for call_delta in delta.get("tool_calls") or []:
+                            ttft = ttft or time.perf_counter() - start
+                            call = tool_calls.setdefault(
+                                call_delta.get("index", 0), {"name": "", "arguments": ""}
+                            )
+                            function = call_delta.get("function") or {}
+                            call["name"] += function.get("name") or ""
+                            call["arguments"] += function.get("arguments") or ""
+                self.end_stream()
+        self.server.record(
+            Recording(
+                request_key(body),
+                body.get("model", ""),
+                body.get("messages", []),
+                chunks,
+                ttft,
+                time.perf_counter() - start,
+                [tool_calls[i] for i in sorted(tool_calls)],
+            )
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible stub LLM server with scripted, recorded and replayed "
+        "streaming responses. Point OPENAI_BASE_URL at the URL it prints."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on.")
+    parser.add_argument(
+        "--ttft", type=float, default=0.0, help="Seconds before the first token is streamed."
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=0.0, help="Streaming rate, 0 for no delay."
+    )
+    parser.add_argument(
+        "--script", help='JSONL of {"pattern", "response"} rules tried before the defaults.'
+    )
+    parser.add_argument("--replay", help="JSONL recordings to answer requests from.")
+    parser.add_argument(
+        "--replay-miss",
+        choices=["error", "script"],
+        default="error",
+        help="Answer requests that were not recorded with an error or with the script.",
+    )
+    parser.add_argument(
+        "--recorded-timing",
+        action="store_true",
+        help="Replay the recorded time to first token and streaming rate.",
+    )
+    parser.add_argument("--upstream", help="Proxy this OpenAI-compatible base URL and record.")
+    parser.add_argument("--record", help="JSONL file to append the proxied exchanges to.")
+    parser.add_argument("--log-level", default="info", help="Logging level.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    if args.record and not args.upstream:
+        raise SystemExit("--record needs --upstream to record from.")
+    server = StubLLMServer(
+        (args.host, args.port),
+        script=load_script(args.script) if args.script else None,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        replay_path=args.replay,
+        replay_miss=args.replay_miss,
+        recorded_timing=args.recorded_timing,
+        upstream=args.upstream,
+        record_path=args.record,
+    )
+    logging.info(f"Stub LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
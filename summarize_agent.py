@@ -1,33 +1,121 @@
 import logging
+from threading import Lock
 from time import sleep
-from typing import Iterator, Optional
+from typing import Any, Generator, Iterator, NamedTuple, Optional
 
+from sqlalchemy import func
 import streamlit as st
 from swarm import Agent  # type: ignore[import]
 from token_world.llm.stream_processing import MessageStream, ToolStream, parse_streaming_response
-from token_world.llm.xplore.conversation import SummaryConversation
+from token_world.llm.xplore.conversation import SummaryConversation, format_transcript
 from token_world.llm.xplore.db import (
     MessageModel,
     SummaryModel,
 )
 from token_world.llm.xplore.llm import handle_base_model_arg, llm_client
+from token_world.llm.xplore.prompt_builder import PromptBuilder
+from token_world.llm.xplore.prompt_cache import record_prompt
 from token_world.llm.xplore.session_state import get_active_storyline
+from token_world.llm.xplore.telemetry import traced_stream
+from token_world.llm.xplore.tokens import truncate_to_tokens
+from token_world.llm.xplore.turn_events import SummaryChunk
+
+# Summary levels: chunks summarize messages, chapters summarize chunks and the arc is a rolling
+# summary of chapters. Together they bound the summary context regardless of storyline length.
+CHUNK, CHAPTER, ARC = 0, 1, 2
+SUMMARY_LEVEL_NAMES = {CHUNK: "recent events", CHAPTER: "chapter", ARC: "story arc"}
+SUMMARY_TOKEN_BUDGETS = {CHUNK: 300, CHAPTER: 600, ARC: 1000}
+CHUNKS_PER_CHAPTER = 4
+CHAPTERS_PER_ARC = 4
+
+_summary_locks: dict[str, Lock] = {}
+_summary_locks_lock = Lock()
 
 SYSTEM_PROMPT = "You are a helpful assistant who is an expert and providing detailed summaries of "
 "conversations."
 
 
+def summary_lock(storyline_name: str) -> Lock:
+    """Lock held while a summary for the storyline is being generated and stored."""
+    with _summary_locks_lock:
+        return _summary_locks.setdefault(storyline_name, Lock())
+
+
+class SummaryRollUp(NamedTuple):
+    level: int
+    summary_until_id: int
+    previous_arc: Optional[str]
+    parts: list[str]
+
+
+def get_summary_context(session, storyline_name: str, until_id: int) -> str:
+    """Assemble the arc, chapter and chunk summaries covering messages up to ``until_id``.
+
+    Every level contributes a bounded number of summaries, each cut to its token budget.
+    """
+    sections = []
+    covered_until_id = 0
+    levels = ((ARC, 1), (CHAPTER, CHAPTERS_PER_ARC), (CHUNK, CHUNKS_PER_CHAPTER))
+    for level, max_summaries in levels:
+        summaries = (
+            session.query(SummaryModel)
+            .where(SummaryModel.storyline_name == storyline_name)
+            .where(SummaryModel.level == level)
+            .where(SummaryModel.summary_until_id > covered_until_id)
+            .where(SummaryModel.summary_until_id <= until_id)
+            .order_by(SummaryModel.summary_until_id.desc())
+            .limit(max_summaries)
+            .all()
+        )
+        for summary in reversed(summaries):
+            content = truncate_to_tokens(str(summary.content), SUMMARY_TOKEN_BUDGETS[level])
+            sections.append(f"### {SUMMARY_LEVEL_NAMES[level].capitalize()}\n{content}")
+        if summaries:
+            covered_until_id = summaries[0].summary_until_id
+    return "\n\n".join(sections)
+
+
+def get_pending_rollup(session, storyline_name: str) -> Optional[SummaryRollUp]:
+    """Return the next chapter or arc summary that has enough parts to be written, if any."""
+    for level, n_parts in ((CHAPTER, CHUNKS_PER_CHAPTER), (ARC, CHAPTERS_PER_ARC)):
+        latest = (
+            session.query(SummaryModel)
+            .where(SummaryModel.storyline_name == storyline_name)
+            .where(SummaryModel.level == level)
+            .order_by(SummaryModel.summary_until_id.desc())
+            .first()
+        )
+        parts = (
+            session.query(SummaryModel)
+            .where(SummaryModel.storyline_name == storyline_name)
+            .where(SummaryModel.level == level - 1)
+            .where(SummaryModel.summary_until_id > (latest.summary_until_id if latest else 0))
+            .order_by(SummaryModel.summary_until_id)
+            .limit(n_parts)
+            .all()
+        )
+        if len(parts) < n_parts:
+            continue
+        previous_arc = str(latest.content) if latest and level == ARC else None
+        return SummaryRollUp(
+            level, parts[-1].summary_until_id, previous_arc, [str(part.content) for part in parts]
+        )
+    return None
+
+
 def get_summary_conversation(
     session,
     latest_message: Optional[MessageModel] = None,
     max_messages: int = 8,
     min_messages: int = 2,
+    storyline_name: Optional[str] = None,
 ) -> SummaryConversation:
+    storyline_name = storyline_name or get_active_storyline()
     new_messages_query = session.query(MessageModel).where(
-        MessageModel.storyline_name == get_active_storyline()
+        MessageModel.storyline_name == storyline_name
     )
     if latest_message:
-        new_messages_query.where(MessageModel.id <= latest_message.id)
+        new_messages_query = new_messages_query.where(MessageModel.id <= latest_message.id)
     new_messages = new_messages_query.order_by(MessageModel.id.desc()).limit(max_messages).all()
     new_messages = list(reversed(new_messages))
     logging.debug(
@@ -38,7 +126,8 @@ def get_summary_conversation(
 
     latest_summary = (
         session.query(SummaryModel)
-        .where(SummaryModel.storyline_name == get_active_storyline())
+        .where(SummaryModel.storyline_name == storyline_name)
+        .where(SummaryModel.level == CHUNK)
         .where(SummaryModel.summary_until_id < new_messages[-min_messages].id)
         .order_by(SummaryModel.summary_until_id.desc())
         .first()
@@ -47,7 +136,7 @@ def get_summary_conversation(
     logging.debug(f"Found latest summary ID: {latest_summary_id}")
     messages_to_summarize = (
         session.query(MessageModel)
-        .where(MessageModel.storyline_name == get_active_storyline())
+        .where(MessageModel.storyline_name == storyline_name)
         .where(
             MessageModel.id > latest_summary_id, MessageModel.id < new_messages[-min_messages].id
         )
@@ -57,55 +146,124 @@ def get_summary_conversation(
         f"Found {len(messages_to_summarize)} messages to summarize: "
         f"{[message.id for message in messages_to_summarize]}"
     )
-    return SummaryConversation(latest_summary, messages_to_summarize, new_messages)
+    summary_context = (
+        get_summary_context(session, storyline_name, latest_summary_id) if latest_summary else ""
+    )
+    return SummaryConversation(
+        latest_summary, messages_to_summarize, new_messages, summary_context
+    )
 
 
+@traced_stream("generate_summary")
 def generate_summary(
     conversation: SummaryConversation, model: Optional[str] = None
 ) -> Iterator[str]:
     model = handle_base_model_arg(model)
     prev_summary_prompt = (
-        f"""Let me first give you a summary of the conversation so far:
-## Summary
-{conversation.latest_summary.content}
+        f"""For context, here is a summary of the story before these messages:
+## Story So Far
+{conversation.summary_context}
 
 """
-        if conversation.latest_summary
+        if conversation.summary_context
         else ""
     )
+    max_words = SUMMARY_TOKEN_BUDGETS[CHUNK] * 3 // 4
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": f"""The following conversation is between a user and an AI in a
+    def render(prev_summary_prompt: str, recent_messages: str) -> str:
+        # Static instructions come first so that the prompt prefix is identical across calls.
+        return f"""The following conversation is between a user and an AI in a
 roleplaying game.
-{prev_summary_prompt}
-Here are the most recent messages between the user and the AI:
-## Recent Messages
-{[message.content for message in conversation.messages_to_summarize]}
-
-Can you please provide a detailed summary of the conversation so far?
+Can you please provide a detailed summary of the recent messages given below?
 1. Make sure you don't miss out any important details.
 2. Do not output anything other than the summary.
-3. The conversations can vary in length, so don't worry if you summary is as small as 1 paragraph,
-   or as large as 12 paragraphs long!
+3. Only summarize the recent messages, the story so far is already summarized.
+4. Use at most {max_words} words.
    The important point is that you preserve all the important details,
    especially the most recent little details.
 
+{prev_summary_prompt}Here are the most recent messages between the user and the AI:
+## Recent Messages
+{recent_messages}
+
+SUMMARY:
+"""
+
+    # Fill the prompt by priority: instructions, messages to summarize and then the story so far.
+    builder = PromptBuilder(model)
+    builder.reserve("system", SYSTEM_PROMPT)
+    builder.reserve("instructions", render("", ""))
+    recent_messages = builder.fit(
+        "recent messages",
+        format_transcript(conversation.messages_to_summarize),
+    )
+    prev_summary_prompt = builder.fit("summary", prev_summary_prompt)
+    builder.log_usage("Summarizer")
+    messages = [{"role": "user", "content": render(prev_summary_prompt, recent_messages)}]
+
+    agent = Agent(
+        name="Goal Manager",
+        model=model,
+        instructions=SYSTEM_PROMPT,
+        stream=True,
+    )
+
+    record_prompt(agent.name, agent.instructions, messages)
+    chunks = llm_client(model).run(agent, messages, stream=True)
+    for chunk in parse_streaming_response(chunks):
+        if isinstance(chunk, MessageStream):
+            for content in chunk.content_stream:
+                yield content
+        elif isinstance(chunk, ToolStream):
+            logging.info(f"Tool Use: {chunk}")
+
+
+@traced_stream("generate_rollup")
+def generate_rollup(rollup: SummaryRollUp, model: Optional[str] = None) -> Iterator[str]:
+    model = handle_base_model_arg(model)
+    level_name = SUMMARY_LEVEL_NAMES[rollup.level]
+    part_name = SUMMARY_LEVEL_NAMES[rollup.level - 1]
+    previous_arc_prompt = (
+        f"""Here is the story arc up to these summaries:
+## Story Arc
+{rollup.previous_arc}
+
+"""
+        if rollup.previous_arc
+        else ""
+    )
+    parts = "\n\n".join(
+        f"### {part_name.capitalize()} {i}\n{part}" for i, part in enumerate(rollup.parts, 1)
+    )
+    max_words = SUMMARY_TOKEN_BUDGETS[rollup.level] * 3 // 4
+
+    messages = [
+        {
+            "role": "user",
+            "content": f"""The following are consecutive summaries ({part_name}) of a conversation
+between a user and an AI in a roleplaying game.
+{previous_arc_prompt}## Summaries
+{parts}
+
+Can you please condense them into a single {level_name} summary?
+1. Keep the characters, places, promises and unresolved threads that matter for the story.
+2. Do not output anything other than the summary.
+3. Use at most {max_words} words.
+
 SUMMARY:
 """,
         },
     ]
 
     agent = Agent(
-        name="Goal Manager",
+        name="Summary Roll-Up",
         model=model,
         instructions=SYSTEM_PROMPT,
         stream=True,
     )
 
-    chunks = llm_client().run(agent, messages, stream=True)
+    record_prompt(agent.name, agent.instructions, messages)
+    chunks = llm_client(model).run(agent, messages, stream=True)
     for chunk in parse_streaming_response(chunks):
         if isinstance(chunk, MessageStream):
             for content in chunk.content_stream:
@@ -114,47 +272,126 @@ SUMMARY:
             logging.info(f"Tool Use: {chunk}")
 
 
+def stream_rollups(session, storyline_name: str) -> Iterator[SummaryChunk]:
+    """Write every pending chapter and arc summary of the storyline, yielding them as they stream.
+
+    Each summary is stored once it has streamed completely.
+    """
+    while (rollup := get_pending_rollup(session, storyline_name)) is not None:
+        logging.info(
+            f"Rolling up {len(rollup.parts)} summaries of '{storyline_name}' into a "
+            f"{SUMMARY_LEVEL_NAMES[rollup.level]} until message {rollup.summary_until_id}"
+        )
+        chunks = []
+        for text in generate_rollup(rollup):
+            chunks.append(text)
+            yield SummaryChunk(rollup.level, rollup.summary_until_id, text)
+        session.merge(
+            SummaryModel(
+                storyline_name=storyline_name,
+                level=rollup.level,
+                summary_until_id=rollup.summary_until_id,
+                content="".join(chunks),
+            )
+        )
+        session.commit()
+
+
+def roll_up_summaries(session, storyline_name: str) -> int:
+    """Write every pending chapter and arc summary of the storyline and return how many."""
+    rollups = {chunk[:2] for chunk in stream_rollups(session, storyline_name)}
+    return len(rollups)
+
+
+def summarize_conversation(
+    session,
+    storyline_name: str,
+    max_messages: int = 8,
+    min_messages: int = 2,
+) -> Generator[SummaryChunk, None, SummaryConversation]:
+    """Summarize the messages before the most recent ones, yielding the summaries as they stream.
+
+    Returns the conversation with every older message summarized, ready for the agents.
+    """
+    with summary_lock(storyline_name):
+        conversation = get_summary_conversation(
+            session,
+            max_messages=max_messages,
+            min_messages=min_messages,
+            storyline_name=storyline_name,
+        )
+        logging.info(
+            f"Conversation has {len(conversation.messages_to_summarize)} to summarize "
+            f"{[message.id for message in conversation.messages_to_summarize]} "
+            f"and {len(conversation.new_messages)} new messages "
+            f"{[message.id for message in conversation.new_messages]}."
+        )
+        if not conversation.is_summary_required():
+            return conversation
+
+        summary_until_id = conversation.messages_to_summarize[-1].id
+        chunks = []
+        for text in generate_summary(conversation):
+            chunks.append(text)
+            yield SummaryChunk(CHUNK, summary_until_id, text)
+        session.merge(
+            SummaryModel(
+                storyline_name=storyline_name,
+                level=CHUNK,
+                summary_until_id=summary_until_id,
+                content="".join(chunks),
+            )
+        )
+        session.commit()
+        yield from stream_rollups(session, storyline_name)
+        return get_summary_conversation(
+            session,
+            max_messages=max_messages,
+            min_messages=min_messages,
+            storyline_name=storyline_name,
+        )
+
+
+class SummaryPainter:
+    """Paints every summary into its own placeholder as its chunks stream in."""
+
+    def __init__(self):
+        self._placeholders: dict[tuple[int, int], Any] = {}
+        self._texts: dict[tuple[int, int], str] = {}
+
+    @property
+    def n_summaries(self) -> int:
+        return len(self._texts)
+
+    def paint(self, chunk: SummaryChunk):
+        key = (chunk.level, chunk.summary_until_id)
+        if key not in self._texts:
+            self._placeholders[key] = st.empty()
+            self._texts[key] = ""
+        self._texts[key] += chunk.text
+        self._placeholders[key].markdown(self._texts[key])
+
+
 def draw_conversation_summary(
     session,
     max_messages: int = 8,
     min_messages: int = 2,
 ) -> Optional[SummaryConversation]:
     try:
+        painter = SummaryPainter()
         with st.spinner("Summarizing conversation..."):
-            conversation = get_summary_conversation(
-                session, max_messages=max_messages, min_messages=min_messages
+            summarizer = summarize_conversation(
+                session, get_active_storyline(), max_messages, min_messages
             )
-            logging.info(
-                f"Conversation has {len(conversation.messages_to_summarize)} to summarize "
-                f"{[message.id for message in conversation.messages_to_summarize]} "
-                f"and {len(conversation.new_messages)} new messages "
-                f"{[message.id for message in conversation.new_messages]}."
-            )
-            if conversation.is_summary_required():
-                messages_to_summarize = conversation.messages_to_summarize
-                with st.spinner(
-                    f"Summarizing {len(messages_to_summarize)} new messages "
-                    f"({messages_to_summarize[0].id}..{messages_to_summarize[-1].id}) ..."
-                ):
-                    stream = generate_summary(conversation)
-                    text_content = st.write_stream(stream)
-                    conversation = SummaryModel(
-                        storyline_name=get_active_storyline(),
-                        summary_until_id=messages_to_summarize[-1].id,
-                        content=text_content,
-                    )
-                    session.add(conversation)
-                    session.commit()
-                    conversation = get_summary_conversation(
-                        session,
-                        max_messages=max_messages,
-                        min_messages=min_messages,
-                    )
-            elif conversation.latest_summary:
-                st.markdown(conversation.latest_summary.content)
-            else:
-                st.write("No conversation to summarize.")
-            return conversation
+            while True:
+                try:
+                    painter.paint(next(summarizer))
+                except StopIteration as stop:
+                    conversation = stop.value
+                    break
+        if not painter.n_summaries:
+            st.markdown(conversation.summary_context or "No conversation to summarize.")
+        return conversation
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
@@ -164,3 +401,31 @@ def draw_conversation_summary(
                 sleep(0.5)
             st.rerun()
         return None
+
+
+class LazySummaryConversation:
+    """Defers ``draw_conversation_summary`` until a caller actually needs the summary.
+
+    Results are memoized per (storyline, latest message id), so rendering many messages in one
+    rerun resolves the summary at most once, while deleting messages still triggers a refresh.
+    """
+
+    def __init__(self, session, max_messages: int = 8, min_messages: int = 2):
+        self.session = session
+        self.max_messages = max_messages
+        self.min_messages = min_messages
+        self._resolved: dict[tuple[str, int], Optional[SummaryConversation]] = {}
+
+    def get(self) -> Optional[SummaryConversation]:
+        storyline_name = get_active_storyline()
+        latest_message_id = (
+            self.session.query(func.max(MessageModel.id))
+            .where(MessageModel.storyline_name == storyline_name)
+            .scalar()
+        ) or 0
+        key = (storyline_name, latest_message_id)
+        if key not in self._resolved:
+            self._resolved[key] = draw_conversation_summary(
+                self.session, max_messages=self.max_messages, min_messages=self.min_messages
+            )
+        return self._resolved[key]
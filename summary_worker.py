@@ -0,0 +1,200 @@
+import argparse
+import logging
+import os
+import socket
+import time
+import uuid
+from threading import Event, Thread
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+
+from token_world.llm.xplore.db import (
+    MessageModel,
+    StorylineModel,
+    SummaryModel,
+    SummaryWorkerLeaseModel,
+    dialect_insert,
+    initialize_db,
+    session_scope,
+)
+from token_world.llm.xplore.summarize_agent import (
+    CHUNK,
+    generate_summary,
+    get_summary_conversation,
+    roll_up_summaries,
+    summary_lock,
+)
+
+
+# Seconds a worker keeps a storyline to itself after claiming it. Workers renew their claims on
+# every scan, so a storyline only moves to another worker once its worker has stopped.
+LEASE_SECONDS = 60.0
+
+
+def claim_storyline(storyline_name: str, owner: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+    """Claim or renew the storyline for the worker, unless another worker holds a live claim.
+
+    The claim is a single upsert, so two workers racing for a storyline cannot both get it.
+    """
+    now = time.time()
+    with session_scope("claim_storyline") as session:
+        statement = dialect_insert(session, SummaryWorkerLeaseModel).values(
+            storyline_name=storyline_name, owner=owner, expires_at=now + lease_seconds
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["storyline_name"],
+                set_={"owner": owner, "expires_at": now + lease_seconds},
+                where=(SummaryWorkerLeaseModel.owner == owner)
+                | (SummaryWorkerLeaseModel.expires_at < now),
+            )
+        )
+        holder = (
+            session.query(SummaryWorkerLeaseModel.owner)
+            .where(SummaryWorkerLeaseModel.storyline_name == storyline_name)
+            .scalar()
+        )
+        return holder == owner
+
+
+def release_storylines(owner: str):
+    with session_scope("release_storylines") as session:
+        session.query(SummaryWorkerLeaseModel).where(
+            SummaryWorkerLeaseModel.owner == owner
+        ).delete()
+
+
+def summarize_storyline(storyline_name: str) -> Optional[int]:
+    """Store the summary that the next turn of the storyline will need, if it is missing.
+
+    The next turn keeps the latest message and the upcoming user message unsummarized, so once
+    the latest message is an assistant reply everything before it can be summarized ahead of time.
+    Returns the ``summary_until_id`` of the stored summary, or None if nothing was summarized.
+    """
+    with summary_lock(storyline_name), session_scope("summarize_storyline") as session:
+        latest_message = (
+            session.query(MessageModel)
+            .where(MessageModel.storyline_name == storyline_name)
+            .order_by(MessageModel.id.desc())
+            .first()
+        )
+        if latest_message is None:
+            return None
+        keep_messages = 1 if latest_message.role == "assistant" else 2
+        conversation = get_summary_conversation(
+            session,
+            max_messages=keep_messages,
+            min_messages=keep_messages,
+            storyline_name=storyline_name,
+        )
+        if not conversation.is_summary_required():
+            return None
+
+        summary_until_id = conversation.messages_to_summarize[-1].id
+        if session.get(SummaryModel, (storyline_name, CHUNK, summary_until_id)):
+            return None
+        logging.info(
+            f"Summarizing '{storyline_name}' in the background until message {summary_until_id}"
+        )
+        content = "".join(generate_summary(conversation))
+        try:
+            session.add(
+                SummaryModel(
+                    storyline_name=storyline_name,
+                    level=CHUNK,
+                    summary_until_id=summary_until_id,
+                    content=content,
+                )
+            )
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            logging.info(f"Summary until {summary_until_id} of '{storyline_name}' already exists")
+            return None
+        return summary_until_id
+
+
+class SummaryWorker(Thread):
+    """Polls all storylines and writes their summaries ahead of the turns that need them.
+
+    Several processes can each run a worker, but only the one holding a storyline's lease
+    summarizes it.
+    """
+
+    def __init__(self, poll_interval: float = 2.0):
+        super().__init__(name="summary-worker", daemon=True)
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop_event = Event()
+
+    def run(self):
+        logging.info("Summary worker started")
+        while not self._stop_event.is_set():
+            self.summarize_pending()
+            self._stop_event.wait(self.poll_interval)
+        release_storylines(self.owner)
+        logging.info("Summary worker stopped")
+
+    def summarize_pending(self):
+        with session_scope("summarize_pending") as session:
+            storyline_names = [name for (name,) in session.query(StorylineModel.name).all()]
+        for storyline_name in storyline_names:
+            try:
+                if not claim_storyline(storyline_name, self.owner):
+                    continue
+                summarize_storyline(storyline_name)
+                with summary_lock(storyline_name), session_scope("summarize_pending") as session:
+                    roll_up_summaries(session, storyline_name)
+            except Exception as e:
+                logging.error(
+                    f"Background summarization of '{storyline_name}' failed: {e}", exc_info=True
+                )
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def is_summary_worker_enabled() -> bool:
+    """Whether the app and server start a worker, so that turns find their summaries ready.
+
+    On by default. With XPLORE_SUMMARY_WORKER=0 turns only summarize inline.
+    """
+    return os.getenv("XPLORE_SUMMARY_WORKER", "1") != "0"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Background summarization worker.")
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=2.0,
+        help="Seconds to wait between scans of the storylines",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=str,
+        default="INFO",
+        help="Set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    initialize_db()
+    worker = SummaryWorker(poll_interval=args.poll_interval)
+    worker.start()
+    try:
+        worker.join()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
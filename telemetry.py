@@ -0,0 +1,311 @@
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from functools import wraps
+from threading import Lock, current_thread
+from typing import Callable, Iterator, Optional, TypeVar
+
+from token_world.llm.xplore.tokens import count_tokens
+
+# Upper bounds of the latency histogram buckets, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Recent turns kept for the waterfall in the Admin tab.
+MAX_TURNS = int(os.getenv("XPLORE_TELEMETRY_TURNS", "50"))
+
+
+@dataclass
+class Span:
+    """One timed operation: an agent call, a database session or a whole turn."""
+
+    name: str
+    kind: str
+    start: float = field(default_factory=time.perf_counter)
+    end: Optional[float] = None
+    # Seconds from the start to the first streamed chunk, for agent calls.
+    ttft: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    queries: int = 0
+    error: Optional[str] = None
+    # Whether the consumer closed the stream before it finished, which is not an error.
+    cancelled: bool = False
+    thread: str = field(default_factory=lambda: current_thread().name)
+    # Text of the prompt, to estimate its tokens from if the LLM reports no usage.
+    prompt: str = field(default="", repr=False)
+    parent: Optional["Span"] = field(default=None, repr=False)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+@dataclass
+class TurnTrace:
+    storyline_name: str
+    started_at: float = field(default_factory=time.time)
+    spans: list[Span] = field(default_factory=list)
+    # Whether the character response started alongside the classifiers was kept, if one was.
+    speculative_hit: Optional[bool] = None
+    # Seconds of that response generated before the classifiers finished, saved on a hit.
+    speculation_saved: float = 0.0
+
+    @property
+    def start(self) -> float:
+        return self.spans[0].start if self.spans else 0.0
+
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+Labels = tuple[tuple[str, str], ...]
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("xplore_span", default=None)
+_current_turn: ContextVar[Optional[TurnTrace]] = ContextVar("xplore_turn", default=None)
+_lock = Lock()
+_turns: deque[TurnTrace] = deque(maxlen=MAX_TURNS)
+_histograms: dict[tuple[str, Labels], Histogram] = {}
+_counters: dict[tuple[str, Labels], float] = {}
+
+
+def _observe(metric: str, labels: Labels, value: float):
+    _histograms.setdefault((metric, labels), Histogram()).observe(value)
+
+
+def _increment(metric: str, labels: Labels, value: float):
+    _counters[(metric, labels)] = _counters.get((metric, labels), 0) + value
+
+
+def _finish(span: Span):
+    span.end = time.perf_counter()
+    labels = (("kind", span.kind), ("name", span.name))
+    with _lock:
+        if (turn := _current_turn.get()) is not None:
+            turn.spans.append(span)
+        _observe("xplore_span_duration_seconds", labels, span.duration)
+        _increment("xplore_span_queries_total", labels, span.queries)
+        if span.error:
+            _increment("xplore_span_errors_total", labels, 1)
+        if span.kind == "agent":
+            if span.ttft is not None:
+                _observe("xplore_agent_ttft_seconds", (("name", span.name),), span.ttft)
+            for token_type, tokens in (
+                ("prompt", span.prompt_tokens),
+                ("completion", span.completion_tokens),
+            ):
+                _increment(
+                    "xplore_agent_tokens_total", (("name", span.name), ("type", token_type)), tokens
+                )
+
+
+@contextmanager
+def span(name: str, kind: str) -> Iterator[Span]:
+    """Time the block as a span of the current turn, counting the queries it runs."""
+    current = Span(name, kind, parent=_current_span.get())
+    _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        # Set rather than reset, since generators may finish the span in another context.
+        _current_span.set(current.parent)
+        _finish(current)
+
+
+def traced_stream(name: str) -> Callable:
+    """Trace a generator of streamed LLM chunks as an agent span with its time to first token.
+
+    Token counts come from the usage the LLM reports, or are estimated from the chunks.
+    """
+
+    def decorator(func: Callable[..., Iterator[str]]) -> Callable[..., Iterator[str]]:
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Iterator[str]:
+            agent_span = Span(name, "agent", parent=_current_span.get())
+            chunks = []
+            try:
+                stream = func(*args, **kwargs)
+                while True:
+                    # Only the stream's own work belongs to the span, not the consumer's.
+                    previous = _current_span.get()
+                    _current_span.set(agent_span)
+                    try:
+                        chunk = next(stream)
+                    except StopIteration:
+                        break
+                    finally:
+                        _current_span.set(previous)
+                    if agent_span.ttft is None:
+                        agent_span.ttft = time.perf_counter() - agent_span.start
+                    chunks.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                agent_span.cancelled = True
+                raise
+            except BaseException as e:
+                agent_span.error = repr(e)
+                raise
+            finally:
+                # Streams closed early, or replayed from the cache, report no usage.
+                if not agent_span.prompt_tokens and agent_span.prompt:
+                    agent_span.prompt_tokens = count_tokens(agent_span.prompt)
+                agent_span.prompt = ""
+                if not agent_span.completion_tokens:
+                    agent_span.completion_tokens = count_tokens("".join(chunks))
+                _finish(agent_span)
+
+        return wrapper
+
+    return decorator
+
+
+def record_query():
+    """Count a database query against the current span and every span enclosing it."""
+    with _lock:
+        current = _current_span.get()
+        while current is not None:
+            current.queries += 1
+            current = current.parent
+
+
+def record_usage(prompt_tokens: int, completion_tokens: int):
+    """Attribute the token usage an LLM reported to the agent span that made the call."""
+    current = _current_span.get()
+    while current is not None and current.kind != "agent":
+        current = current.parent
+    if current is not None:
+        current.prompt_tokens += prompt_tokens
+        current.completion_tokens += completion_tokens
+
+
+def record_prompt_text(prompt: str):
+    """Keep the prompt of the current agent call, in case the LLM reports no usage for it."""
+    current = _current_span.get()
+    while current is not None and current.kind != "agent":
+        current = current.parent
+    if current is not None:
+        current.prompt += prompt
+
+
+def record_speculation(hit: bool, saved_seconds: float):
+    """Record whether the current turn kept its speculative character response."""
+    with _lock:
+        if (turn := _current_turn.get()) is not None:
+            turn.speculative_hit = hit
+            turn.speculation_saved = saved_seconds
+        outcome = "hit" if hit else "miss"
+        _increment("xplore_speculative_responses_total", (("outcome", outcome),), 1)
+        _observe("xplore_speculation_saved_seconds", (), saved_seconds)
+
+
+@contextmanager
+def trace_turn(storyline_name: str) -> Iterator[TurnTrace]:
+    """Collect the spans of a turn, including those of threads started with its context."""
+    turn = TurnTrace(storyline_name)
+    previous = _current_turn.get()
+    _current_turn.set(turn)
+    try:
+        with span("turn", "turn"):
+            yield turn
+    finally:
+        _current_turn.set(previous)
+        with _lock:
+            turn.spans.sort(key=lambda turn_span: turn_span.start)
+            _turns.append(turn)
+
+
+T = TypeVar("T")
+
+
+def own_context(func: Callable[..., Iterator[T]]) -> Callable[..., Iterator[T]]:
+    """Run every step of a generator in a context of its own.
+
+    Spans and turns the generator opens around its yields then stay current only for its own
+    work, and for threads it starts with its context, not for what the consumer does between items.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> Iterator[T]:
+        context = copy_context()
+        generator = context.run(func, *args, **kwargs)
+        try:
+            while True:
+                try:
+                    item = context.run(next, generator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            context.run(generator.close)
+
+    return wrapper
+
+
+def recent_turns() -> list[TurnTrace]:
+    with _lock:
+        return list(reversed(_turns))
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    pairs = []
+    for key, value in (*labels, *extra.items()):
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{escaped}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+METRIC_HELP = {
+    "xplore_span_duration_seconds": (
+        "histogram",
+        "Duration of agent calls, DB sessions and turns.",
+    ),
+    "xplore_agent_ttft_seconds": ("histogram", "Time to the first streamed chunk of agent calls."),
+    "xplore_agent_tokens_total": ("counter", "Prompt and completion tokens of agent calls."),
+    "xplore_span_queries_total": ("counter", "Database queries run within spans."),
+    "xplore_span_errors_total": ("counter", "Spans that ended with an exception."),
+    "xplore_speculative_responses_total": (
+        "counter",
+        "Character responses started alongside the classifiers, by whether they were kept.",
+    ),
+    "xplore_speculation_saved_seconds": (
+        "histogram",
+        "Seconds of the character response generated before the classifiers finished.",
+    ),
+}
+
+
+def prometheus_metrics() -> str:
+    """Render the metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for metric, (metric_type, help_text) in METRIC_HELP.items():
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+            for (name, labels), histogram in sorted(_histograms.items()):
+                if name != metric:
+                    continue
+                # Bucket counts are cumulative already, as observe counts a value in every bucket
+                # whose bound it is within.
+                for bound, count in zip(DURATION_BUCKETS, histogram.bucket_counts):
+                    lines.append(f"{metric}_bucket{format_labels(labels, le=str(bound))} {count}")
+                lines.append(f"{metric}_bucket{format_labels(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(_counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
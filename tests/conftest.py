@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+# The engine is created when the db module is imported, so point it at a scratch database first.
+os.environ["XPLORE_DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/xplore_test.db"
+os.environ["XPLORE_LLM_CACHE"] = "0"
+os.environ["XPLORE_SUMMARY_WORKER"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest  # noqa: E402
+
+from token_world.llm.xplore.db import wipe_db  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """An empty database with the current schema."""
+    wipe_db()
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    """A scripted OpenAI-compatible endpoint that the agents are pointed at."""
+    from token_world.llm.xplore.stub_llm import StubLLMServer
+
+    server = StubLLMServer()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.start())
+    yield server
+    server.stop()
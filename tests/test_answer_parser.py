@@ -0,0 +1,73 @@
+import pytest
+
+from token_world.llm.xplore.answer_parser import (
+    AnswerParser,
+    ChoiceAnswerParser,
+    JsonAnswerParser,
+    until_answer,
+)
+
+CHOICES = ("INCOMPLETE", "COMPLETE")
+
+
+def feed_chunks(parser: AnswerParser, chunks: list[str]) -> list[bool]:
+    return [parser.feed(chunk) for chunk in chunks]
+
+
+def test_answer_parser_is_abstract():
+    with pytest.raises(TypeError):
+        AnswerParser("ANSWER:")  # type: ignore[abstract]
+
+
+def test_json_answer_ignores_text_after_it():
+    parser = JsonAnswerParser("ANSWER:")
+    text = 'Reasoning.\nANSWER: ```json\n{"goal": "COMPLETE"}\n```\nThat is all.'
+    assert parser.parse(text) == {"goal": "COMPLETE"}
+
+
+def test_choice_answer_ignores_text_after_it():
+    parser = ChoiceAnswerParser("ANSWER:", CHOICES)
+    assert parser.parse("ANSWER: **COMPLETE**, as the key was found.") == "COMPLETE"
+
+
+def test_marker_in_the_reasoning_is_skipped():
+    json_text = 'I will end with ANSWER: as asked.\nANSWER: {"a": 1}'
+    assert JsonAnswerParser("ANSWER:").parse(json_text) == {"a": 1}
+    choice_text = "The format is ANSWER: followed by a word.\nANSWER: INCOMPLETE"
+    assert ChoiceAnswerParser("ANSWER:", CHOICES).parse(choice_text) == "INCOMPLETE"
+
+
+def test_incomplete_response_has_no_result():
+    parser = JsonAnswerParser("ANSWER:")
+    parser.feed('ANSWER: {"a": ')
+    with pytest.raises(ValueError):
+        parser.result()
+
+
+def test_marker_and_json_split_across_chunks():
+    parser = JsonAnswerParser("ANSWER:")
+    completed = feed_chunks(parser, ["Done. ANS", "WER: {\"go", 'al": "COMP', 'LETE"}', " Bye."])
+    assert completed == [False, False, False, True, True]
+    assert parser.result() == {"goal": "COMPLETE"}
+
+
+def test_choice_split_across_chunks_waits_for_the_whole_word():
+    # INCOMPLETE must not be read as COMPLETE, nor IN as a wrong answer.
+    parser = ChoiceAnswerParser("ANSWER:", CHOICES)
+    assert feed_chunks(parser, ["AN", "SWER: IN", "COMP", "LETE"]) == [False, False, False, True]
+    assert parser.result() == "INCOMPLETE"
+
+
+def test_until_answer_closes_the_stream_after_the_answer():
+    closed = []
+
+    def stream():
+        try:
+            yield from ["Thinking. ANSWER: {", '"a": 1}', " and more", " text"]
+        finally:
+            closed.append(True)
+
+    parser = JsonAnswerParser("ANSWER:")
+    assert list(until_answer(stream(), parser)) == ["Thinking. ANSWER: {", '"a": 1}']
+    assert closed == [True]
+    assert parser.result() == {"a": 1}
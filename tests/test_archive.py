@@ -0,0 +1,56 @@
+import gzip
+import io
+
+import pytest
+from sqlalchemy import select
+
+from token_world.llm.xplore.archive import (
+    STORYLINE_TABLES,
+    ArchiveError,
+    decompress_if_gzipped,
+    export_storyline,
+    import_storyline,
+)
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.db import add_message_to_db, engine, session_scope, wipe_db
+
+
+def storyline_rows(storyline_name: str) -> dict[str, list[dict]]:
+    with engine.connect() as connection:
+        return {
+            table.name: [
+                dict(row)
+                for row in connection.execute(
+                    select(table)
+                    .where(table.c[column] == storyline_name)
+                    .order_by(*table.primary_key.columns)
+                ).mappings()
+            ]
+            for table, column in STORYLINE_TABLES
+        }
+
+
+def test_exported_storyline_is_imported_unchanged(db):
+    seed_storyline("archived", 20, 3, 3)
+    rows = storyline_rows("archived")
+    assert all(rows[table] for table in ("messages", "summaries", "milestones", "agent_goals"))
+    archive = io.BytesIO()
+    with gzip.GzipFile(fileobj=archive, mode="wb") as file:
+        export_storyline("archived", file)
+
+    wipe_db()
+    archive.seek(0)
+    assert import_storyline(decompress_if_gzipped(archive)) == "archived"
+    assert storyline_rows("archived") == rows
+
+    archive.seek(0)
+    with pytest.raises(ArchiveError, match="already exists"):
+        import_storyline(decompress_if_gzipped(archive))
+    archive.seek(0)
+    import_storyline(decompress_if_gzipped(archive), replace=True)
+    assert storyline_rows("archived") == rows
+
+    # New messages continue after the imported ones.
+    with session_scope("add_message") as session:
+        message = add_message_to_db({"role": "user", "content": "Back again."}, session, "archived")
+        assert message.id == rows["messages"][-1]["id"] + 1
@@ -0,0 +1,49 @@
+import json
+import re
+
+from token_world.llm.xplore.batch_classify import (
+    MISSING_RESULT_ERROR,
+    find_failed_jobs,
+    find_jobs,
+    run_batch,
+)
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.db import ClassificationModel, session_scope
+from token_world.llm.xplore.llm import handle_base_model_arg
+
+
+def answer_all_but_first(prompt: str) -> str:
+    turn_ids = re.findall(r"^## Turn (\d+)$", prompt, re.MULTILINE)
+    return "BATCH COMPLETIONS: " + json.dumps({turn_id: {} for turn_id in turn_ids[1:]})
+
+
+def classifications() -> dict[int, list[str]]:
+    with session_scope() as session:
+        rows = session.query(ClassificationModel).all()
+        return {
+            int(row.message_id): [
+                json.loads(other.result) if other.result else other.error
+                for other in rows
+                if other.message_id == row.message_id
+            ]
+            for row in rows
+        }
+
+
+def test_turns_left_out_of_a_packed_answer_are_errors_and_retried(db, stub_llm):
+    seed_storyline("batch", 12, 2, 2)
+    jobs = find_jobs(["batch"])
+    stub_llm.script.insert(0, (re.compile("BATCH COMPLETIONS:"), answer_all_but_first))
+
+    stats = run_batch(jobs, pack=len(jobs))
+
+    assert stats["errors"] == 2
+    results = classifications()
+    assert results[jobs[0].message_id] == [MISSING_RESULT_ERROR, MISSING_RESULT_ERROR]
+    assert {"milestone 1": "INCOMPLETE"} in results[jobs[1].message_id]
+
+    failed_jobs = find_failed_jobs(handle_base_model_arg(None))
+    assert failed_jobs == [jobs[0]]
+    stub_llm.script.pop(0)
+    assert run_batch(failed_jobs, pack=len(jobs))["errors"] == 0
+    assert find_failed_jobs(handle_base_model_arg(None)) == []
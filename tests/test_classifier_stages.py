@@ -0,0 +1,28 @@
+import re
+
+from token_world.llm.xplore import prompt_cache
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.turn_engine import TurnEngine
+from token_world.llm.xplore.turn_events import StageFinished, StageStarted
+
+
+def test_goal_creation_sees_the_goals_completed_this_turn(db, stub_llm):
+    seed_storyline("stages", 4, 2, 2)
+    stub_llm.script.insert(
+        0, (re.compile("GOAL CLASSIFICATIONS:"), 'GOAL CLASSIFICATIONS: {"goal 0": "COMPLETE"}')
+    )
+    prompt_cache._last_prompts.clear()
+
+    events = list(TurnEngine("stages", speculative=False).run_turn("I found the key!"))
+
+    stage_events = [
+        (type(event).__name__, event.stage)
+        for event in events
+        if isinstance(event, (StageStarted, StageFinished))
+    ]
+    assert stage_events.index(("StageFinished", "🎯 Goal Completion")) < stage_events.index(
+        ("StageStarted", "➕ Goal Creation")
+    )
+    creation_prompt = prompt_cache._last_prompts["Goal Creator"]
+    assert b"task 1" in creation_prompt
+    assert b"task 0" not in creation_prompt
@@ -0,0 +1,46 @@
+from token_world.llm.xplore.db import (
+    MessageModel,
+    Session,
+    add_messages_to_db,
+    session_scope,
+)
+from token_world.llm.xplore.message_cache import get_parsed_messages
+
+
+def add_messages(storyline_name: str, *contents: str):
+    with session_scope() as session:
+        add_messages_to_db(
+            [{"role": "user", "content": content} for content in contents],
+            session,
+            storyline_name,
+        )
+
+
+def parsed_contents(storyline_name: str) -> list[str]:
+    with session_scope() as session:
+        return [message.content for message in get_parsed_messages(session, storyline_name)]
+
+
+def test_appends_new_messages(db):
+    add_messages("cache", "a", "b")
+    assert parsed_contents("cache") == ["a", "b"]
+    add_messages("cache", "c")
+    assert parsed_contents("cache") == ["a", "b", "c"]
+
+
+def test_reloads_after_another_session_regenerates(db):
+    add_messages("cache", "a", "b", "c")
+    assert parsed_contents("cache") == ["a", "b", "c"]
+
+    # Another process deletes the tail and writes new messages, whose ids are higher.
+    other = Session()
+    try:
+        other.query(MessageModel).where(MessageModel.storyline_name == "cache").where(
+            MessageModel.content != "a"
+        ).delete()
+        add_messages_to_db([{"role": "user", "content": "d"}], other, "cache")
+        other.commit()
+    finally:
+        other.close()
+
+    assert parsed_contents("cache") == ["a", "d"]
@@ -0,0 +1,81 @@
+from threading import Barrier, Thread
+
+from sqlalchemy.orm import sessionmaker
+
+from token_world.llm.xplore.db import (
+    Base,
+    MessageModel,
+    add_message_to_db,
+    add_messages_to_db,
+    create_db_engine,
+)
+
+N_WRITERS = 8
+N_BATCHES = 25
+STORYLINES = ("left", "right")
+
+
+def write(session_factory, barrier: Barrier, writer: int):
+    """Append single messages and pairs, alternating, to one of the storylines."""
+    storyline_name = STORYLINES[writer % len(STORYLINES)]
+    barrier.wait()
+    for batch in range(N_BATCHES):
+        with session_factory.begin() as session:
+            if batch % 2:
+                add_message_to_db(
+                    {"role": "user", "content": f"{writer}:{batch}:0"}, session, storyline_name
+                )
+            else:
+                add_messages_to_db(
+                    [
+                        {"role": "user", "content": f"{writer}:{batch}:0"},
+                        {"role": "assistant", "content": f"{writer}:{batch}:1"},
+                    ],
+                    session,
+                    storyline_name,
+                )
+
+
+def test_concurrent_writers_get_unique_contiguous_ids(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'writers.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    barrier = Barrier(N_WRITERS)
+    writers = [
+        Thread(target=write, args=(session_factory, barrier, writer))
+        for writer in range(N_WRITERS)
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    with session_factory() as session:
+        rows = session.query(
+            MessageModel.storyline_name, MessageModel.id, MessageModel.content
+        ).all()
+    engine.dispose()
+
+    messages_per_writer = N_BATCHES // 2 + 2 * (N_BATCHES - N_BATCHES // 2)
+    for storyline_name in STORYLINES:
+        storyline_rows = sorted(
+            (message_id, content) for name, message_id, content in rows if name == storyline_name
+        )
+        ids = [message_id for message_id, _ in storyline_rows]
+        n_writers = N_WRITERS // len(STORYLINES)
+        assert ids == list(range(1, n_writers * messages_per_writer + 1))
+
+        # Every writer's messages, and the messages of each batch, keep the order they were
+        # written in, and a batch gets consecutive ids.
+        positions = {content: message_id for message_id, content in storyline_rows}
+        for writer in range(N_WRITERS):
+            if STORYLINES[writer % len(STORYLINES)] != storyline_name:
+                continue
+            writer_ids = [
+                positions[f"{writer}:{batch}:{part}"]
+                for batch in range(N_BATCHES)
+                for part in ((0, 1) if batch % 2 == 0 else (0,))
+            ]
+            assert writer_ids == sorted(writer_ids)
+            for batch in range(0, N_BATCHES, 2):
+                assert positions[f"{writer}:{batch}:1"] == positions[f"{writer}:{batch}:0"] + 1
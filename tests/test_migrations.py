@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from sqlalchemy import select, text
+
+from token_world.llm.xplore.db import (
+    Base,
+    MessageModel,
+    SummaryModel,
+    SummaryWorkerLeaseModel,
+    create_db_engine,
+    initialize_db,
+)
+from token_world.llm.xplore.migrations import (
+    FULL_SCAN_PATTERN,
+    HOT_QUERIES,
+    MIGRATIONS,
+    check_query_plans,
+    run_migrations,
+)
+
+# The tables as they were before the schema migrations existed.
+LEGACY_SCHEMA = [
+    "CREATE TABLE messages (storyline_name VARCHAR NOT NULL, id INTEGER NOT NULL, "
+    "content TEXT NOT NULL, PRIMARY KEY (storyline_name, id))",
+    "CREATE TABLE summaries (storyline_name VARCHAR NOT NULL, summary_until_id INTEGER NOT NULL, "
+    "content TEXT NOT NULL, PRIMARY KEY (storyline_name, summary_until_id))",
+]
+
+
+def test_legacy_database_is_migrated_once(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(
+            text("INSERT INTO messages VALUES ('story', 1, :content), ('story', 2, 'not json')"),
+            {"content": json.dumps({"role": "assistant", "content": "Hello there"})},
+        )
+        connection.execute(text("INSERT INTO summaries VALUES ('story', 2, 'They met.')"))
+
+    initialize_db(engine)
+
+    with engine.connect() as connection:
+        messages = connection.execute(
+            select(MessageModel.id, MessageModel.role, MessageModel.content).order_by(
+                MessageModel.id
+            )
+        ).all()
+        summaries = connection.execute(
+            select(SummaryModel.level, SummaryModel.summary_until_id, SummaryModel.content)
+        ).all()
+    assert messages == [(1, "assistant", "Hello there"), (2, "user", "not json")]
+    assert summaries == [(0, 2, "They met.")]
+
+    assert run_migrations(engine) == []
+    initialize_db(engine)
+    with engine.connect() as connection:
+        assert connection.scalar(text("SELECT count(*) FROM schema_migrations")) == len(MIGRATIONS)
+    engine.dispose()
+
+
+def test_leases_table_is_created_by_a_recorded_migration(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/leases.db")
+    # A database from before the leases: every other table exists, up to migration 3.
+    tables = [
+        table for table in Base.metadata.sorted_tables if table.name != "summary_worker_leases"
+    ]
+    Base.metadata.create_all(engine, tables=tables)
+    with engine.begin() as connection:
+        for version in (1, 2, 3):
+            connection.execute(
+                text("INSERT INTO schema_migrations VALUES (:version, 'earlier', 0)"),
+                {"version": version},
+            )
+
+    assert run_migrations(engine) == [4]
+    with engine.connect() as connection:
+        assert connection.scalar(select(SummaryWorkerLeaseModel.storyline_name)) is None
+    engine.dispose()
+
+
+@pytest.fixture
+def scratch_engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/plans.db")
+    initialize_db(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_hot_queries_are_served_by_their_indexes(scratch_engine):
+    plans = check_query_plans(scratch_engine)
+
+    assert plans.keys() == HOT_QUERIES.keys()
+    for name, (_, index_name) in HOT_QUERIES.items():
+        assert index_name is None or index_name in plans[name], name
+        assert not FULL_SCAN_PATTERN.search(plans[name]), name
+        assert "TEMP B-TREE" not in plans[name], name
+
+
+def test_missing_index_fails_the_plan_check(scratch_engine):
+    with scratch_engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_milestones_storyline_completed_order"))
+
+    with pytest.raises(AssertionError, match="active milestone"):
+        check_query_plans(scratch_engine)
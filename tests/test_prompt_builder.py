@@ -0,0 +1,53 @@
+import pytest
+
+from token_world.llm.xplore import tokens
+from token_world.llm.xplore.prompt_builder import MESSAGE_OVERHEAD_TOKENS, PromptBuilder
+
+TEXT = "The café by the fjord served crème brûlée 🍮 to travellers from Zürich. " * 40
+
+
+class ByteEncoding:
+    """A tokenizer of one token per UTF-8 byte, whose cuts can split a character."""
+
+    def encode(self, text: str, disallowed_special=()) -> list[int]:
+        return list(text.encode())
+
+    def decode(self, tokens: list[int]) -> str:
+        return bytes(tokens).decode(errors="replace")
+
+
+@pytest.fixture(params=["estimate", "bytes"])
+def encoding(request, monkeypatch):
+    """Count tokens by the estimate, or with a tokenizer that does not cut on characters."""
+    encoding = ByteEncoding() if request.param == "bytes" else None
+    monkeypatch.setattr(tokens, "get_encoding", lambda model=None: encoding)
+
+
+@pytest.mark.parametrize("max_tokens", [0, 1, 2, 3, 7, 50, 333])
+def test_truncated_text_fits_its_budget(encoding, max_tokens):
+    truncated = tokens.truncate_to_tokens(TEXT, max_tokens)
+    assert tokens.count_tokens(truncated) <= max_tokens
+    assert TEXT.startswith(truncated.removesuffix(tokens.TRUNCATION_MARK))
+
+
+@pytest.mark.parametrize("budget", [60, 101, 250])
+def test_fitted_prompt_respects_the_budget(encoding, budget):
+    builder = PromptBuilder("gpt-4o", budget)
+    system = builder.reserve("system", "You are a helpful game master.")
+    summary = builder.fit("summary", TEXT)
+
+    n_tokens = tokens.count_tokens(system) + MESSAGE_OVERHEAD_TOKENS + tokens.count_tokens(summary)
+    assert n_tokens == budget - builder.remaining
+    assert n_tokens <= budget
+
+
+@pytest.mark.parametrize("budget", [60, 101, 250])
+def test_fitted_messages_respect_the_budget(encoding, budget):
+    builder = PromptBuilder("gpt-4o", budget)
+    messages = builder.fit_messages(
+        "messages", [{"role": "user", "content": TEXT}, {"role": "assistant", "content": TEXT}]
+    )
+
+    assert len(messages) == 1
+    assert tokens.count_tokens(messages[0]["content"]) + MESSAGE_OVERHEAD_TOKENS <= budget
+    assert builder.remaining >= 0
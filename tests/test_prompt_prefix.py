@@ -0,0 +1,39 @@
+import json
+
+from token_world.llm.xplore import prompt_cache
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.summarize_agent import SUMMARY_LEVEL_NAMES
+from token_world.llm.xplore.turn_engine import TurnEngine
+
+
+def play_turn(storyline_name: str, user_message: str) -> dict[str, bytes]:
+    """Play a turn and return the serialized prompt of every agent it called."""
+    prompt_cache._last_prompts.clear()
+    for _ in TurnEngine(storyline_name, speculative=False).run_turn(user_message):
+        pass
+    return dict(prompt_cache._last_prompts)
+
+
+def serialized(text: str) -> bytes:
+    return json.dumps(text, ensure_ascii=False)[1:-1].encode()
+
+
+def volatile_start(prompt: bytes, user_message: str) -> int:
+    """Where the parts of a prompt that change from turn to turn start: the summary sections
+    or the recent messages."""
+    markers = [serialized(user_message)] + [
+        serialized(f"### {name.capitalize()}\n") for name in SUMMARY_LEVEL_NAMES.values()
+    ]
+    return min(prompt.find(marker) for marker in markers if marker in prompt)
+
+
+def test_static_prompt_prefixes_are_byte_identical_across_turns(db, stub_llm):
+    seed_storyline("prefix", 12, 3, 3)
+    first = play_turn("prefix", "Shall we go to the river?")
+    second = play_turn("prefix", "Let us take the quick path.")
+
+    assert {"Milestone Completion Classifier", "Goal Completion Classifier"} <= second.keys()
+    for agent_name, prompt in second.items():
+        static_length = volatile_start(prompt, "Let us take the quick path.")
+        assert static_length > 0, agent_name
+        assert prompt[:static_length] == first[agent_name][:static_length], agent_name
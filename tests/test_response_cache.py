@@ -0,0 +1,66 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from token_world.llm.xplore import response_cache
+from token_world.llm.xplore.answer_parser import JsonAnswerParser
+from token_world.llm.xplore.response_cache import ResponseCache, cached_response_stream
+
+AGENT = SimpleNamespace(name="Classifier", instructions="Classify.")
+MESSAGES = [{"role": "user", "content": "Which goals are complete?"}]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(
+        str(tmp_path / "cache.db"), max_bytes=1 << 20, max_entries=100, ttl_seconds=60
+    )
+    monkeypatch.setattr(response_cache, "get_response_cache", lambda: cache)
+    return cache
+
+
+def stream_of(*chunks: str):
+    calls = []
+
+    def stream():
+        calls.append(1)
+        yield from chunks
+
+    return stream, calls
+
+
+def test_caches_a_complete_answer(cache):
+    stream, calls = stream_of("Done. ", "ANSWER: ", '{"a": "COMPLETE"}', " and more")
+    for _ in range(2):
+        response = "".join(
+            cached_response_stream("m", AGENT, MESSAGES, stream, JsonAnswerParser("ANSWER:"))
+        )
+        assert response == 'Done. ANSWER: {"a": "COMPLETE"}'
+    assert len(calls) == 1
+
+
+def test_does_not_cache_a_response_without_an_answer(cache):
+    stream, calls = stream_of("Done. ", "ANSWER: ", '{"a": "COMP')
+    for _ in range(2):
+        "".join(cached_response_stream("m", AGENT, MESSAGES, stream, JsonAnswerParser("ANSWER:")))
+    assert len(calls) == 2
+
+
+def test_closes_its_connections(cache, monkeypatch):
+    connections = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        connections.append(connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+    cache.put("key", "response")
+    assert cache.get("key") == "response"
+    cache.clear()
+
+    assert len(connections) == 3
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
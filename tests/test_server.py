@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.server import MAX_CONCURRENT_TURNS, TurnSlots, app
+
+
+@pytest.fixture
+def client(db, stub_llm):
+    seed_storyline("server", 4, 2, 2)
+    with TestClient(app) as client:
+        yield client
+
+
+def parse_sse(text: str) -> list[dict]:
+    return [
+        json.loads(line.removeprefix("data: "))
+        for line in text.splitlines()
+        if line.startswith("data: ")
+    ]
+
+
+def wait_for_free_slots(slots: TurnSlots, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while slots.storylines and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not slots.storylines
+    assert slots.semaphore._value == MAX_CONCURRENT_TURNS
+
+
+def test_turn_is_streamed_and_saved(client):
+    n_messages = len(client.get("/storylines/server/messages").json())
+    response = client.post("/storylines/server/messages", json={"content": "Hello Ollie!"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert any(event["type"] == "ResponseChunk" for event in events)
+    assert events[-1]["type"] == "TurnComplete"
+    messages = client.get("/storylines/server/messages").json()
+    assert len(messages) == n_messages + 2
+    assert messages[-2]["content"] == "Hello Ollie!"
+    wait_for_free_slots(client.app.state.turn_slots)
+
+
+def test_concurrent_turn_of_a_storyline_is_rejected(client):
+    slots = client.app.state.turn_slots
+    client.portal.call(slots.acquire, "server")
+    try:
+        response = client.post("/storylines/server/messages", json={"content": "Anyone there?"})
+        assert response.status_code == 409
+    finally:
+        client.portal.call(slots.release, "server")
+
+
+def test_cancelled_wait_for_a_slot_frees_the_storyline():
+    async def cancel_waiter() -> TurnSlots:
+        slots = TurnSlots(1)
+        await slots.acquire("first")
+        waiter = asyncio.create_task(slots.acquire("second"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return slots
+
+    assert asyncio.run(cancel_waiter()).storylines == {"first"}
+
+
+def test_slot_is_released_after_the_client_disconnects(client, stub_llm):
+    stub_llm.ttft = 0.2
+    n_messages = len(client.get("/storylines/server/messages").json())
+    body = json.dumps({"content": "I have to go."}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/storylines/server/messages",
+        "raw_path": b"/storylines/server/messages",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+
+    async def disconnect_after_first_event():
+        requests = [{"type": "http.request", "body": body, "more_body": False}]
+        first_event = asyncio.Event()
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await first_event.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                first_event.set()
+
+        await app(scope, receive, send)
+
+    client.portal.call(disconnect_after_first_event)
+    slots = client.app.state.turn_slots
+    assert slots.storylines == {"server"}, "the turn should outlive its client"
+    wait_for_free_slots(slots)
+    assert len(client.get("/storylines/server/messages").json()) == n_messages + 2
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"characters": ["Ada"]},
+        {"characters": {"player1": 1}},
+        {"milestones": [{"description": "No name"}]},
+        {"milestones": [{"name": "twice"}, {"name": "twice"}]},
+        {"milestones": "all of them"},
+    ],
+)
+def test_invalid_storyline_is_rejected(client, body):
+    response = client.put("/storylines/server", json=body)
+    assert response.status_code == 400
+    assert client.get("/storylines/server").json()["characters"]
+
+
+def test_websocket_rejects_a_body_that_is_not_an_object(client):
+    with client.websocket_connect("/storylines/server/play") as websocket:
+        websocket.send_json(["Hello"])
+        assert websocket.receive_json() == {
+            "type": "Notice",
+            "level": "error",
+            "message": "The request body must be a JSON object.",
+            "stage": "",
+        }
+        websocket.send_json({"content": "Hello Ollie!"})
+        events = [websocket.receive_json()]
+        while events[-1]["type"] != "TurnComplete":
+            events.append(websocket.receive_json())
+        assert not any(event.get("level") == "error" for event in events)
@@ -0,0 +1,32 @@
+import time
+
+from token_world.llm.xplore import turn_engine
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.turn_engine import SpeculativeResponse, TurnEngine
+from token_world.llm.xplore.turn_events import ClassifierChunk
+
+
+def test_closing_the_turn_cancels_the_speculative_response(db, stub_llm, monkeypatch):
+    seed_storyline("speculation", 4, 2, 2)
+    speculations: list[SpeculativeResponse] = []
+
+    class RecordedSpeculativeResponse(SpeculativeResponse):
+        def __init__(self, *args):
+            super().__init__(*args)
+            speculations.append(self)
+
+    monkeypatch.setattr(turn_engine, "SpeculativeResponse", RecordedSpeculativeResponse)
+    stub_llm.tokens_per_second = 20
+    turn = TurnEngine("speculation", speculative=True).run_turn("Let us wait here.")
+    for event in turn:
+        if isinstance(event, ClassifierChunk):
+            break
+    turn.close()
+
+    (speculation,) = speculations
+    deadline = time.monotonic() + 5
+    while speculation.end is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert speculation.end is not None, "the speculative stream was left running"
+    # A cancelled stream stops without the None that marks a finished response.
+    assert None not in list(speculation.chunks.queue)
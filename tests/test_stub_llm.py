@@ -0,0 +1,51 @@
+import openai
+import pytest
+
+from token_world.llm.xplore.stub_llm import StubLLMServer
+
+TOOL_CALLS = [
+    {"name": "mark_goal_completed", "arguments": {"goal": "Find the key"}},
+    {"name": "add_goal", "arguments": {"goal": "Open the gate", "persistence": "High"}},
+]
+MESSAGES = [{"role": "user", "content": "Which goals are done?"}]
+
+
+def complete(base_url: str, stream: bool) -> tuple[str, list[tuple[str, str]]]:
+    """Return the text and the (name, arguments) of the calls of a completion."""
+    client = openai.OpenAI(base_url=base_url, api_key="test")
+    if not stream:
+        message = client.chat.completions.create(model="stub", messages=MESSAGES).choices[0].message
+        calls = [(call.function.name, call.function.arguments) for call in message.tool_calls]
+        return message.content or "", calls
+    content, calls = "", {}
+    for chunk in client.chat.completions.create(model="stub", messages=MESSAGES, stream=True):
+        delta = chunk.choices[0].delta
+        content += delta.content or ""
+        for call in delta.tool_calls or []:
+            name, arguments = calls.get(call.index, ("", ""))
+            calls[call.index] = (
+                name + (call.function.name or ""),
+                arguments + (call.function.arguments or ""),
+            )
+    return content, [calls[i] for i in sorted(calls)]
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_recorded_tool_calls_are_replayed(tmp_path, stream):
+    record_path = str(tmp_path / "recordings.jsonl")
+    upstream = StubLLMServer(
+        script=[("goals", {"content": "Checking.", "tool_calls": TOOL_CALLS})]
+    )
+    proxy = StubLLMServer(upstream=upstream.start(), record_path=record_path)
+    try:
+        recorded = complete(proxy.start(), stream)
+    finally:
+        proxy.stop()
+        upstream.stop()
+    assert [name for name, _ in recorded[1]] == ["mark_goal_completed", "add_goal"]
+
+    replay = StubLLMServer(replay_path=record_path)
+    try:
+        assert complete(replay.start(), stream) == recorded
+    finally:
+        replay.stop()
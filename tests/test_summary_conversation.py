@@ -0,0 +1,17 @@
+from token_world.llm.xplore.db import MessageModel, add_messages_to_db, session_scope
+from token_world.llm.xplore.summarize_agent import get_summary_conversation
+
+
+def test_conversation_ends_at_the_latest_message(db):
+    with session_scope() as session:
+        add_messages_to_db(
+            [{"role": "user", "content": f"message {i}"} for i in range(1, 11)],
+            session,
+            "history",
+        )
+    with session_scope() as session:
+        latest_message = session.get(MessageModel, ("history", 6))
+        conversation = get_summary_conversation(
+            session, latest_message, max_messages=4, storyline_name="history"
+        )
+        assert [message.id for message in conversation.new_messages] == [3, 4, 5, 6]
@@ -0,0 +1,27 @@
+from token_world.llm.xplore.summary_worker import (
+    claim_storyline,
+    is_summary_worker_enabled,
+    release_storylines,
+)
+
+
+def test_one_worker_per_storyline(db):
+    assert claim_storyline("story", "worker-a")
+    assert not claim_storyline("story", "worker-b")
+    # Renewing a claim, and claiming another storyline, both succeed.
+    assert claim_storyline("story", "worker-a")
+    assert claim_storyline("other", "worker-b")
+
+
+def test_expired_or_released_claims_move_on(db):
+    assert claim_storyline("story", "worker-a", lease_seconds=-1)
+    assert claim_storyline("story", "worker-b")
+    release_storylines("worker-b")
+    assert claim_storyline("story", "worker-a")
+
+
+def test_worker_is_enabled_unless_opted_out(monkeypatch):
+    monkeypatch.delenv("XPLORE_SUMMARY_WORKER")
+    assert is_summary_worker_enabled()
+    monkeypatch.setenv("XPLORE_SUMMARY_WORKER", "0")
+    assert not is_summary_worker_enabled()
@@ -0,0 +1,32 @@
+from token_world.llm.xplore import telemetry
+from token_world.llm.xplore.bench_turn import seed_storyline
+from token_world.llm.xplore.db import session_scope
+from token_world.llm.xplore.telemetry import recent_turns, trace_turn
+from token_world.llm.xplore.turn_engine import TurnEngine
+
+
+def test_sessions_are_named_by_their_callers(db):
+    with trace_turn("names"):
+        with session_scope():
+            pass
+        with session_scope("explicit"):
+            pass
+
+    assert [span.name for span in recent_turns()[0].spans] == ["turn", "db:session", "db:explicit"]
+
+
+def test_turn_spans_are_not_current_between_events(db, stub_llm):
+    seed_storyline("spans", 4, 2, 2)
+    n_events = 0
+    for _ in TurnEngine("spans", speculative=True).run_turn("Where to next?"):
+        n_events += 1
+        assert telemetry._current_span.get() is None
+        assert telemetry._current_turn.get() is None
+        with session_scope("consumer"):
+            pass
+
+    assert n_events > 1
+    turn = recent_turns()[0]
+    assert turn.storyline_name == "spans"
+    assert "db:consumer" not in {span.name for span in turn.spans}
+    assert {"turn", "generate_character_response"} <= {span.name for span in turn.spans}
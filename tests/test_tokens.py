@@ -0,0 +1,38 @@
+import pytest
+
+from token_world.llm.xplore import tokens
+
+
+@pytest.fixture
+def offline_tiktoken(monkeypatch):
+    """tiktoken as on a host without network access, counting its download attempts."""
+    attempts = []
+
+    def fail(*args):
+        attempts.append(args)
+        raise ConnectionError("Name or service not known")
+
+    monkeypatch.setattr(tokens, "_encodings_unavailable", False)
+    monkeypatch.setattr(tokens.tiktoken, "encoding_for_model", fail)
+    monkeypatch.setattr(tokens.tiktoken, "get_encoding", fail)
+    tokens.get_encoding.cache_clear()
+    yield attempts
+    tokens.get_encoding.cache_clear()
+
+
+@pytest.mark.skipif(tokens.tiktoken is None, reason="tiktoken is not installed")
+def test_offline_tokenizer_is_only_tried_once(offline_tiktoken):
+    assert tokens.count_tokens("a" * 40, "model-a") == 10
+    assert tokens.count_tokens("a" * 40, "model-b") == 10
+    assert tokens.truncate_to_tokens("word " * 20, 2) == "word ..."
+    assert len(offline_tiktoken) == 1
+
+
+def test_tiktoken_can_be_turned_off(monkeypatch):
+    monkeypatch.setenv("XPLORE_TIKTOKEN", "0")
+    tokens.get_encoding.cache_clear()
+    try:
+        assert tokens.get_encoding("gpt-4o") is None
+        assert tokens.count_tokens("abcdefgh") == 2
+    finally:
+        tokens.get_encoding.cache_clear()
@@ -0,0 +1,80 @@
+import logging
+import os
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Optional
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is optional
+    tiktoken = None
+
+# Rough average of characters per token for English prose, used when no tokenizer is available.
+CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = "cl100k_base"
+# Appended to truncated text.
+TRUNCATION_MARK = " ..."
+
+# tiktoken downloads its encodings on first use, which on an offline host only fails after
+# network timeouts. The first failure is remembered so that it is only waited for once.
+_encoding_lock = Lock()
+_encodings_unavailable = False
+
+
+def use_tiktoken() -> bool:
+    """Whether to count tokens with tiktoken. Set XPLORE_TIKTOKEN=0 to always estimate them."""
+    return tiktoken is not None and os.getenv("XPLORE_TIKTOKEN", "1") != "0"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None) -> Any:
+    """Return the tiktoken encoding of the model, or None if token counts must be estimated."""
+    global _encodings_unavailable
+    if not use_tiktoken():
+        return None
+    with _encoding_lock:
+        if _encodings_unavailable:
+            return None
+        try:
+            if model:
+                try:
+                    return tiktoken.encoding_for_model(model)
+                except KeyError:
+                    pass
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+        except Exception as e:
+            _encodings_unavailable = True
+            logging.warning(f"Could not load a tokenizer, estimating token counts from now on: {e}")
+            return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count the tokens in the text with the model's tokenizer, or estimate them."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut the text down to at most ``max_tokens`` tokens, keeping its beginning.
+
+    Text and tokens do not map one to one, so the cut is counted again, mark included, and
+    shortened until it fits.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=()) if encoding is not None else []
+    n_kept = max_tokens - count_tokens(TRUNCATION_MARK, model)
+    while n_kept > 0:
+        if encoding is None:
+            kept = text[: n_kept * CHARS_PER_TOKEN].rsplit(" ", 1)[0]
+        else:
+            kept = encoding.decode(tokens[:n_kept])
+        truncated = kept + TRUNCATION_MARK
+        excess = count_tokens(truncated, model) - max_tokens
+        if excess <= 0:
+            return truncated
+        n_kept -= excess
+    return ""
@@ -0,0 +1,68 @@
+import logging
+from contextlib import nullcontext
+from typing import Iterator, Optional
+
+import streamlit as st
+
+from token_world.llm.xplore.summarize_agent import SummaryPainter
+from token_world.llm.xplore.turn_events import (
+    ClassifierChunk,
+    GoalUpdate,
+    MilestoneUpdate,
+    Notice,
+    ResponseChunk,
+    StageFinished,
+    StageStarted,
+    SummaryChunk,
+    SummaryReady,
+    TurnComplete,
+    TurnEvent,
+)
+
+
+def draw_turn(events: Iterator[TurnEvent]) -> Optional[TurnComplete]:
+    """Draw the events of a ``TurnEngine`` turn as they arrive.
+
+    The summary and every classifier stage get an expander, and the response streams below them.
+    Returns the completed turn, or None if it did not complete.
+    """
+    logging.info("Showing turn classification...")
+    summary_expander = st.expander("📜 Conversation Summary", expanded=True)
+    summaries = SummaryPainter()
+    expanders = {}
+    placeholders = {}
+    classifications = {}
+    response_placeholder = None
+    response = ""
+    for event in events:
+        if isinstance(event, SummaryChunk):
+            with summary_expander:
+                summaries.paint(event)
+        elif isinstance(event, SummaryReady):
+            logging.info("Summarization for classifiers complete...")
+            if not summaries.n_summaries:
+                with summary_expander:
+                    st.markdown(event.summary_context or "No conversation to summarize.")
+        elif isinstance(event, StageStarted):
+            expanders[event.stage] = st.expander(event.stage, expanded=True)
+        elif isinstance(event, ClassifierChunk):
+            if event.stage not in placeholders:
+                with expanders[event.stage]:
+                    placeholders[event.stage] = st.empty()
+                classifications[event.stage] = ""
+            classifications[event.stage] += event.text
+            placeholders[event.stage].markdown(classifications[event.stage])
+        elif isinstance(event, (MilestoneUpdate, GoalUpdate, Notice)):
+            with expanders.get(event.stage) or nullcontext():
+                getattr(st, event.level)(event.message)
+        elif isinstance(event, StageFinished):
+            with expanders[event.stage]:
+                st.info("Classification complete.")
+        elif isinstance(event, ResponseChunk):
+            if response_placeholder is None:
+                response_placeholder = st.empty()
+            response += event.text
+            response_placeholder.markdown(response)
+        elif isinstance(event, TurnComplete):
+            return event
+    return None
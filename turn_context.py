@@ -0,0 +1,141 @@
+import logging
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from token_world.llm.xplore.db import (
+    AgentGoalModel,
+    CharacterModel,
+    MilestoneModel,
+    StorylineModel,
+    session_scope,
+)
+
+
+class MilestoneSnapshot(NamedTuple):
+    name: str
+    order: int
+    description: str
+    completed: bool
+
+
+class GoalSnapshot(NamedTuple):
+    name: str
+    description: str
+    persistence: str
+
+
+class TurnSnapshot(NamedTuple):
+    storyline_name: str
+    # None if the storyline has no row, which the agents treat as unscripted mode.
+    storyline_description: Optional[str]
+    character_names: dict[str, str]
+    # All milestones of the storyline in order, completed ones included.
+    milestones: list[MilestoneSnapshot]
+    # Incomplete goals in alphabetical order.
+    goals: list[GoalSnapshot]
+
+
+def load_turn_snapshot(storyline_name: str) -> TurnSnapshot:
+    """Load everything the agents of a turn read about a storyline, in a single session."""
+    with session_scope("load_turn_snapshot") as session:
+        storyline = session.get(StorylineModel, storyline_name)
+        characters = (
+            session.query(CharacterModel)
+            .where(CharacterModel.storyline_name == storyline_name)
+            .all()
+        )
+        milestones = (
+            session.query(MilestoneModel)
+            .where(MilestoneModel.storyline_name == storyline_name)
+            .order_by(MilestoneModel.order)
+            .all()
+        )
+        goals = (
+            session.query(AgentGoalModel)
+            .where(AgentGoalModel.storyline_name == storyline_name)
+            .where(AgentGoalModel.completed.is_(False))
+            .order_by(AgentGoalModel.name)
+            .all()
+        )
+        return TurnSnapshot(
+            storyline_name=storyline_name,
+            storyline_description=str(storyline.description) if storyline else None,
+            character_names={str(c.type): str(c.name) for c in characters},
+            milestones=[
+                MilestoneSnapshot(str(m.name), int(m.order), str(m.description), bool(m.completed))
+                for m in milestones
+            ],
+            goals=[
+                GoalSnapshot(str(g.name), str(g.description), str(g.persistence)) for g in goals
+            ],
+        )
+
+
+class TurnContext:
+    """The storyline state shared by all agents of one turn.
+
+    It is loaded lazily in a single session and kept until ``invalidate`` is called, which every
+    write made during the turn (completing a milestone, creating or completing goals) must do so
+    that later agents of the turn see the change. Classifiers stream on worker threads, so access
+    is guarded by a lock.
+    """
+
+    def __init__(self, storyline_name: str):
+        self.storyline_name = storyline_name
+        self._snapshot: Optional[TurnSnapshot] = None
+        self._lock = Lock()
+        self.n_loads = 0
+
+    @property
+    def snapshot(self) -> TurnSnapshot:
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = load_turn_snapshot(self.storyline_name)
+                self.n_loads += 1
+                logging.info(f"Loaded turn context for '{self.storyline_name}'")
+            return self._snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot: TurnSnapshot) -> "TurnContext":
+        """A context fixed to the snapshot, for agents that must not see the turn's writes."""
+        context = cls(snapshot.storyline_name)
+        context._snapshot = snapshot
+        return context
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def character_name(self, character_type: str) -> str:
+        return self.snapshot.character_names.get(character_type, "Player")
+
+    @property
+    def player1_name(self) -> str:
+        return self.character_name("player1")
+
+    @property
+    def character1_name(self) -> str:
+        return self.character_name("character1")
+
+    @property
+    def storyline_description(self) -> str:
+        description = self.snapshot.storyline_description
+        if description is None:
+            return "There is no explicit storyline, this game is in unscripted mode."
+        return description.replace("{character_name}", self.character1_name)
+
+    @property
+    def milestones(self) -> list[MilestoneSnapshot]:
+        return self.snapshot.milestones
+
+    @property
+    def active_milestone(self) -> Optional[MilestoneSnapshot]:
+        return next((m for m in self.milestones if not m.completed), None)
+
+    @property
+    def n_completed_milestones(self) -> int:
+        return sum(m.completed for m in self.milestones)
+
+    @property
+    def goals(self) -> list[GoalSnapshot]:
+        return self.snapshot.goals
@@ -0,0 +1,300 @@
+import logging
+import os
+import time
+from contextvars import copy_context
+from queue import Queue
+from threading import Event, Thread
+from typing import Callable, Generator, Iterator, Optional, Union
+
+from token_world.llm.xplore.character_agent import (
+    generate_character_response,
+    get_classified_state_prompts,
+)
+from token_world.llm.xplore.conversation import ClassifierTask, SummaryConversation
+from token_world.llm.xplore.db import (
+    MessageModel,
+    SummaryModel,
+    add_message_to_db,
+    get_query_count,
+    session_scope,
+)
+from token_world.llm.xplore.goal_agent import (
+    prepare_goal_completion_classification,
+    prepare_goal_creation,
+)
+from token_world.llm.xplore.message_cache import invalidate_parsed_messages
+from token_world.llm.xplore.milestone_agent import prepare_milestone_classification
+from token_world.llm.xplore.summarize_agent import summarize_conversation
+from token_world.llm.xplore.telemetry import own_context, record_speculation, trace_turn
+from token_world.llm.xplore.turn_context import TurnContext
+from token_world.llm.xplore.turn_events import (
+    ClassifierChunk,
+    Notice,
+    ResponseChunk,
+    SpeculationFinished,
+    StageFinished,
+    StageStarted,
+    SummaryChunk,
+    SummaryReady,
+    TurnComplete,
+    TurnEvent,
+)
+
+ClassifierStage = tuple[
+    str, Callable[[SummaryConversation, TurnContext], Union[ClassifierTask, Notice]]
+]
+
+# Classifier stages of a turn, in rounds. The stages of a round stream concurrently and their side
+# effects are applied in order; a round is only prepared once those of the rounds before it are
+# applied. Goal creation waits for goal completion, so that it sees the goals that remain.
+CLASSIFIER_STAGES: list[list[ClassifierStage]] = [
+    [
+        ("🔖 Milestone Management", prepare_milestone_classification),
+        ("🎯 Goal Completion", prepare_goal_completion_classification),
+    ],
+    [("➕ Goal Creation", prepare_goal_creation)],
+]
+
+
+def _drain_stream(stage: str, stream: Iterator[str], chunks: Queue):
+    """Put the chunks of a classifier stream on the queue, then the error that ended it or None."""
+    try:
+        for chunk in stream:
+            chunks.put((stage, chunk))
+    except Exception as e:
+        logging.error(f"Error while streaming classifier {stage}: {e}", exc_info=True)
+        chunks.put((stage, e))
+        return
+    chunks.put((stage, None))
+
+
+def use_speculative_response() -> bool:
+    """Whether turns start the character response while the classifiers are still running."""
+    return os.getenv("XPLORE_SPECULATIVE_RESPONSE", "0") == "1"
+
+
+class SpeculativeResponse:
+    """A character response streamed on a thread with the goals and milestone from before the
+    classifiers, to be kept if the classifiers change neither of them."""
+
+    def __init__(self, conversation: SummaryConversation, context: TurnContext):
+        # Fix the state the response is written for, as the classifiers invalidate the context.
+        self.context = TurnContext.from_snapshot(context.snapshot)
+        self.state_prompts = get_classified_state_prompts(self.context)
+        self.chunks: Queue = Queue()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self._cancelled = Event()
+        # Run in a copy of the context, so that the stream is traced as part of the turn.
+        Thread(
+            target=copy_context().run,
+            args=(self._drain, generate_character_response(conversation, self.context)),
+            daemon=True,
+        ).start()
+
+    def _drain(self, stream: Iterator[str]):
+        """Put the chunks on the queue, then the error that ended the stream or None."""
+        try:
+            for chunk in stream:
+                if self._cancelled.is_set():
+                    return
+                self.chunks.put(chunk)
+        except Exception as e:
+            logging.error(f"Error while streaming the speculative response: {e}", exc_info=True)
+            self.chunks.put(e)
+            return
+        finally:
+            # Closing the stream stops the LLM from generating the rest of a cancelled response.
+            stream.close()  # type: ignore[attr-defined]
+            self.end = time.perf_counter()
+        self.chunks.put(None)
+
+    def matches(self, context: TurnContext) -> bool:
+        """Whether the response was written for the goals and milestone the turn ended with."""
+        return get_classified_state_prompts(context) == self.state_prompts
+
+    def elapsed(self) -> float:
+        """Seconds the response has been generated for so far."""
+        return (self.end or time.perf_counter()) - self.start
+
+    def cancel(self):
+        """Stop generating the response at its next chunk, unless it has finished already."""
+        if self.end is None:
+            self._cancelled.set()
+
+    def stream(self) -> Iterator[str]:
+        while (chunk := self.chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class TurnEngine:
+    """Plays the turns of a storyline without any UI, as a stream of ``turn_events``.
+
+    A turn summarizes the conversation, runs the rounds of ``CLASSIFIER_STAGES``, each with its
+    classifiers concurrent and their updates applied in order, then streams the character's
+    response and saves it. With ``speculative`` the response starts alongside the classifiers,
+    and is restarted only if they change the goals or milestone. The Streamlit app is one
+    consumer of the events; workers and benchmarks can drive the engine directly.
+    """
+
+    def __init__(self, storyline_name: str, speculative: Optional[bool] = None):
+        self.storyline_name = storyline_name
+        self.speculative = use_speculative_response() if speculative is None else speculative
+
+    def add_user_message(self, content: str) -> int:
+        with session_scope("add_user_message") as session:
+            message = add_message_to_db(
+                {"role": "user", "content": content}, session, self.storyline_name
+            )
+            return int(message.id)
+
+    def delete_messages_from(self, message_id: int):
+        """Delete the message, every later one and the summaries that covered them."""
+        logging.info(f"Deleting messages of '{self.storyline_name}' from {message_id}")
+        with session_scope("delete_messages_from") as session:
+            session.query(MessageModel).where(
+                MessageModel.storyline_name == self.storyline_name
+            ).where(MessageModel.id >= message_id).delete()
+            session.query(SummaryModel).where(
+                SummaryModel.storyline_name == self.storyline_name
+            ).where(SummaryModel.summary_until_id >= message_id).delete()
+        invalidate_parsed_messages(self.storyline_name)
+
+    def summarize(self, max_messages: int) -> Generator[SummaryChunk, None, SummaryConversation]:
+        with session_scope("summarize") as session:
+            conversation = yield from summarize_conversation(
+                session, self.storyline_name, max_messages
+            )
+            # Keep the loaded messages readable by the agents once the session is closed.
+            session.expunge_all()
+        return conversation
+
+    def run_classifiers(
+        self, summary: SummaryConversation, context: TurnContext
+    ) -> Iterator[TurnEvent]:
+        """Run the rounds of classifier stages, each after the updates of the one before it."""
+        for stages in CLASSIFIER_STAGES:
+            yield from self.run_classifier_round(stages, summary, context)
+
+    def run_classifier_round(
+        self, stages: list[ClassifierStage], summary: SummaryConversation, context: TurnContext
+    ) -> Iterator[TurnEvent]:
+        """Stream the classifiers concurrently, then apply their responses in stage order."""
+        tasks: dict[str, ClassifierTask] = {}
+        for stage, prepare in stages:
+            yield StageStarted(stage)
+            task = prepare(summary, context)
+            if isinstance(task, Notice):
+                yield task._replace(stage=stage)
+            else:
+                tasks[stage] = task
+
+        chunks: Queue = Queue()
+        for stage, task in tasks.items():
+            # Run in a copy of the context, so that the streams are traced as part of the turn.
+            Thread(
+                target=copy_context().run,
+                args=(_drain_stream, stage, task.stream, chunks),
+                daemon=True,
+            ).start()
+        responses = {stage: "" for stage in tasks}
+        errors: dict[str, Exception] = {}
+        pending = len(tasks)
+        while pending:
+            stage, chunk = chunks.get()
+            if isinstance(chunk, str):
+                responses[stage] += chunk
+                yield ClassifierChunk(stage, chunk)
+                continue
+            if chunk is not None:
+                errors[stage] = chunk
+            pending -= 1
+
+        for stage, task in tasks.items():
+            if stage in errors:
+                yield Notice("error", f"Error generating response: {errors[stage]}.", stage)
+            else:
+                logging.debug(f"Classifier {stage} response: {responses[stage]}")
+                try:
+                    for event in task.handle_response(responses[stage]):
+                        yield event._replace(stage=stage)
+                except Exception as e:
+                    logging.error(f"Error handling the {stage} response: {e}", exc_info=True)
+                    yield Notice("error", f"Error handling the response: {e}.", stage)
+            yield StageFinished(stage)
+
+    def resolve_speculation(
+        self,
+        speculation: SpeculativeResponse,
+        conversation: SummaryConversation,
+        context: TurnContext,
+    ) -> Generator[SpeculationFinished, None, Iterator[str]]:
+        """Return the speculative response if the classifiers left it valid, else a new one."""
+        hit = speculation.matches(context)
+        saved_seconds = speculation.elapsed() if hit else 0.0
+        record_speculation(hit, saved_seconds)
+        yield SpeculationFinished(hit, saved_seconds)
+        if hit:
+            logging.info(f"Keeping the speculative response, {saved_seconds:.2f}s ahead")
+            return speculation.stream()
+        logging.info("The classifiers changed the goals or milestone, restarting the response")
+        speculation.cancel()
+        return generate_character_response(conversation, context)
+
+    @own_context
+    def run_turn(
+        self, user_message: Optional[str] = None, regenerate_from: Optional[int] = None
+    ) -> Iterator[TurnEvent]:
+        """Play the next turn, optionally after adding a user message or deleting messages.
+
+        ``regenerate_from`` deletes that message and everything after it first, so that the turn
+        answers the conversation as it stood before it.
+        """
+        with trace_turn(self.storyline_name):
+            n_queries = get_query_count()
+            if regenerate_from is not None:
+                self.delete_messages_from(regenerate_from)
+            if user_message is not None:
+                self.add_user_message(user_message)
+
+            summary = yield from self.summarize(max_messages=2)
+            yield SummaryReady(summary.summary_context)
+            context = TurnContext(self.storyline_name)
+            speculation: Optional[SpeculativeResponse] = None
+            try:
+                if self.speculative:
+                    # The response's conversation does not depend on the classifiers.
+                    conversation = yield from self.summarize(max_messages=8)
+                    speculation = SpeculativeResponse(conversation, context)
+                    yield from self.run_classifiers(summary, context)
+                    response_stream = yield from self.resolve_speculation(
+                        speculation, conversation, context
+                    )
+                else:
+                    yield from self.run_classifiers(summary, context)
+                    conversation = yield from self.summarize(max_messages=8)
+                    response_stream = generate_character_response(conversation, context)
+
+                chunks = []
+                for chunk in response_stream:
+                    chunks.append(chunk)
+                    yield ResponseChunk(chunk)
+            finally:
+                # Stop a speculative response nobody will read, if the classifiers failed or
+                # the consumer closed the turn.
+                if speculation is not None:
+                    speculation.cancel()
+            response = "".join(chunks)
+            logging.debug(f"AI response: {response}")
+            with session_scope("run_turn") as session:
+                message = add_message_to_db(
+                    {"role": "assistant", "content": response}, session, self.storyline_name
+                )
+                message_id = int(message.id)
+            logging.info(
+                f"Turn loaded its context {context.n_loads} times "
+                f"and ran {get_query_count() - n_queries} queries"
+            )
+            yield TurnComplete(message_id, response)
@@ -0,0 +1,129 @@
+from typing import NamedTuple, Union
+
+# Statuses of milestone and goal updates.
+COMPLETED = "completed"
+INCOMPLETE = "incomplete"
+CREATED = "created"
+NOT_FOUND = "not found"
+ALREADY_EXISTS = "already exists"
+INVALID = "invalid"
+UNKNOWN_STATUS = "unknown status"
+
+
+class SummaryChunk(NamedTuple):
+    """Part of a summary being written, at chunk, chapter or arc level."""
+
+    level: int
+    summary_until_id: int
+    text: str
+
+
+class SummaryReady(NamedTuple):
+    """The summary the classifiers will see, once every message before them is summarized."""
+
+    summary_context: str
+
+
+class StageStarted(NamedTuple):
+    stage: str
+
+
+class ClassifierChunk(NamedTuple):
+    stage: str
+    text: str
+
+
+class MilestoneUpdate(NamedTuple):
+    milestone_name: str
+    status: str
+    # The unparsed classification, for unknown statuses.
+    detail: str = ""
+    stage: str = ""
+
+    @property
+    def level(self) -> str:
+        return {COMPLETED: "success", INCOMPLETE: "info", NOT_FOUND: "warning"}.get(
+            self.status, "error"
+        )
+
+    @property
+    def message(self) -> str:
+        if self.status == COMPLETED:
+            return f"Milestone '{self.milestone_name}' marked as completed."
+        if self.status == INCOMPLETE:
+            return f"Milestone '{self.milestone_name}' is incomplete."
+        if self.status == NOT_FOUND:
+            return f"Milestone '{self.milestone_name}' not found."
+        return f"Unknown completion status '{self.detail}' for milestone '{self.milestone_name}'."
+
+
+class GoalUpdate(NamedTuple):
+    goal_name: str
+    status: str
+    description: str = ""
+    stage: str = ""
+
+    @property
+    def level(self) -> str:
+        return {COMPLETED: "success", CREATED: "success", NOT_FOUND: "warning"}.get(
+            self.status, "error"
+        )
+
+    @property
+    def message(self) -> str:
+        if self.status == COMPLETED:
+            return f"Goal '{self.goal_name}' marked as completed."
+        if self.status == CREATED:
+            return f"Goal '{self.goal_name}' added."
+        if self.status == NOT_FOUND:
+            return f"Goal '{self.goal_name}' not found."
+        if self.status == ALREADY_EXISTS:
+            return f"Goal '{self.goal_name}' already exists."
+        return (
+            f"Goal name or description are empty: goal_name={self.goal_name!r}, "
+            f"goal_description={self.description!r}."
+        )
+
+
+class Notice(NamedTuple):
+    """A message for the player, at the level of ``st.info``, ``st.warning`` and so on."""
+
+    level: str
+    message: str
+    stage: str = ""
+
+
+class StageFinished(NamedTuple):
+    stage: str
+
+
+class SpeculationFinished(NamedTuple):
+    """Whether the character response started alongside the classifiers could be kept."""
+
+    hit: bool
+    # Seconds of the response generated before the classifiers finished, saved on a hit.
+    saved_seconds: float
+
+
+class ResponseChunk(NamedTuple):
+    text: str
+
+
+class TurnComplete(NamedTuple):
+    message_id: int
+    response: str
+
+
+TurnEvent = Union[
+    SummaryChunk,
+    SummaryReady,
+    StageStarted,
+    ClassifierChunk,
+    MilestoneUpdate,
+    GoalUpdate,
+    Notice,
+    StageFinished,
+    SpeculationFinished,
+    ResponseChunk,
+    TurnComplete,
+]